@@ -6,45 +6,56 @@
 # Authors: {svc, lucy}@dmi.uns.ac.rs
 
 import networkx as nx
+import numpy as np
 
-from Automaton import PatternGraph, learn_simple_concept_from_matrix
+from Automaton import get_pattern_graph, learn_simple_concept_from_matrix
 from HOAutomaton import learn_complex_concept
-from Matrix import parse_field, create_empty_matrix
+from Matrix import cell_id, cell_xy, cell_ids_xy, cell_str, create_empty_matrix, as_grid
 from Matrix import print_matrix, determine_first_nonempty_pixel
+from Matrix import dx, dy, OPPOSITE_LINK, MASK_DEGREE
 
 class AdvancedLearner:
     def __init__(self, concept_id, mat, automata_memory):
         self.concept_id = concept_id
-        self.mat = mat
+        self.mat = as_grid(mat)
         self.automata_memory = automata_memory
 
         # first non-empty pixel
         self.start_x, self.start_y = determine_first_nonempty_pixel(mat)
 
-        pattern_graph = PatternGraph(self.mat)
-        self.G = pattern_graph.G
+        pattern_graph = get_pattern_graph(self.mat)
+        self.G = pattern_graph.to_networkx()
+
+        # neighbour masks of nodes remaining in the pattern graph
+        self.mask = self.mat.neighbour_mask().copy()
 
     
     def max_degree(self):
-        max_d = 0
-        max_d_node = None
+        nodes = list(self.G.nodes())
+        if len(nodes) == 0:
+            return None
+        
+        xs, ys = cell_ids_xy(nodes)
+        degrees = MASK_DEGREE[self.mask[xs, ys]]
+        k = int(np.argmax(degrees))
+        return nodes[k] if degrees[k] > 0 else None
 
-        for n in self.G.nodes():
-            deg = self.G.degree(n)
-            if deg > max_d:
-                max_d = deg
-                max_d_node = n
 
-        return max_d_node 
+    def remove_node(self, n):
+        self.G.remove_node(n)
+        x, y = cell_xy(n)
+        self.mask[x, y] = 0
+        for k in range(len(dx)):
+            nei_x, nei_y = x + dx[k], y + dy[k]
+            if nei_x >= 0 and nei_x < self.mat.dimx and nei_y >= 0 and nei_y < self.mat.dimy:
+                self.mask[nei_x, nei_y] &= ~(1 << OPPOSITE_LINK[k]) & 0xFF
 
 
+    # nodes of a component are linked only to nodes in the component,
+    # so their in-degrees are read from the neighbour masks
     def is_simple_component(self, comp):
-        for n in comp:
-            indeg = self.G.in_degree(n)
-            if indeg > 2:
-                return False
-            
-        return True
+        xs, ys = cell_ids_xy(list(comp))
+        return not np.any(MASK_DEGREE[self.mask[xs, ys]] > 2)
 
 
     def check_components(self, wccs):
@@ -52,8 +63,7 @@ class AdvancedLearner:
             return False
         
         for w in wccs:
-            comp = nx.induced_subgraph(self.G, w)
-            if not self.is_simple_component(comp):
+            if not self.is_simple_component(w):
                 return False
             
         return True
@@ -67,12 +77,12 @@ class AdvancedLearner:
         while not stop:
             node_to_remove = None
             if iter == 0:
-                node_to_remove = str(self.start_x) + "-" + str(self.start_y)
+                node_to_remove = cell_id(self.start_x, self.start_y)
             else:
                 node_to_remove = self.max_degree()
 
-            print("Removing node", node_to_remove)
-            self.G.remove_node(node_to_remove)
+            print("Removing node", cell_str(node_to_remove))
+            self.remove_node(node_to_remove)
             wccs = list(nx.weakly_connected_components(self.G))
             stop = self.check_components(wccs)
             iter += 1
@@ -87,7 +97,7 @@ class AdvancedLearner:
         #print("Pattern graph to matrix")
         max_x, max_y = 0, 0
         for n in pg:
-            x, y = parse_field(n)
+            x, y = cell_xy(n)
             if x > max_x:
                 max_x = x
             if y > max_y:
@@ -97,8 +107,8 @@ class AdvancedLearner:
         mat = create_empty_matrix(dimx, dimy)
 
         for n in pg:
-            x, y = parse_field(n)
-            mat[x][y] = pg.nodes[n]["symbol"]
+            x, y = cell_xy(n)
+            mat.set_symbol(x, y, pg.nodes[n]["symbol"])
 
         return mat
 
@@ -4,13 +4,15 @@
 #
 # Authors: {svc, lucy}@dmi.uns.ac.rs
 
-from Matrix import determine_first_nonempty_pixel, parse_field, coverage, print_matrix
-from Matrix import mat_to_str
-from HOAutomaton import HOAPatRecKernel
-from Automaton import FSMPatRecKernel, PatternGraph
+from Matrix import determine_first_nonempty_pixel, cell_ids_xy, coverage, print_matrix, as_grid
+from Matrix import mat_to_str, move_name, move_names, symbol_code, MOVE_DX, MOVE_DY
+from SceneStorage import grid_to_str
+from HOAutomaton import HOAPatRecKernel, AutomatonMemo
+from Automaton import apply_fsm_multi, get_pattern_graph, deduplicate_fsms, fsm_prefix, FSMBank
 from HOAComparator import HOAComparator
 from BaseLearning import BaseLearner
 
+import numpy as np
 import networkx as nx
 
 """
@@ -142,8 +144,105 @@ class HOASimilarityNet:
             self.G.remove_node(concept)
 
 
-class AutomataMemory:
+"""
+function returns the activation key of an automaton (FSM or HOA): the code of
+its activating symbol and the first transition of its strict prefix (None if the
+prefix is empty). A HOA is activated only if the automaton of its start node is
+activated, so it gets the key of that automaton (None for HOAs without nodes)
+"""
+def activation_key(automaton):
+    # HOAs (unlike FSMs) do not have activating symbols
+    while not hasattr(automaton, "activating_symbol"):
+        if len(automaton.nodes) == 0:
+            return None
+        automaton = automaton.nodes[0].get_automaton()
+
+    prefix = fsm_prefix(automaton)
+    return symbol_code(automaton.activating_symbol), (prefix[0] if len(prefix) > 0 else None)
+
+
+"""
+Index of automata (FSMs and HOAs) by activation keys: activating symbol code ->
+(automata without the first transition, move -> symbol code -> automata), so the
+automata that can be activated at a field are found by a constant number of
+lookups (the symbol of the field and the symbols of its neighbours)
+"""
+class ActivationIndex:
     def __init__(self):
+        self.unconditional = []    # automata without activation keys
+        self.by_symbol = dict()
+        self.entries = dict()      # concept -> list of (bucket, automaton)
+
+
+    def add(self, concept, automata):
+        entries = self.entries.setdefault(concept, [])
+        for automaton in automata:
+            key = activation_key(automaton)
+            if key is None:
+                bucket = self.unconditional
+            else:
+                code, first = key
+                plain, by_move = self.by_symbol.setdefault(code, ([], dict()))
+                if first is None:
+                    bucket = plain
+                else:
+                    bucket = by_move.setdefault(first.move, dict()).setdefault(first.code, [])
+
+            bucket.append((concept, len(entries), automaton))
+            entries.append((bucket, automaton))
+
+
+    def remove(self, concept):
+        for bucket, _ in self.entries.pop(concept, []):
+            bucket[:] = [e for e in bucket if e[0] != concept]
+
+
+    def rename(self, old_concept, new_concept):
+        entries = self.entries.pop(old_concept, [])
+        for bucket, _ in entries:
+            bucket[:] = [(new_concept, k, a) if c == old_concept else (c, k, a) for c, k, a in bucket]
+
+        self.entries[new_concept] = entries
+
+
+    """
+    automata that can be activated at the field (x, y) of a matrix, it returns a map
+    from concepts to lists of (index of automaton in the concept, automaton) ordered by indices
+    """
+    def candidates(self, mat, x, y):
+        grid = as_grid(mat)
+        cells, mask = grid.data, grid.neighbour_mask()
+        found = dict()
+        if x < 0 or x >= grid.dimx or y < 0 or y >= grid.dimy:
+            return found
+
+        buckets = [self.unconditional]
+        entry = self.by_symbol.get(cells.item(x, y))
+        if entry is not None:
+            plain, by_move = entry
+            buckets.append(plain)
+            moves = mask.item(x, y)
+            for move, by_code in by_move.items():
+                if moves >> move & 1:
+                    bucket = by_code.get(cells.item(x + MOVE_DX[move], y + MOVE_DY[move]))
+                    if bucket is not None:
+                        buckets.append(bucket)
+
+        for bucket in buckets:
+            for concept, k, automaton in bucket:
+                found.setdefault(concept, []).append((k, automaton))
+
+        for concept in found:
+            found[concept].sort(key=lambda e: e[0])
+
+        return found
+
+
+class AutomataMemory:
+    # with deduplicate_fsms FSMs of base concepts equivalent to FSMs already stored
+    # for the concept or to other FSMs learned from the same pattern (Automaton.deduplicate_fsms)
+    # are not added to the memory
+    def __init__(self, deduplicate_fsms=False):
         self.automata = dict()       # map from concepts to automata recognizing concepts
         self.patterns = dict()       # map from concepts to patterns used to learn concepts
         self.base_concepts = set()   # concepts recognized by base automata
@@ -154,6 +253,11 @@ class AutomataMemory:
 
         self.partially_activated_hoa = []
 
+        self.deduplicate_fsms = deduplicate_fsms
+        self.fsm_bank = FSMBank()     # FSMs of base concepts indexed by their prefixes
+        self.activation_index = ActivationIndex()    # all automata indexed by activation keys
+        self.eliminated_fsms = 0     # number of FSMs eliminated by deduplication
+
         self.inheritance_tree = HOAInheritanceTree()
         self.dependency_net = DependencyNet()
         self.similarity_net = HOASimilarityNet()
@@ -163,6 +267,20 @@ class AutomataMemory:
     concept - string, automata -- list of automata
     """
     def add_automata_to_memory(self, concept, base_concept, automata, pattern_matrix):
+        if base_concept and self.deduplicate_fsms:
+            automata, eliminated = deduplicate_fsms(automata, self.automata.get(concept), pattern_matrix)
+            if eliminated > 0:
+                self.eliminated_fsms += eliminated
+                print("[AutomataMemory] equivalent FSMs of concept", concept, "eliminated:", eliminated)
+
+            # nothing new to add for a known concept
+            if len(automata) == 0 and concept in self.automata:
+                return
+
+        if base_concept:
+            self.fsm_bank.add(concept, automata)
+        self.activation_index.add(concept, automata)
+
         if concept in self.automata:
             self.automata[concept].extend(automata)
             self.patterns[concept].extend(pattern_matrix)
@@ -227,6 +345,12 @@ class AutomataMemory:
         return self.automata
 
 
+    # automata that can be activated at the field (x, y) of a matrix (map from concepts
+    # to lists of (index of automaton in the concept, automaton), see ActivationIndex)
+    def candidate_automata(self, matrix, x, y):
+        return self.activation_index.candidates(matrix, x, y)
+
+
     def get_concept_id_for_unknown(self, base_concept):
         concept_type = "FSM" if base_concept else "HOA"
         num = len(self.unknown_base_concepts) if base_concept else len(self.unknown_hoa_concepts)
@@ -250,17 +374,19 @@ class AutomataMemory:
         if first_pixel == None:
             return []
 
+        # sub-automata results are shared by kernels of all HOAs
+        memo = AutomatonMemo(matrix)
         for hoa_concept in self.hoa_concepts:
             hoas = self.automata[hoa_concept]
             for hoa in hoas:
-                prk = HOAPatRecKernel(hoa, matrix, first_pixel[0], first_pixel[1])
+                prk = HOAPatRecKernel(hoa, memo.grid, first_pixel[0], first_pixel[1], memo)
                 rec, _, visited_fields = prk.apply()
 
                 ac_score = prk.activation_score()
                 if ac_score > 0:
                     self.partially_activated_hoa.append((hoa_concept, hoa, prk, ac_score))
 
-                if rec and coverage(visited_fields, matrix):
+                if rec and coverage(prk.all_visited_set, matrix):
                     sat.append((hoa_concept, hoa))
                     if return_only_first:
                         return sat
@@ -272,20 +398,48 @@ class AutomataMemory:
         return self.partially_activated_hoa
 
 
+    """
+    FSMs of base concepts are applied from start fields (xs, ys): at each field only
+    FSMs selected by the FSM bank are applied, and each FSM is applied from all its
+    start fields at once. It returns a map from (concept, index of FSM in the concept,
+    index of start field) to (recognized, visited fields)
+    """
+    def apply_base_automata(self, matrix, xs, ys, with_visited=False):
+        grid = as_grid(matrix)
+        xs, ys = np.asarray(xs, dtype=np.int64), np.asarray(ys, dtype=np.int64)
+
+        fsm_starts = dict()
+        for i in range(len(xs)):
+            for concept, fsms in self.fsm_bank.candidates(grid, int(xs[i]), int(ys[i])).items():
+                for k, _ in fsms:
+                    fsm_starts.setdefault((concept, k), []).append(i)
+
+        results = dict()
+        for (concept, k), starts in fsm_starts.items():
+            _, _, rec, _, visited = apply_fsm_multi(self.automata[concept][k], grid, xs[starts], ys[starts], with_visited)
+            for n in range(len(starts)):
+                results[(concept, k, starts[n])] = (bool(rec[n]), visited[n] if with_visited else None)
+
+        return results
+
+
     def retrieve_satisfiable_basic_concepts(self, matrix, return_only_first=False):
         sat = []
 
-        pg = PatternGraph(matrix)
+        pg = get_pattern_graph(matrix)
         starts = pg.start_nodes
-        for start in starts:
-            x, y = parse_field(start)
+        if len(starts) == 0:
+            return sat
+
+        xs, ys = cell_ids_xy(starts)
+        results = self.apply_base_automata(matrix, xs, ys, with_visited=True)
+
+        for i in range(len(starts)):
             for base_concept in self.base_concepts:
-                fsms = self.automata[base_concept]
-                for fsm in fsms:
-                    pkr = FSMPatRecKernel(fsm, matrix, x, y)
-                    rec, _, visited_fields = pkr.apply()
-                    if rec and coverage(visited_fields, matrix):
-                        sat.append((base_concept, pkr))
+                for k in range(len(self.automata[base_concept])):
+                    res = results.get((base_concept, k, i))
+                    if res is not None and res[0] and coverage(res[1], matrix):
+                        sat.append((base_concept, self.automata[base_concept][k]))
                         if return_only_first:
                             return sat
                     
@@ -333,6 +487,9 @@ class AutomataMemory:
                 a.print()
                 print()
 
+        if self.deduplicate_fsms:
+            print("#FSMs eliminated by deduplication", self.eliminated_fsms)
+
         self.inheritance_tree.info()
         self.dependency_net.info()
         self.similarity_net.info()
@@ -352,6 +509,7 @@ class AutomataMemory:
             self.base_concepts.remove(unsupervised_name)
             self.base_concepts.add(supervised_name)
             self.unknown_base_concepts.remove(unsupervised_name)
+            self.fsm_bank.rename(unsupervised_name, supervised_name)
         else:
             self.hoa_concepts.remove(unsupervised_name)
             self.hoa_concepts.add(supervised_name)
@@ -365,6 +523,8 @@ class AutomataMemory:
             for a in automata:
                 a.change_concept_name(supervised_name)
 
+        self.activation_index.rename(unsupervised_name, supervised_name)
+
         print("[AutomataMemory] unsupervised concept " + unsupervised_name + " reconfigured to " + supervised_name)
 
 
@@ -415,11 +575,13 @@ class AutomataMemory:
         base_concept = c in self.base_concepts
         if base_concept:
             self.base_concepts.remove(c)
+            self.fsm_bank.remove(c)
         else:
             self.hoa_concepts.remove(c)
 
         del self.automata[c]
         del self.patterns[c]
+        self.activation_index.remove(c)
 
         self.inheritance_tree.remove_node(c)
         self.dependency_net.remove_node(c)
@@ -441,13 +603,16 @@ class AutomataMemory:
     # convert automata memory to networkx digraph 
     #
 
-    def convert_to_big_digraph(self):
+    def convert_to_big_digraph(self, binary_patterns=False):
         big_G = nx.DiGraph()
 
         for concept in self.automata:
             is_fsm = concept in self.base_concepts
             autos = self.automata[concept]
-            pattern_matrix = mat_to_str(self.patterns[concept][0])
+            if binary_patterns:
+                pattern_matrix = grid_to_str(self.patterns[concept][0])
+            else:
+                pattern_matrix = mat_to_str(self.patterns[concept][0])
             #print(concept, is_fsm)
             #print(pattern)
             
@@ -518,7 +683,7 @@ class AutomataMemory:
                     dst_id = node_id_map[dst.get_id()]
                     move_type = hoa_G.edges[link]["move_type"]
                     constraints = hoa_G.edges[link]["constraints"]
-                    big_G.add_edge(src_id, dst_id, link_type="HOA_TRANSITION", move_type=str(move_type), constraints=str(constraints))
+                    big_G.add_edge(src_id, dst_id, link_type="HOA_TRANSITION", move_type=move_name(move_type), constraints=str(move_names(constraints)))
 
 
         """
@@ -6,49 +6,53 @@
 #
 # Authors: {svc, lucy}@dmi.uns.ac.rs
 
+import os
 import sys
+import hashlib
+import numpy as np
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 import networkx as nx
-from Matrix import dx, dy, link_type, load_matrix
+from Matrix import link_type, load_matrix, as_grid, as_sparse, symbol_code, code_symbol
+from Matrix import MOVE_DX, MOVE_DY, MOVE_EMPTY, MASK_DEGREE, move_code, move_name, neigh_move
+from Matrix import cell_id, cell_ids, cell_ids_xy, cell_str, cells_str
 
 
 """
 Objects of PatternGraph are pattern graphs. Nodes in pattern
 graphs are non-empty symbols in the pattern matrix identified by 
 their coordinates, while two nodes are connected if they are
-adjacent considering the Moore neighboorhood
+adjacent considering the Moore neighboorhood.
+Pattern graphs are kept in arrays: nodes are indexed in the row-major
+order of the pattern, links of a node are kept in the order of link types
+(adj_start, adj_dst, adj_move -- CSR form), networkx graphs are built
+only on request (to_networkx)
 """
 class PatternGraph:
     def __init__(self, mat):
         # a concept is simple if its pattern graph has clear starting nodes for FSM-based pattern recognition
         self.simple_concept = True
 
-        dimx = len(mat)
-        dimy = len(mat[0])
-
-        self.G = nx.DiGraph()
-        self.first_node = None
-
-        for i in range(dimx):
-            for j in range(dimy):
-                if mat[i][j] != ' ':
-                    node_id = str(i) + "-" + str(j)
-                    self.G.add_node(node_id, x=i, y=j, symbol=mat[i][j])
-                    if self.first_node == None:
-                        self.first_node = node_id
-
-        for i in range(dimx):
-            for j in range(dimy):
-                if mat[i][j] != ' ':
-                    current_id = str(i) + "-" + str(j)
-                    for k in range(len(dx)):
-                        nei_x = i + dx[k]
-                        nei_y = j + dy[k]
-                        in_range = nei_x >= 0 and nei_x < dimx and nei_y >= 0 and nei_y < dimy
-                        if in_range and mat[nei_x][nei_y] != ' ':
-                            nei_id = str(nei_x) + "-" + str(nei_y)
-                            self.G.add_edge(current_id, nei_id, link_type=link_type[k])
-
-        self.connected = nx.is_connected(self.G.to_undirected())
+        # nodes and links are taken from the sparse form of the pattern
+        # (in row-major order), so the cost does not depend on the pattern area
+        scene = as_sparse(mat)
+        ids = scene.ids.tolist()
+        self.node_ids = tuple(ids)
+        self.node_index = {ids[i] : i for i in range(len(ids))}
+        self.xs, self.ys = tuple(scene.xs.tolist()), tuple(scene.ys.tolist())
+        self.symbols = tuple(code_symbol(c) for c in scene.codes.tolist())
+        self.node_masks = scene.neighbour_masks().copy()
+        self.node_masks.setflags(write=False)
+        self.first_node = ids[0] if len(ids) > 0 else None
+
+        # links are ordered by source nodes and then by link types
+        src, dst, types = scene.links()
+        self.adj_start = tuple(np.searchsorted(src, np.arange(len(ids) + 1)).tolist())
+        self.adj_dst = tuple(dst.tolist())
+        self.adj_move = tuple(types.tolist())
+        self._bfs_order = None
+
+        self.connected = self.is_connected()
         if not self.connected:
             # print("[PatternGraph, error] Pattern not connected")
             self.simple_concept = False
@@ -66,140 +70,364 @@ class PatternGraph:
         return self.simple_concept
 
 
+    def num_nodes(self):
+        return len(self.node_ids)
+
+
+    def symbol(self, node):
+        return self.symbols[self.node_index[node]]
+
+
+    # move code of the link from node a to node b
+    def move(self, a, b):
+        return neigh_move(b, a)[1]
+
+
+    # neighbours of a node in the order of link types
+    def neighbors(self, node):
+        i = self.node_index[node]
+        return [self.node_ids[n] for n in self.adj_dst[self.adj_start[i]:self.adj_start[i + 1]]]
+
+
+    # BFS edges (as nx.bfs_edges for the networkx form of the graph)
+    def bfs_edges(self, node):
+        ids, adj_start, adj_dst = self.node_ids, self.adj_start, self.adj_dst
+        start = self.node_index[node]
+        visited = bytearray(len(ids))
+        visited[start] = 1
+        queue = [start]
+        head = 0
+        while head < len(queue):
+            curr = queue[head]
+            head += 1
+            for n in adj_dst[adj_start[curr]:adj_start[curr + 1]]:
+                if not visited[n]:
+                    visited[n] = 1
+                    queue.append(n)
+                    yield ids[curr], ids[n]
+
+
+    # nodes in the order of BFS links from the first node (a tuple computed once, the graph is not modified)
+    def bfs_order(self):
+        if self._bfs_order is None:
+            order = []
+            if self.first_node is not None:
+                for src, dst in self.bfs_edges(self.first_node):
+                    if len(order) == 0:
+                        order.append(src)
+                    order.append(dst)
+            self._bfs_order = tuple(order)
+
+        return self._bfs_order
+
+
+    # links are symmetric, so the graph is connected if BFS reaches all nodes
+    def is_connected(self):
+        if self.first_node is None:
+            return False
+        
+        reached = 1 + sum(1 for _ in self.bfs_edges(self.first_node))
+        return reached == len(self.node_ids)
+
+
+    def to_networkx(self):
+        G = nx.DiGraph()
+        for i in range(len(self.node_ids)):
+            G.add_node(self.node_ids[i], x=self.xs[i], y=self.ys[i], symbol=self.symbols[i])
+
+        for i in range(len(self.node_ids)):
+            for e in range(self.adj_start[i], self.adj_start[i + 1]):
+                k = self.adj_move[e]
+                G.add_edge(self.node_ids[i], self.node_ids[self.adj_dst[e]], link_type=link_type[k], move=k)
+
+        return G
+
+
+    # in-degrees of nodes are the numbers of set bits in their neighbour masks,
+    # start nodes are returned as a tuple (pattern graphs are shared)
     def determine_start_nodes(self):
         sn = []
-        for n in self.G.nodes():
-            indeg = self.G.in_degree(n)
+        degrees = MASK_DEGREE[self.node_masks].tolist()
+        for n, indeg in zip(self.node_ids, degrees):
             if indeg == 0:
                 print("[PatternGraph, warning] found node with in-degree 0")
             elif indeg == 1:
                 sn.append(n)
 
-        return sn
+        return tuple(sn)
 
 
     def print(self):
         print("\nPattern graph:")
-        for n in self.G.nodes():
-            print(n, self.G.nodes[n]["x"], self.G.nodes[n]["y"], self.G.nodes[n]["symbol"])
+        for i in range(len(self.node_ids)):
+            print(cell_str(self.node_ids[i]), self.xs[i], self.ys[i], self.symbols[i])
         
-        for l in self.G.edges():
-            print(l, self.G.edges[l]["link_type"])
+        for i in range(len(self.node_ids)):
+            for e in range(self.adj_start[i], self.adj_start[i + 1]):
+                l = (self.node_ids[i], self.node_ids[self.adj_dst[e]])
+                print(tuple(cells_str(l)), link_type[self.adj_move[e]])
+
+
+"""
+DFS of a pattern graph decomposing the graph into sequences (walks without
+branching) for FSM learning. The DFS state is kept by the walker, so shared
+(cached) pattern graphs are not modified
+"""
+class PatternGraphDFS:
+    def __init__(self, pattern_graph):
+        self.pattern_graph = pattern_graph
 
 
+    # DFS works on node indices, sequences and DFS parents are returned as node ids
     def dfs(self, node, verbose_results=False):
-        self.visited = set()
+        pg = self.pattern_graph
+        n = len(pg.node_ids)
+        self.visited = bytearray(n)
+        self.parent = [-1] * n
+        self.visit_order = []
         self.sequences = []
         self.return_back = [None]
         self.sequence = []
-        self.dfs_parent = dict()
         
-        self.visited.add(node)
-        self.dfs_parent[node] = None
-        self.dfsRec(node)
+        start = pg.node_index[node]
+        self.visited[start] = 1
+        self.visit_order.append(start)
+        self.dfsIter(start)
+
+        ids = pg.node_ids
+        self.sequences = [[ids[i] for i in s] for s in self.sequences]
+        self.dfs_parent = dict()
+        for i in self.visit_order:
+            self.dfs_parent[ids[i]] = None if self.parent[i] == -1 else ids[self.parent[i]]
         
         if verbose_results:
             print("Sequences")
             for s in self.sequences:
-                print(s)
+                print(cells_str(s))
 
             for i in range(len(self.sequences)):
                 s = self.sequences[i]
-                print("\nSequence ", s, " index = ", i)
+                print("\nSequence ", cells_str(s), " index = ", i)
             
                 if i > 0:
                     curr = s[0]
-                    curr_symbol = self.G.nodes[curr]["symbol"]
+                    curr_symbol = pg.symbol(curr)
 
                     prev = self.dfs_parent[curr]
-                    prev_symbol = self.G.nodes[prev]["symbol"]
+                    prev_symbol = pg.symbol(prev)
 
-                    move = self.G.edges[prev, curr]["link_type"]
-                    print("PREV = ", prev)
+                    move = move_name(pg.move(prev, curr))
+                    print("PREV = ", cell_str(prev))
                     print("RETURN_BACK_SEQUENCE = ", self.return_back[i])
                     print("Sequence transition: ", move, prev_symbol, curr_symbol)
             
                 for i in range(0, len(s) - 1):
                     curr = s[i]
-                    curr_symbol = self.G.nodes[curr]["symbol"]
+                    curr_symbol = pg.symbol(curr)
                     next = s[i + 1]
-                    next_symbol = self.G.nodes[next]["symbol"]
-                    move = self.G.edges[curr, next]["link_type"]
+                    next_symbol = pg.symbol(next)
+                    move = move_name(pg.move(curr, next))
 
                     print("Transition: ", move, curr_symbol, next_symbol)
 
         return self.sequences, self.dfs_parent, self.return_back    
 
 
-    def dfsRec(self, curr):
-        self.sequence.append(curr)
-        sequence_index = len(self.sequences)
-        prev = self.dfs_parent[curr]
-        transition_move = None
-        if prev != None:
-            transition_move = self.G.edges[prev, curr]["link_type"]
-
-        neis = self.G.neighbors(curr)
-        
-        last_append = None
-        move_forward = []
-        for n in neis:
-            if not n in self.visited:
-                forward_move = self.G.edges[curr, n]["link_type"]
-                if transition_move != None and forward_move == transition_move:
-                    last_append = n
+    """
+    DFS with an explicit stack: walking along a sequence is a loop, while
+    branching nodes push their not yet visited forward neighbours, so the
+    recursion limit does not bound the size of patterns
+    """
+    def dfsIter(self, start):
+        pg = self.pattern_graph
+        adj_start, adj_dst, adj_move = pg.adj_start, pg.adj_dst, pg.adj_move
+        ids, visited, parent = pg.node_ids, self.visited, self.parent
+
+        # stack of branching nodes: (sequence index, iterator over forward neighbours, node)
+        stack = []
+        curr = start
+        while curr is not None:
+            self.sequence.append(curr)
+            sequence_index = len(self.sequences)
+            prev = parent[curr]
+            transition_move = None
+            if prev != -1:
+                transition_move = neigh_move(ids[curr], ids[prev])[1]
+
+            last_append = None
+            move_forward = []
+            for e in range(adj_start[curr], adj_start[curr + 1]):
+                n = adj_dst[e]
+                if not visited[n]:
+                    if transition_move != None and adj_move[e] == transition_move:
+                        last_append = n
+                    else:
+                        move_forward.append(n)
+            
+            if last_append != None:
+                move_forward.append(last_append)
+
+            nmf = len(move_forward)
+            if nmf == 1:
+                fnode = move_forward[0]
+                visited[fnode] = 1
+                self.visit_order.append(fnode)
+                parent[fnode] = curr
+                curr = fnode
+                continue
+
+            self.sequences.append(self.sequence)
+            self.sequence = []
+            if nmf > 1:
+                stack.append((sequence_index, iter(move_forward), curr))
+
+            # continue from the first branching node with a not visited forward neighbour
+            curr = None
+            while len(stack) > 0 and curr is None:
+                sequence_index, neis, branch = stack[-1]
+                for n in neis:
+                    if not visited[n]:
+                        self.return_back.append(sequence_index)
+                        visited[n] = 1
+                        self.visit_order.append(n)
+                        parent[n] = branch
+                        curr = n
+                        break
                 else:
-                    move_forward.append(n)
+                    stack.pop()
+
+
+"""
+key of a pattern in PatternGraphCache: content hash of the pattern
+dimensions, its non-empty fields and their symbol codes
+"""
+def pattern_key(mat):
+    scene = as_sparse(mat)
+    h = hashlib.blake2b(digest_size=16)
+    h.update(np.array([scene.dimx, scene.dimy], dtype=np.int64).tobytes())
+    h.update(np.ascontiguousarray(scene.ids, dtype=np.int64).tobytes())
+    h.update(np.ascontiguousarray(scene.codes, dtype=np.uint32).tobytes())
+    return h.digest()
+
+
+"""
+LRU cache of pattern graphs keyed by content hashes of patterns, so the
+same pattern graph (with its start nodes and BFS order) is built once per
+pattern. Cached pattern graphs are shared and must not be modified
+(to_networkx gives a private networkx copy)
+"""
+class PatternGraphCache:
+    def __init__(self, max_size=256):
+        self.max_size = max_size
+        self.graphs = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+
+    def get(self, mat):
+        scene = as_sparse(mat)
+        key = pattern_key(scene)
+
+        pg = self.graphs.get(key)
+        if pg is not None:
+            self.hits += 1
+            self.graphs.move_to_end(key)
+            return pg
         
-        if last_append != None:
-            move_forward.append(last_append)
+        self.misses += 1
+        pg = PatternGraph(scene)
+        self.graphs[key] = pg
+        while len(self.graphs) > self.max_size:
+            self.graphs.popitem(last=False)
 
-        nmf = len(move_forward)
-        if nmf == 0:
-            self.sequences.append(self.sequence.copy())
-            self.sequence = []
-        elif nmf == 1:
-            fnode = move_forward[0]
-            self.visited.add(fnode)
-            self.dfs_parent[fnode] = curr
-            self.dfsRec(fnode)
-        else:
-            self.sequences.append(self.sequence.copy())
-            for n in move_forward:
-                if not n in self.visited:
-                    self.sequence = []
-                    self.return_back.append(sequence_index)
-                    self.visited.add(n)
-                    self.dfs_parent[n] = curr
-                    self.dfsRec(n)
+        return pg
 
 
-class FSMSymbol:
-    def __init__(self, move, next_symbol):
-        self.move = move
-        self.next_symbol = next_symbol
+    def clear(self):
+        self.graphs.clear()
+        self.hits = 0
+        self.misses = 0
 
-    def __eq__(self, other):
-        return self.next_symbol == other.next_symbol and self.move == other.move
-    
-    def __ne__(self, other):
-        return not self.__eq__(other)
+
+    def stats(self):
+        return {"size" : len(self.graphs), "max_size" : self.max_size, "hits" : self.hits, "misses" : self.misses}
+
+
+    def print_stats(self):
+        lookups = self.hits + self.misses
+        hit_rate = self.hits / lookups if lookups > 0 else 0.0
+        print("PatternGraphCache: size", len(self.graphs), "/", self.max_size, "hits", self.hits, "misses", self.misses, "hit rate", round(hit_rate, 3))
+
+
+# pattern graph cache shared by learners and inference
+pattern_graph_cache = PatternGraphCache()
+
+
+"""
+function returns the (shared) pattern graph of a matrix from the pattern graph cache
+"""
+def get_pattern_graph(mat):
+    return pattern_graph_cache.get(mat)
+
+
+"""
+FSM transition symbol: move code and the symbol expected after the move,
+moves can be given by their string forms (e.g. when restored from database).
+FSM symbols are interned: there is one immutable instance per (move, symbol)
+pair, so they are compared by identity and their ids (indices in
+fsm_symbol_table, local to the process) can be used as array indices
+"""
+class FSMSymbol:
+    __slots__ = ("move", "next_symbol", "code", "id")
+
+    def __new__(cls, move, next_symbol):
+        if isinstance(move, str):
+            move = move_code(move)
+
+        sym = _fsm_symbols.get((move, next_symbol))
+        if sym is None:
+            sym = object.__new__(cls)
+            object.__setattr__(sym, "move", move)
+            object.__setattr__(sym, "next_symbol", next_symbol)
+            # code of the expected symbol (-1 for the empty transition)
+            object.__setattr__(sym, "code", symbol_code(next_symbol) if len(next_symbol) == 1 else -1)
+            object.__setattr__(sym, "id", len(fsm_symbol_table))
+            _fsm_symbols[(move, next_symbol)] = sym
+            fsm_symbol_table.append(sym)
+
+        return sym
+
+    def __setattr__(self, name, value):
+        raise Exception("[ERROR, FSMSymbol] FSM symbols are immutable")
+
+    # unpickled symbols are interned in the receiving process
+    def __reduce__(self):
+        return (FSMSymbol, (self.move, self.next_symbol))
     
     def __str__(self):
-        return "<" + self.move + "," + self.next_symbol + ">"
+        return "<" + move_name(self.move) + "," + self.next_symbol + ">"
+
+
+# interning table of FSM symbols: (move, symbol) -> FSMSymbol, and FSM symbols by ids
+_fsm_symbols = dict()
+fsm_symbol_table = []
 
 
-EMPTY_FSM_SYMBOL = FSMSymbol('EMPTY', '')    
+EMPTY_FSM_SYMBOL = FSMSymbol(MOVE_EMPTY, '')    
 
 
 class FSMState:
-    def __init__(self, name):
+    # fsm -- FSM owning the state (its compiled form is invalidated by new transitions)
+    def __init__(self, name, fsm=None):
         self.name = name
         self.transitions = []
+        self.fsm = fsm
 
 
     def add_transition(self, fsm_symbol, next_state):
         self.transitions.append((fsm_symbol, next_state))
+        if self.fsm is not None:
+            self.fsm._compiled = None
 
 
     def print(self):
@@ -213,14 +441,24 @@ class FSM:
         self.activating_symbol = activating_symbol
         self.num_states = 0
         self.states = []
+        self._compiled = None
         
 
     def create_state(self):
         name = "S_" + str(self.num_states)
         self.num_states += 1
-        state = FSMState(name)
+        state = FSMState(name, self)
         self.states.append(state)
+        self._compiled = None
         return state 
+
+
+    # compiled form of the FSM (built on the first use after a change of the FSM)
+    def compile(self):
+        if self._compiled is None:
+            self._compiled = CompiledFSM(self)
+
+        return self._compiled
     
 
     def print(self):
@@ -236,15 +474,179 @@ class FSM:
         self.fsm_id = id
 
 
+    # flat form for pickling (e.g. FSMs learned by worker processes): states are
+    # given by names and transitions (fsm symbol, index of the next state), so
+    # long chains of states do not hit the recursion limit of pickle
+    def __getstate__(self):
+        index = {self.states[i] : i for i in range(len(self.states))}
+        state = {k : v for k, v in self.__dict__.items() if k not in ("states", "_compiled")}
+        state["state_names"] = [s.name for s in self.states]
+        state["transitions"] = [[(sym, index[ns]) for sym, ns in s.transitions] for s in self.states]
+        return state
+
+
+    def __setstate__(self, state):
+        names = state.pop("state_names")
+        transitions = state.pop("transitions")
+        self.__dict__.update(state)
+        self._compiled = None
+        self.states = [FSMState(name, self) for name in names]
+        for s, trans in zip(self.states, transitions):
+            for sym, i in trans:
+                s.add_transition(sym, self.states[i])
+
+
+    """
+    canonical form of the FSM: bisimilar states (states with equal transitions
+    to equivalent states and equal self-loops, found by partition refinement)
+    are merged, merged states are renumbered in BFS order from the start state
+    following transitions in their order (unreachable states follow in the
+    order of creation), transitions are given as (symbol id, state number) pairs.
+    FSMs with equal canonical forms take the same transitions in FSMPatRecKernel,
+    only the check that all states are activated (at the end of a run without
+    feasible and empty transitions) counts states before merging
+    """
+    def canonical_form(self):
+        states = self.states
+        index = {states[i] : i for i in range(len(states))}
+        trans = [[(sym.id, index[ns]) for sym, ns in s.transitions] for s in states]
+
+        # refine blocks of states until transitions of states in a block lead to equal blocks
+        block = [0] * len(states)
+        num_blocks = 1 if len(states) > 0 else 0
+        while True:
+            signatures = dict()
+            refined = [signatures.setdefault((block[i], tuple((sym, block[ns], ns == i) for sym, ns in trans[i])), len(signatures)) 
+                for i in range(len(states))]
+            block = refined
+            if len(signatures) == num_blocks:
+                break
+            num_blocks = len(signatures)
+
+        # the first state of a block represents the block
+        first = dict()
+        for i in range(len(states)):
+            first.setdefault(block[i], i)
+
+        number = dict()
+        order = []
+        for i in range(min(1, len(states))):
+            number[block[i]] = 0
+            order.append(block[i])
+
+        head = 0
+        while head < len(order):
+            for _, ns in trans[first[order[head]]]:
+                if block[ns] not in number:
+                    number[block[ns]] = len(order)
+                    order.append(block[ns])
+            head += 1
+
+        for i in range(len(states)):
+            if block[i] not in number:
+                number[block[i]] = len(order)
+                order.append(block[i])
+
+        canonical = tuple(tuple((sym, number[block[ns]]) for sym, ns in trans[first[b]]) for b in order)
+        return self.activating_symbol, canonical
+
+
+"""
+coverage of a pattern by an FSM: fields visited by the runs of the FSM
+recognizing the pattern from its start fields (xs, ys)
+"""
+def fsm_coverage(fsm, pattern_matrix, xs, ys):
+    _, _, recognized, _, visited = apply_fsm_multi(fsm, pattern_matrix, xs, ys, with_visited=True)
+    covered = set()
+    for r in np.flatnonzero(recognized).tolist():
+        covered.update(visited[r])
+
+    return frozenset(covered)
+
+
+"""
+function drops FSMs equivalent to an already kept FSM (kept -- FSMs kept before,
+e.g. FSMs of the concept in the automata memory): FSMs with equal canonical forms
+and, if the pattern of the concept is given, FSMs whose coverage of the pattern
+is contained in the coverage of a kept FSM, so the pattern is still recognized
+by kept FSMs. FSMs covering more fields are kept first. The function returns the
+list of kept FSMs from fsms (in their order) and the number of eliminated FSMs
+"""
+def deduplicate_fsms(fsms, kept=None, pattern_matrix=None):
+    if kept is None:
+        kept = []
+
+    forms = set(fsm.canonical_form() for fsm in kept)
+
+    coverages = None
+    if pattern_matrix is not None:
+        pg = get_pattern_graph(pattern_matrix)
+        if pg.is_concept_simple():
+            xs, ys = cell_ids_xy(pg.start_nodes)
+            coverages = [fsm_coverage(fsm, pattern_matrix, xs, ys) for fsm in fsms]
+            kept_coverages = [fsm_coverage(fsm, pattern_matrix, xs, ys) for fsm in kept]
+
+    order = list(range(len(fsms)))
+    if coverages is not None:
+        order.sort(key=lambda i: -len(coverages[i]))
+
+    unique = set()
+    for i in order:
+        form = fsms[i].canonical_form()
+        if form in forms:
+            continue
+
+        if coverages is not None:
+            if any(coverages[i] <= c for c in kept_coverages):
+                continue
+            kept_coverages.append(coverages[i])
+
+        forms.add(form)
+        unique.add(i)
+
+    return [fsms[i] for i in range(len(fsms)) if i in unique], len(fsms) - len(unique)
+
+
+"""
+function returns integer ids of fsm symbols in a sequence
+(equal symbols get equal ids since symbols are interned)
+"""
+def fsmsymbol_ids(s):
+    return [sym.id for sym in s]
+
+
+"""
+function returns the smallest period p < len(ids) such that the sequence
+is a repetition of its first p elements (0 if there is no such period),
+the period is obtained from the prefix function (KMP) in linear time
+"""
+def repetition_period(ids):
+    n = len(ids)
+    if n == 0:
+        return 0
+    
+    pi = [0] * n
+    k = 0
+    for i in range(1, n):
+        while k > 0 and ids[i] != ids[k]:
+            k = pi[k - 1]
+        if ids[i] == ids[k]:
+            k += 1
+        pi[i] = k
+
+    p = n - pi[-1]
+    return p if p < n and n % p == 0 else 0
+
+
 class FSMLearner:
     def __init__(self, pattern_graph, start_node, verbose=False):
         self.pattern_graph = pattern_graph
         self.start_node = start_node
-        self.sequences, self.dfs_parent, self.return_back = self.pattern_graph.dfs(start_node, verbose_results=verbose)
+        self.sequences, self.dfs_parent, self.return_back = PatternGraphDFS(pattern_graph).dfs(start_node, verbose_results=verbose)
         
 
     def learn(self):
-        activating_symbol = self.pattern_graph.G.nodes[self.start_node]["symbol"]
+        activating_symbol = self.pattern_graph.symbol(self.start_node)
         self.fsm = FSM(activating_symbol)
         self.start_states = []
         self.end_states = []
@@ -264,9 +666,10 @@ class FSMLearner:
                 self.start_states.append(singleton_state)
                 self.end_states.append(singleton_state)
             else:
-                repetition_period = self.is_repetition_sequence(fsmsym_seq) 
+                fsmsym_ids = fsmsymbol_ids(fsmsym_seq)
+                repetition_period = self.is_repetition_sequence(fsmsym_seq, fsmsym_ids) 
                 if repetition_period == 0:
-                    red_seq, rep = self.reduce_fsmsymbol_sequence(fsmsym_seq)
+                    red_seq, rep = self.reduce_fsmsymbol_sequence(fsmsym_seq, fsmsym_ids)
                     
                     for i in range(len(red_seq) + 1):
                         local_states.append(self.fsm.create_state())
@@ -315,8 +718,8 @@ class FSMLearner:
         for i in range(0, len(s) - 1):
             curr = s[i]
             next = s[i + 1]
-            next_symbol = self.pattern_graph.G.nodes[next]["symbol"]
-            move = self.pattern_graph.G.edges[curr, next]["link_type"]
+            next_symbol = self.pattern_graph.symbol(next)
+            move = self.pattern_graph.move(curr, next)
 
             symbol_seq.append(FSMSymbol(move, next_symbol))
 
@@ -324,73 +727,46 @@ class FSMLearner:
     
 
     # identify consecutive repetitions in fsmsymbol sequences
-    # (those repetitions are represented by loops in FSMs)
-    def reduce_fsmsymbol_sequence(self, s):
+    # (those repetitions are represented by loops in FSMs),
+    # symbols are compared by their ids (ids -- fsmsymbol_ids(s) if already computed)
+    def reduce_fsmsymbol_sequence(self, s, ids=None):
+        if ids is None:
+            ids = fsmsymbol_ids(s)
+
         length = len(s)
         i = 0
         symbol_seq = []
         repetition = []
         
         while i < length:
-            curr = s[i]
-            if i < length - 1 and s[i + 1] == curr:
-                symbol_seq.append(curr)
+            curr = ids[i]
+            symbol_seq.append(s[i])
+            if i < length - 1 and ids[i + 1] == curr:
                 repetition.append(True)
-                while i < length and s[i] == curr:
+                while i < length and ids[i] == curr:
                     i += 1
             else:
-                symbol_seq.append(curr)
                 repetition.append(False)
                 i += 1
 
-        if len(symbol_seq) != len(repetition):
-            print("[WARNING], reduce_fsmsymbol_sequence, len(symbol_seq) != len(repetition)")
-
         return symbol_seq, repetition
-
-
+    
     
     # the function checks whether the sequence is repetative and it returns repetition period
     # if the repetition period is equal to 0 then we do not have repetitions
-    def is_repetition_sequence(self, s):
-        length = 1
-        while length <= len(s) // 2:
-            start = s[:length]
-            rest = s[length:]
-            l_start = len(start)
-            l_rest = len(rest)
-            rep_seq = True
-            if l_rest % l_start == 0:
-                shift = 0
-                while shift <= l_rest - l_start:
-                    match = True
-                    for k in range(l_start): 
-                        if rest[shift + k] != start[k]:
-                            match = False
-                            break
-
-                    if match:
-                        shift += l_start
-                    else:
-                        rep_seq = False
-                        break
-            else:
-                rep_seq = False
-            
-            if rep_seq:
-                return length
-            else:
-                length += 1
-        
-        return 0
+    def is_repetition_sequence(self, s, ids=None):
+        if ids is None:
+            ids = fsmsymbol_ids(s)
+
+        return repetition_period(ids)
             
 
     # determine transition move that activates sequence
     def determine_transition_move(self, sequence):
         start = sequence[0]
         prev = self.dfs_parent[start]
-        prev_symbol = self.pattern_graph.G.nodes[prev]["symbol"]
-        move = self.pattern_graph.G.edges[prev, start]["link_type"]
+        prev_symbol = self.pattern_graph.symbol(prev)
+        move = self.pattern_graph.move(prev, start)
         return FSMSymbol(move, prev_symbol)      
 
 
@@ -401,15 +777,17 @@ given fsm, input matrix and starting coordinates
 class FSMPatRecKernel:
     def __init__(self, fsm, input_matrix, x, y):
         self.fsm = fsm
-        self.input_matrix = input_matrix
+        self.input_matrix = as_grid(input_matrix)
+        self.cells = self.input_matrix.data
+        self.mask = self.input_matrix.neighbour_mask()
         self.x = x
         self.y = y
-        self.dimx = len(input_matrix)
-        self.dimy = len(input_matrix[0])
+        self.dimx = self.input_matrix.dimx
+        self.dimy = self.input_matrix.dimy
 
 
     def apply(self):
-        startsym = self.input_matrix[self.x][self.y]
+        startsym = self.input_matrix.symbol(self.x, self.y)
         if startsym == self.fsm.activating_symbol:
             state = self.fsm.states[0]
             self.end_state = self.fsm.states[-1]
@@ -430,7 +808,7 @@ class FSMPatRecKernel:
         while (True):
             #print(state.name, x, y)
             self.active_time += 1
-            self.visited.append(str(x) + "-" + str(y))
+            self.visited.append(cell_id(x, y))
             self.activated_states.add(state.name)
         
             num_trans = len(state.transitions)
@@ -468,12 +846,7 @@ class FSMPatRecKernel:
                 
 
     def next_x_y(self, x, y, move):
-        ind = link_type.index(move)
-        if ind == -1:
-            print("[FATAL ERROR] Unknown moving type", move)
-            return None
-        
-        return x + dx[ind], y + dy[ind]
+        return x + MOVE_DX[move], y + MOVE_DY[move]
 
 
     def on_table(self, x, y):
@@ -486,36 +859,457 @@ class FSMPatRecKernel:
         empty_present = False
         selfloop_present = False
 
+        # moves leading to non-empty fields on the table (bits of the neighbour mask)
+        moves = int(self.mask[x, y])
+
         for tran in possible_trans:
             fsm_symbol = tran[0]
             next_state = tran[1]
             move = fsm_symbol.move
-            next_symbol = fsm_symbol.next_symbol
 
-            if fsm_symbol != EMPTY_FSM_SYMBOL:
-                next_x, next_y = self.next_x_y(x, y, move)
+            if fsm_symbol is not EMPTY_FSM_SYMBOL:
                 if next_state == state:
                     selfloop_present = True
-                if self.on_table(next_x, next_y) and self.input_matrix[next_x][next_y] == next_symbol:
-                    feasible_trans.append((next_x, next_y, next_state))
+                if moves >> move & 1:
+                    next_x, next_y = self.next_x_y(x, y, move)
+                    if self.cells[next_x, next_y] == fsm_symbol.code:
+                        feasible_trans.append((next_x, next_y, next_state))
             else:
                 empty_present = True
 
         return feasible_trans, empty_present, selfloop_present
 
 
-def learn_simple_concept_from_matrix(pattern_matrix, verbose=False):
+"""
+Compiled form of an FSM: states are numbered in the order of fsm.states and
+non-empty transitions of state s are kept at positions trans_start[s] ...
+trans_start[s + 1] - 1 of flat arrays of move codes, expected symbol codes and
+next states. Per-state flags tell the number of all transitions, whether the
+state has a non-empty self-loop and whether it has an EMPTY transition
+"""
+class CompiledFSM:
+    def __init__(self, fsm):
+        self.activating_code = symbol_code(fsm.activating_symbol)
+        self.num_states = len(fsm.states)
+
+        index = {fsm.states[i] : i for i in range(self.num_states)}
+        self.trans_start = [0]
+        self.trans_move, self.trans_code, self.trans_next = [], [], []
+        self.num_trans, self.selfloop, self.empty = [], [], []
+
+        for s in fsm.states:
+            selfloop, empty = 0, 0
+            for sym, next_state in s.transitions:
+                if sym is EMPTY_FSM_SYMBOL:
+                    empty = 1
+                else:
+                    if next_state is s:
+                        selfloop = 1
+                    self.trans_move.append(sym.move)
+                    self.trans_code.append(sym.code)
+                    self.trans_next.append(index[next_state])
+
+            self.trans_start.append(len(self.trans_move))
+            self.num_trans.append(len(s.transitions))
+            self.selfloop.append(selfloop)
+            self.empty.append(empty)
+
+        self._tables = None
+
+
+    """
+    transitions as padded arrays for vectorized runs: move codes, expected symbol
+    codes, next states and validity of the j-th non-empty transition of state s
+    are at [s, j], followed by arrays of per-state flags
+    """
+    def tables(self):
+        if self._tables is None:
+            width = max([self.trans_start[s + 1] - self.trans_start[s] for s in range(self.num_states)] + [1])
+            move = np.zeros((self.num_states, width), dtype=np.int64)
+            code = np.full((self.num_states, width), -1, dtype=np.int64)
+            next = np.zeros((self.num_states, width), dtype=np.int64)
+            valid = np.zeros((self.num_states, width), dtype=bool)
+            for s in range(self.num_states):
+                lo, hi = self.trans_start[s], self.trans_start[s + 1]
+                move[s, :hi - lo] = self.trans_move[lo:hi]
+                code[s, :hi - lo] = self.trans_code[lo:hi]
+                next[s, :hi - lo] = self.trans_next[lo:hi]
+                valid[s, :hi - lo] = True
+
+            flags = np.array(self.num_trans, dtype=np.int64), np.array(self.selfloop, dtype=bool), np.array(self.empty, dtype=bool)
+            self._tables = (move, code, next, valid) + flags
+
+        return self._tables
+
+
+"""
+Iterative interpreter of compiled FSMs, it gives the same results as
+FSMPatRecKernel(fsm, grid, x, y).apply() (cells and mask -- symbol codes and
+neighbour masks of the grid). Branching states push their feasible transitions
+on a stack, so branches are processed in the same (depth-first) order
+"""
+def run_compiled_fsm(cfsm, cells, mask, x, y):
+    dimx, dimy = cells.shape
+    if x < 0 or x >= dimx or y < 0 or y >= dimy or cells.item(x, y) != cfsm.activating_code:
+        return False, 0, None
+    
+    return _run_compiled_fsm(cfsm, cells, mask, x, y, 0, bytearray(cfsm.num_states), 0, [])
+
+
+# interpreter continuing a run in the given state (activated -- activated states,
+# active_time and visited -- active time and visited fields of the run so far)
+def _run_compiled_fsm(cfsm, cells, mask, x, y, state, activated, active_time, visited):
+    trans_start, trans_move, trans_code, trans_next = cfsm.trans_start, cfsm.trans_move, cfsm.trans_code, cfsm.trans_next
+    num_trans, selfloop, empty = cfsm.num_trans, cfsm.selfloop, cfsm.empty
+    
+    num_activated = sum(activated)
+    stack = []
+    while True:
+        active_time += 1
+        visited.append(cell_id(x, y))
+        if not activated[state]:
+            activated[state] = 1
+            num_activated += 1
+
+        moves = mask.item(x, y)
+        feasible = []
+        for t in range(trans_start[state], trans_start[state + 1]):
+            move = trans_move[t]
+            if moves >> move & 1:
+                next_x, next_y = x + MOVE_DX[move], y + MOVE_DY[move]
+                if cells.item(next_x, next_y) == trans_code[t]:
+                    feasible.append((next_x, next_y, trans_next[t]))
+
+        num_feasible = len(feasible)
+        if num_feasible == 0:
+            if empty[state]:
+                ok = num_trans[state] == 1 or (num_trans[state] == 2 and selfloop[state])
+            else:
+                ok = num_activated == cfsm.num_states
+        elif not selfloop[state] and num_feasible + empty[state] != num_trans[state]:
+            ok = False
+        elif num_feasible == 1:
+            x, y, state = feasible[0]
+            continue
+        else:
+            for f in reversed(feasible):
+                if f[2] != state:
+                    stack.append(f)
+            ok = True
+
+        # a failed branch fails the whole recognition
+        if not ok:
+            return False, active_time, visited
+        
+        if len(stack) == 0:
+            return True, active_time, visited
+        
+        x, y, state = stack.pop()
+
+
+"""
+Visited fields of many runs kept in flat arrays: fields visited by the run
+from the r-th start are ids[offsets[r]:offsets[r + 1]] (in the order of visits),
+the list of visited fields of a start is built when it is requested
+(None for starts not activating the FSM). Lists of runs finished by
+the interpreter are kept as they are
+"""
+class VisitedFields:
+    def __init__(self, ids, offsets, activated):
+        self.ids = ids
+        self.offsets = offsets
+        self.activated = activated
+        self.lists = dict()
+
+
+    def __len__(self):
+        return len(self.activated)
+
+
+    def __getitem__(self, r):
+        visited = self.lists.get(r)
+        if visited is not None:
+            return visited
+
+        if not self.activated[r]:
+            return None
+
+        return self.ids[self.offsets[r]:self.offsets[r + 1]].tolist()
+
+
+    def __setitem__(self, r, visited):
+        self.lists[r] = visited
+
+
+    def __iter__(self):
+        for r in range(len(self)):
+            yield self[r]
+
+
+"""
+Vectorized run of a compiled FSM from many start fields (xs, ys) at once: runs
+advance in lockstep while they follow single transitions, a run reaching a state
+with several feasible transitions is finished by the iterative interpreter.
+The function returns arrays of recognition results and active times, and the
+visited fields per start (VisitedFields, built only if with_visited is True),
+all equal to the results of run_compiled_fsm for each start
+"""
+def run_compiled_fsm_multi(cfsm, cells, mask, xs, ys, with_visited=False):
+    xs, ys = np.asarray(xs, dtype=np.int64), np.asarray(ys, dtype=np.int64)
+    n = len(xs)
+    recognized = np.zeros(n, dtype=bool)
+    active_time = np.zeros(n, dtype=np.int64)
+    
+    dimx, dimy = cells.shape
+    rows = np.flatnonzero((xs >= 0) & (xs < dimx) & (ys >= 0) & (ys < dimy))
+    rows = rows[cells[xs[rows], ys[rows]] == cfsm.activating_code]
+    
+    t_move, t_code, t_next, t_valid, num_trans, selfloop, empty = cfsm.tables()
+    move_dx, move_dy = np.array(MOVE_DX, dtype=np.int64), np.array(MOVE_DY, dtype=np.int64)
+
+    # runs in progress: rows of starts, states, fields and activated states
+    x, y = xs[rows], ys[rows]
+    state = np.zeros(len(rows), dtype=np.int64)
+    activated = np.zeros((len(rows), cfsm.num_states), dtype=bool)
+    active = np.arange(len(rows))
+    
+    visited_rows, visited_ids = [], []
+    branching = []
+    while len(active) > 0:
+        moves = mask[x, y].astype(np.int64)
+        feasible = np.zeros((len(active), t_move.shape[1]), dtype=bool)
+        next_x = np.zeros(feasible.shape, dtype=np.int64)
+        next_y = np.zeros(feasible.shape, dtype=np.int64)
+        for j in range(t_move.shape[1]):
+            m = t_move[state, j]
+            ok = t_valid[state, j] & ((moves >> m) & 1 == 1)
+            nx_j, ny_j = x + move_dx[m], y + move_dy[m]
+            sel = np.flatnonzero(ok)
+            ok[sel] = cells[nx_j[sel], ny_j[sel]] == t_code[state[sel], j]
+            feasible[:, j], next_x[:, j], next_y[:, j] = ok, nx_j, ny_j
+
+        num_feasible = feasible.sum(axis=1)
+        failed = (num_feasible > 0) & ~selfloop[state] & (num_feasible + empty[state] != num_trans[state])
+
+        # runs reaching a branching state are continued by the interpreter
+        branch = (num_feasible > 1) & ~failed
+        for i in np.flatnonzero(branch).tolist():
+            branching.append((active[i], int(state[i]), int(x[i]), int(y[i])))
+
+        step = ~branch
+        active, state, x, y = active[step], state[step], x[step], y[step]
+        feasible, next_x, next_y = feasible[step], next_x[step], next_y[step]
+        num_feasible, failed = num_feasible[step], failed[step]
+
+        active_time[rows[active]] += 1
+        activated[active, state] = True
+        if with_visited:
+            visited_rows.append(active)
+            visited_ids.append(cell_ids(x, y))
+
+        # finished runs
+        stop = (num_feasible == 0) | failed
+        done = np.flatnonzero(stop)
+        s = state[done]
+        ended = np.where(empty[s], (num_trans[s] == 1) | ((num_trans[s] == 2) & selfloop[s]), activated[active[done]].all(axis=1))
+        recognized[rows[active[done]]] = ended & ~failed[done]
+
+        # runs following their single feasible transition
+        go = np.flatnonzero(~stop)
+        j = feasible[go].argmax(axis=1)
+        active, state = active[go], t_next[state[go], j]
+        x, y = next_x[go, j], next_y[go, j]
+
+    visited = None
+    if with_visited or len(branching) > 0:
+        # visits are grouped by starts, the order of visits of a run is kept
+        runs, ids = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        if len(visited_rows) > 0:
+            runs = rows[np.concatenate(visited_rows)]
+            ids = np.concatenate(visited_ids)
+            order = np.argsort(runs, kind="stable")
+            runs, ids = runs[order], ids[order]
+
+        offsets = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(runs, minlength=n), out=offsets[1:])
+        activated_starts = np.zeros(n, dtype=bool)
+        activated_starts[rows] = True
+        visited = VisitedFields(ids, offsets, activated_starts)
+
+    for i, s, bx, by in branching:
+        r = int(rows[i])
+        rec, t, vis = _run_compiled_fsm(cfsm, cells, mask, bx, by, s, bytearray(activated[i].tobytes()), int(active_time[r]), visited[r])
+        recognized[r], active_time[r], visited[r] = rec, t, vis
+
+    if not with_visited:
+        visited = None
+
+    return recognized, active_time, visited
+
+
+"""
+function applies an FSM from many start fields of a matrix (all fields with
+the activating symbol of the FSM if xs and ys are not given), it returns start
+fields and the results of run_compiled_fsm_multi
+"""
+def apply_fsm_multi(fsm, mat, xs=None, ys=None, with_visited=False):
+    grid = as_grid(mat)
+    cfsm = fsm.compile()
+    if xs is None:
+        xs, ys = np.nonzero(grid.data == cfsm.activating_code)
+
+    recognized, active_time, visited = run_compiled_fsm_multi(cfsm, grid.data, grid.neighbour_mask(), xs, ys, with_visited)
+    return xs, ys, recognized, active_time, visited
+
+
+"""
+function applies an FSM at the field (x, y) of a matrix (compiled FSM,
+no kernel object), it returns the same as FSMPatRecKernel.apply
+"""
+def apply_fsm(fsm, mat, x, y):
+    grid = as_grid(mat)
+    return run_compiled_fsm(fsm.compile(), grid.data, grid.neighbour_mask(), x, y)
+
+
+"""
+function returns the strict prefix of an FSM: FSM symbols of the transitions
+taken from the start state while the current state has a single non-empty
+transition leading to a state not visited before. A run of the FSM fails at
+a field where a prefix transition is not feasible, since the next state of
+the transition remains inactive
+"""
+def fsm_prefix(fsm):
+    prefix = []
+    if len(fsm.states) == 0:
+        return prefix
+
+    state = fsm.states[0]
+    on_path = {state}
+    while len(state.transitions) == 1:
+        sym, next_state = state.transitions[0]
+        if sym is EMPTY_FSM_SYMBOL or next_state in on_path:
+            break
+        
+        prefix.append(sym)
+        on_path.add(next_state)
+        state = next_state
+
+    return prefix
+
+
+# node of the FSMBank trie: children by FSM symbols and
+# FSMs (concept, index of FSM in the concept, FSM) whose prefixes end in the node
+class FSMBankNode:
+    def __init__(self):
+        self.children = dict()
+        self.fsms = []
+
+
+"""
+FSMBank keeps FSMs of base concepts in a trie over their strict prefixes
+(fsm_prefix) rooted by activating symbols, so one walk from a field selects
+all FSMs that can recognize a pattern starting at the field and prunes
+FSMs sharing a failed prefix together. FSMs are added and removed per concept
+"""
+class FSMBank:
+    def __init__(self):
+        self.roots = dict()      # activating symbol code -> root node
+        self.entries = dict()    # concept -> list of (node, FSM)
+
+
+    def add(self, concept, fsms):
+        entries = self.entries.setdefault(concept, [])
+        for fsm in fsms:
+            node = self.roots.setdefault(symbol_code(fsm.activating_symbol), FSMBankNode())
+            for sym in fsm_prefix(fsm):
+                child = node.children.get(sym)
+                if child is None:
+                    child = FSMBankNode()
+                    node.children[sym] = child
+                node = child
+
+            node.fsms.append((concept, len(entries), fsm))
+            entries.append((node, fsm))
+
+
+    def remove(self, concept):
+        entries = self.entries.pop(concept, [])
+        for node in set(node for node, _ in entries):
+            node.fsms = [e for e in node.fsms if e[0] != concept]
+
+
+    def rename(self, old_concept, new_concept):
+        entries = self.entries.pop(old_concept, [])
+        for node in set(node for node, _ in entries):
+            node.fsms = [(new_concept, k, fsm) if c == old_concept else (c, k, fsm) for c, k, fsm in node.fsms]
+
+        self.entries[new_concept] = entries
+
+
+    def num_fsms(self):
+        return sum(len(e) for e in self.entries.values())
+
+
+    """
+    FSMs whose prefixes are feasible from the field (x, y) of a matrix,
+    it returns a map from concepts to lists of (index of FSM in the concept, FSM)
+    ordered by indices
+    """
+    def candidates(self, mat, x, y):
+        grid = as_grid(mat)
+        cells, mask = grid.data, grid.neighbour_mask()
+        found = dict()
+        if x < 0 or x >= grid.dimx or y < 0 or y >= grid.dimy:
+            return found
+        
+        root = self.roots.get(cells.item(x, y))
+        if root is None:
+            return found
+        
+        stack = [(root, x, y)]
+        while len(stack) > 0:
+            node, x, y = stack.pop()
+            for concept, k, fsm in node.fsms:
+                found.setdefault(concept, []).append((k, fsm))
+
+            moves = mask.item(x, y)
+            for sym, child in node.children.items():
+                if moves >> sym.move & 1:
+                    next_x, next_y = x + MOVE_DX[sym.move], y + MOVE_DY[sym.move]
+                    if cells.item(next_x, next_y) == sym.code:
+                        stack.append((child, next_x, next_y))
+
+        for concept in found:
+            found[concept].sort(key=lambda e: e[0])
+
+        return found
+
+
+"""
+function learns FSMs of a simple concept (one FSM per start node).
+With processes > 1 FSMs for different start nodes are learned in a pool of
+processes (None -- one process per CPU), FSMs are returned in the order of
+start nodes in both cases
+"""
+def learn_simple_concept_from_matrix(pattern_matrix, verbose=False, processes=1):
     fsms = []
 
-    pg = PatternGraph(pattern_matrix)
+    pg = get_pattern_graph(pattern_matrix)
     if not pg.is_concept_simple():
         return False, pg, []
     
+    if processes is None:
+        processes = os.cpu_count() or 1
+
     start_nodes = pg.start_nodes
-    for sn in start_nodes:
-        l = FSMLearner(pg, sn) 
-        fsm = l.learn()
-        
+    if processes > 1 and len(start_nodes) > 1:
+        # FSMs are learned by worker processes, the pattern is sent once per worker
+        with ProcessPoolExecutor(max_workers=min(processes, len(start_nodes)), initializer=_init_fsm_learner, initargs=(pattern_matrix,)) as pool:
+            learned = list(pool.map(_learn_fsm, start_nodes))
+    else:
+        learned = (FSMLearner(pg, sn).learn() for sn in start_nodes)
+
+    for fsm in learned:
         if verbose: 
             print("Learned FSM")
             fsm.print()
@@ -528,17 +1322,50 @@ def learn_simple_concept_from_matrix(pattern_matrix, verbose=False):
     return True, pg, fsms
 
 
-def learn_simple_concept(pattern_matrix_file, verbose=False):
+def learn_simple_concept(pattern_matrix_file, verbose=False, processes=1):
     concept, pattern_matrix = load_matrix(pattern_matrix_file)
-    ok, pg, fsms = learn_simple_concept_from_matrix(pattern_matrix, verbose)
+    ok, pg, fsms = learn_simple_concept_from_matrix(pattern_matrix, verbose, processes)
     return ok, concept, pattern_matrix, pg, fsms
 
 
+# pattern of the FSM learning worker process
+_learner_pattern = None
+
+def _init_fsm_learner(pattern_matrix):
+    global _learner_pattern
+    _learner_pattern = pattern_matrix
+
+
+def _learn_fsm(start_node):
+    return FSMLearner(get_pattern_graph(_learner_pattern), start_node).learn()
+
+
+def _learn_simple_concept_file(pattern_matrix_file):
+    return learn_simple_concept(pattern_matrix_file)
+
+
+"""
+function learns simple concepts from many pattern files in a pool of
+processes (None -- one process per CPU), one file per task. It returns
+the results of learn_simple_concept in the order of pattern files
+"""
+def learn_simple_concepts(pattern_matrix_files, processes=None):
+    pattern_matrix_files = list(pattern_matrix_files)
+    if processes is None:
+        processes = os.cpu_count() or 1
+
+    if processes <= 1 or len(pattern_matrix_files) <= 1:
+        return [learn_simple_concept(f) for f in pattern_matrix_files]
+
+    with ProcessPoolExecutor(max_workers=min(processes, len(pattern_matrix_files))) as pool:
+        return list(pool.map(_learn_simple_concept_file, pattern_matrix_files))
+
+
 #
 # python3 Automaton.py -pat horizontal_line.pat vertical_line.pat left_angle.pat right_angle.pat t.pat -sc scene2.txt
 #
 if __name__ == "__main__":
-    from Matrix import load_matrix, print_matrix, parse_field
+    from Matrix import load_matrix, print_matrix, cell_ids_xy
     from SceneAnalyzer import IdentifyObjects
 
     args = sys.argv[1:]
@@ -549,9 +1376,11 @@ if __name__ == "__main__":
         print("Help:")
         print("After -pat add all patterns")
         print("After -sc add ONE scene (if you add more than one last one will be taken)")
+        print("With -batch the scene is a directory or a glob pattern of scenes segmented in parallel")
     else:
         patterns = []
         scene = None
+        batch = "-batch" in args
 
         is_pat = False
         for i in range(len(args)):
@@ -559,6 +1388,8 @@ if __name__ == "__main__":
                 is_pat = True
             elif args[i] == "-sc":
                 is_pat = False
+            elif args[i] == "-batch":
+                continue
             else:
                 if is_pat:
                     patterns.append(args[i])
@@ -576,34 +1407,27 @@ if __name__ == "__main__":
             learned_concepts[concept] = fsms
 
         print("learned concepts", learned_concepts)
-        scene_desc, scene_matrix = load_matrix('test_files/' + scene)
-        print(scene_desc, " LOADED")
-        print_matrix(scene_matrix)
-
-        idobj = IdentifyObjects(scene_matrix)
-        num_objects = idobj.num_objects()
-        for i in range(num_objects):
-            mat = idobj.get_object_matrix(i)
-            print("\n\n\nStarting pattern recognition for: ")
-            print_matrix(mat)
-        
-            pg = PatternGraph(mat)
+
+        def recognize_object(mat):
+            pg = get_pattern_graph(mat)
             starts = pg.start_nodes
+            if len(starts) == 0:
+                return
 
-            for start in starts:
-                x, y = parse_field(start)
+            # each FSM is applied from all start nodes at once
+            xs, ys = cell_ids_xy(starts)
+            recognized = dict()
+            for concept in learned_concepts:
+                recognized[concept] = [apply_fsm_multi(fsm, mat, xs, ys, with_visited=False)[2] for fsm in learned_concepts[concept]]
+
+            for i in range(len(starts)):
+                x, y = int(xs[i]), int(ys[i])
                 print("\nApplying automata at", x, y)
                 for concept in learned_concepts:
-                    fsms = learned_concepts[concept]
-                    noauto = len(fsms)
-                    for k in range(noauto):
-                        fsm = fsms[k]
-                        pkr = FSMPatRecKernel(fsm, mat, x, y)
-                        rec, _, _ = pkr.apply()
-                        if rec:
+                    for k in range(len(recognized[concept])):
+                        if recognized[concept][k][i]:
                             print(concept, "recognized by automata", k)
 
-
             """
             for name, fsms in learned_concepts.items():
                 for fsm in fsms:
@@ -614,6 +1438,26 @@ if __name__ == "__main__":
             """
 
 
+        if batch:
+            from SceneBatch import analyze_scenes
+            for f, scene_desc, desc, mat in analyze_scenes('test_files/' + scene, with_matrices=True):
+                print("\n\n\nStarting pattern recognition for object", desc.index, "of", scene_desc, "(" + f + ")")
+                print_matrix(mat)
+                recognize_object(mat)
+        else:
+            scene_desc, scene_matrix = load_matrix('test_files/' + scene)
+            print(scene_desc, " LOADED")
+            print_matrix(scene_matrix)
+
+            idobj = IdentifyObjects(scene_matrix)
+            num_objects = idobj.num_objects()
+            for i in range(num_objects):
+                mat = idobj.get_object_matrix(i, view=True)
+                print("\n\n\nStarting pattern recognition for: ")
+                print_matrix(mat)
+                recognize_object(mat)
+
+
 
 # LAST SVC MAIN
 """
@@ -36,9 +36,11 @@ class BaseLearner:
 
 
     #
-    # base concept learning routine (for both supervised and unsupervised learning)
+    # base concept learning routine (for both supervised and unsupervised learning),
+    # simple_concept -- (passed, fsms) of learn_simple_concept_from_matrix for mat
+    # if already computed (e.g. in a pool of processes)
     # 
-    def learn_concept(self, concept_id, unsupervised):
+    def learn_concept(self, concept_id, unsupervised, simple_concept=None):
         # learn complex concept first
         if unsupervised:
             concept_id = self.automata_memory.get_concept_id_for_unknown(False)
@@ -49,7 +51,10 @@ class BaseLearner:
             return
 
         # if a complex concept cannot be learnt then try to learn a simple concept
-        passed, _, fsms = learn_simple_concept_from_matrix(self.mat, verbose=self.verbose)
+        if simple_concept is None:
+            passed, _, fsms = learn_simple_concept_from_matrix(self.mat, verbose=self.verbose)
+        else:
+            passed, fsms = simple_concept
         if passed:
             if unsupervised:
                 concept_id = self.automata_memory.get_concept_id_for_unknown(True)
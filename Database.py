@@ -12,6 +12,7 @@ import networkx as nx
 
 import Matrix
 import AutomataMemory
+from SceneStorage import is_grid_str, str_to_grid
 from Automaton import FSM, FSMSymbol, EMPTY_FSM_SYMBOL
 import HOAutomaton
 
@@ -130,8 +131,8 @@ class Database:
                 
                 src_id, dst_id = src['id'], dst['id']
                 src_at, dst_at = int(src['activation_time']), int(dst['activation_time'])
-                move_type = link_src_dst['move_type']
-                constraints = eval(link_src_dst['constraints'])
+                move_type = Matrix.move_code(link_src_dst['move_type'])
+                constraints = [Matrix.move_code(c) for c in eval(link_src_dst['constraints'])]
                 
                 src_toks, dst_toks = src_id.split("-"), dst_id.split("-")
                 src_concept, src_index, src_state_index = src_toks[-2], src_toks[-1], int(src_toks[2])
@@ -183,8 +184,8 @@ class Database:
                 nodes = list(dict(state)['r'].nodes)
                 n1_index = dict(nodes[0])['id'].split('-')[2]
                 n2_index = dict(nodes[1])['id'].split('-')[2]
-                move_type = r['move_type']
-                constraints = r['constraints'][2:-2].split(',')
+                move_type = Matrix.move_code(r['move_type'])
+                constraints = self.str_to_constraints(r['constraints'])
                 relations_map.append((n1_index, n2_index, move_type, constraints))
 
                 m = dict(dict(state)['m'])
@@ -249,8 +250,8 @@ class Database:
                     nodes = list(dict(state)['r'].nodes)
                     n1_index = dict(nodes[0])['id'].split('-')[2]
                     n2_index = dict(nodes[1])['id'].split('-')[2]
-                    move_type = r['move_type']
-                    constraints = r['constraints'][2:-2].split(',')
+                    move_type = Matrix.move_code(r['move_type'])
+                    constraints = self.str_to_constraints(r['constraints'])
                     relations_map.append((n1_index, n2_index, move_type, constraints))
 
 
@@ -288,15 +289,16 @@ class Database:
         return memory
 
 
+    # link constraints are stored as lists of move names, e.g. "['END', 'INC_L']"
+    def str_to_constraints(self, str):
+        tokens = [t.strip(" '\"") for t in str.strip("[]").split(",")]
+        return [Matrix.move_code(t) for t in tokens if t != ""]
+
+
     def str_to_matrix(self, str):
+        if is_grid_str(str):
+            return str_to_grid(str)
+
         tokens = str.split("\n")
         tokens.pop() #posto je poslednji element prazan string zbog viska \n na kraju
-        dimx = len(tokens)
-        dimy = len(tokens[0])
-
-        mat = Matrix.create_empty_matrix(dimx, dimy)
-        for i in range(dimx):
-            for j in range(dimy):
-                mat[i][j] = tokens[i][j]
-
-        return mat
\ No newline at end of file
+        return Matrix.grid_from_lines(tokens)
\ No newline at end of file
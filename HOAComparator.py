@@ -4,6 +4,8 @@
 # 
 # Authors: {svc, lucy}@dmi.uns.ac.rs
 
+from Matrix import move_name
+
 
 class HOAComplexityComparator:
     def __init__(self, hoa_a, hoa_b):
@@ -129,10 +131,11 @@ class HOAComparator:
 
     #
     # constraints are compared only for HOAs having identical structure
+    # (link constraints are move codes, compared by their names)
     # 
     def compare_constraints(self):
-        a_lc = [str(x[0]) + "-" + str(x[1]) + "-" + str(x[2]) for x in self.hoa_a.link_constraints] 
-        b_lc = [str(x[0]) + "-" + str(x[1]) + "-" + str(x[2]) for x in self.hoa_b.link_constraints]
+        a_lc = [str(x[0]) + "-" + str(x[1]) + "-" + move_name(x[2]) for x in self.hoa_a.link_constraints] 
+        b_lc = [str(x[0]) + "-" + str(x[1]) + "-" + move_name(x[2]) for x in self.hoa_b.link_constraints]
         
         a_idt = [str(x[0]) + "-" + str(x[1]) for x in self.hoa_a.identical_at] 
         b_idt = [str(x[0]) + "-" + str(x[1]) for x in self.hoa_b.identical_at]
@@ -12,9 +12,11 @@
 import networkx as nx
 from collections import deque
 
-from Automaton import FSMPatRecKernel, PatternGraph
-from Matrix import neigh, parse_field, dx, dy, coverage
-from Matrix import link_type as LT_ARRAY
+from Automaton import apply_fsm, get_pattern_graph
+from Matrix import neigh_move, coverage, as_grid, EMPTY_CODE
+from Matrix import cell_id, cell_xy, cells_str, FieldSet
+from Matrix import MOVE_DX, MOVE_DY, MOVE_DIR_MASK, MOVE_ID, MOVE_START, MOVE_NONE, MOVE_END
+from Matrix import MOVE_KIND_START, MOVE_KIND_INC, move_kind, move_name, move_names, is_straight_move
 from SceneAnalyzer import IdentifyObjects
 from HOAComparator import HOAComplexityComparator
 
@@ -100,14 +102,14 @@ class HOA:
         links = self.G.edges()
         for l in links:
             src, dst = l
-            print(src.get_id(), "-->", dst.get_id(), "move = ", self.G.edges[l]["move_type"], " constraints = ", self.G.edges[l]["constraints"])
+            print(src.get_id(), "-->", dst.get_id(), "move = ", move_name(self.G.edges[l]["move_type"]), " constraints = ", move_names(self.G.edges[l]["constraints"]))
 
         print("-- link constraints")
         if len(self.link_constraints) == 0:
             print("none")
         else:
             for lc in self.link_constraints:
-                print(lc)
+                print((lc[0], lc[1], move_name(lc[2])))
 
         print("-- activation time constraints")
         if len(self.identical_at) == 0 and len(self.semi_identical_at) == 0:
@@ -180,7 +182,7 @@ class HOA:
 
     def bfs_links(self):
         ord = nx.bfs_edges(self.G, self.nodes[0])
-        return [l[0].concept + "--" + l[1].concept + "--" + self.G.edges[l]["move_type"] for l in ord]
+        return [l[0].concept + "--" + l[1].concept + "--" + move_name(self.G.edges[l]["move_type"]) for l in ord]
                 
 
     def get_concept_dependencies(self):
@@ -216,7 +218,7 @@ class HOALearner:
             raise Exception("[ERROR, HOALearner] matrix contains multiple objects")
 
         self.concept = concept
-        self.matrix = matrix
+        self.matrix = as_grid(matrix)
         self.verbose = verbose
         self.hoa = HOA(concept)
 
@@ -225,13 +227,16 @@ class HOALearner:
         # complex concepts that have to be excluded when learning this particular HOA
         self.exclude_concepts = exclude_concepts
 
+        # automaton results on the pattern matrix shared by all applied automata
+        self.memo = AutomatonMemo(self.matrix)
+
 
     #
     # identify automata that can be activated in pattern matrix
     # 
     def identify_automata(self):
         # set of visited matrix fields
-        visited_fields = set()
+        visited_fields = FieldSet(self.matrix.dimx, self.matrix.dimy)
 
         # list of activated automata
         self.activated_automata = []
@@ -241,9 +246,9 @@ class HOALearner:
 
         bfs_order = self.bfs_traversal()
         for start_field in bfs_order:
-            i, j = parse_field(start_field)
+            i, j = cell_xy(start_field)
             
-            if self.matrix[i][j] != ' ' and start_field not in visited_fields:
+            if self.matrix.data[i, j] != EMPTY_CODE and start_field not in visited_fields:
                 hoa_activated = self.identify_complex_concepts(i, j, complex_concepts, visited_fields)
                 if not hoa_activated:
                     # if HOA activated then skip FSMs
@@ -274,24 +279,17 @@ class HOALearner:
     BFS-traversal for pattern matrix
     """
     def bfs_traversal(self):
-        pg = PatternGraph(self.matrix)
-        ret = []
-        for l in nx.bfs_edges(pg.G, pg.first_node):
-            src, dst = l[0], l[1]
-            if src not in ret:
-                ret.append(src)
-            if dst not in ret:
-                ret.append(dst)
-
-        return ret
+        pg = get_pattern_graph(self.matrix)
+        return list(pg.bfs_order())
 
 
     """
     identify complex concepts that can be recognized by existing HOAs 
     """    
     def identify_complex_concepts(self, i, j, complex_concepts, visited_fields):
-        # identify complex concepts (HOAs)
+        # identify complex concepts (HOAs), only HOAs whose start automata can be activated are applied
         activated = []
+        candidates = self.automata_memory.candidate_automata(self.matrix, i, j)
         
         for concept in complex_concepts:
             # skip excluded concepts
@@ -299,14 +297,13 @@ class HOALearner:
                 #print("Excluding: ", concept)
                 continue
 
-            for hoa in self.automata_memory.get_automata(concept):
+            for _, hoa in candidates.get(concept, []):
                 # apply pattern recognition for current HOA
-                prk = HOAPatRecKernel(hoa, self.matrix, i, j)
-                rec, t, visited = prk.apply()
+                rec, t, visited = self.memo.apply(hoa, "HOA", i, j)
             
                 if rec:
                     if self.verbose:
-                        print("Activation [complex] ", visited, ", HOA: ", concept)
+                        print("Activation [complex] ", cells_str(visited), ", HOA: ", concept)
                     
                     # skip concepts that partially covers visisted fileds
                     if self.overlap(visited, visited_fields):
@@ -345,8 +342,7 @@ class HOALearner:
                 # print("Selected HOA", activated[the_best][0])
 
             visited = selected[3]
-            for v in visited:
-                visited_fields.add(v)
+            visited_fields.update(visited)
 
             self.activated_automata.append(selected)
             return True
@@ -355,6 +351,9 @@ class HOALearner:
     
 
     def overlap(self, set1, set2):
+        if isinstance(set2, FieldSet):
+            return set2.overlaps(set1)
+        
         for s in set1:
             if s in set2:
                 return True
@@ -366,26 +365,21 @@ class HOALearner:
     identify base concepts that can be recognized by existing FSMs
     """
     def identify_base_concepts(self, i, j, base_concepts, visited_fields, start_field):
-        # identify base concepts (FSMS)
+        # identify base concepts (FSMS), only FSMs selected by the FSM bank can be activated
+        candidates = self.automata_memory.fsm_bank.candidates(self.matrix, i, j)
         for concept in base_concepts:
-            for automaton in self.automata_memory.get_automata(concept): 
-                prk = FSMPatRecKernel(automaton, self.matrix, i, j)
-                rec, t, visited = prk.apply()
+            for _, automaton in candidates.get(concept, []): 
+                rec, t, visited = self.memo.apply(automaton, "FSM", i, j)
                 if rec:
                     # check valid activations
                     # an activation is valid if it covers at least one unvisited field
-                    valid_activation = False
-                    for v in visited:
-                        if v != start_field and not v in visited_fields:
-                            valid_activation = True
-                            break
+                    valid_activation = visited_fields.has_new(visited, skip=start_field)
 
                     if valid_activation:
                         if self.verbose:
-                            print("Activation [simple] ", visited, ", FSM: ", concept)
+                            print("Activation [simple] ", cells_str(visited), ", FSM: ", concept)
                         
-                        for v in visited:
-                            visited_fields.add(v)
+                        visited_fields.update(visited)
                         
                         self.activated_automata.append([concept, automaton, "FSM", visited, t])
                         break
@@ -411,7 +405,7 @@ class HOALearner:
 
                 if move_dependency != None or link_constraints != []:
                     if move_dependency == None:
-                        move_dependency = "NONE"
+                        move_dependency = MOVE_NONE
 
                     self.hoa.add_link(i, j, move_dependency, link_constraints)
     
@@ -427,29 +421,32 @@ class HOALearner:
 
         if i_start == j_start:
             # automata i and j have identical starting positions
-            return "START"
+            return MOVE_START
         
         # automaton j starts after automata i 
-        nei, move = neigh(j_start, i_end)
+        nei, move = neigh_move(j_start, i_end)
         if nei:
             return move
         
         # automata i and j starts at adjacent positions
-        nei, move = neigh(j_start, i_start)
+        nei, move = neigh_move(j_start, i_start)
         if nei:
-            return "START_" + move
+            return MOVE_KIND_START | move
 
         # automaton j starts at/around some middle field marked by automata i
         incidences = []
         for k in range(1, len(vf_i) - 1):
             f_i = vf_i[k]
-            nei, move = neigh(j_start, f_i)
+            nei, move = neigh_move(j_start, f_i)
             if nei:
-                incidences.append("INC_" + move)
+                incidences.append(MOVE_KIND_INC | move)
 
+        # straight incidences are preferred
         if len(incidences) > 0:
-            selinc = min(incidences, key=len)
-            return selinc
+            for inc in incidences:
+                if is_straight_move(inc):
+                    return inc
+            return incidences[0]
 
         return None
 
@@ -460,15 +457,15 @@ class HOALearner:
 
         if i_end == j_end:
             # both automata ends at same position
-            return ["END"]
+            return [MOVE_END]
         
         # automaton j ends at/around some middle field marked by automata i
         incidences = []
         for k in range(1, len(vf_i) - 1):
             f_i = vf_i[k]
-            nei, move = neigh(j_end, f_i)
+            nei, move = neigh_move(j_end, f_i)
             if nei:
-                incidences.append("INC_" + move)
+                incidences.append(MOVE_KIND_INC | move)
         
         return incidences
 
@@ -482,8 +479,8 @@ class HOALearner:
         for i in range(self.dim_x):
             for j in range(self.dim_y): 
                 f = self.matrix[i][j]
-                f_str = str(i) + "-" + str(j)
-                if f != ' ' and f_str not in visited_fields:
+                f_id = cell_id(i, j)
+                if f != ' ' and f_id not in visited_fields:
                     return False
                 
         return True
@@ -499,20 +496,94 @@ class HOALearner:
         return self.hoa
 
 
+"""
+Memo table of automaton results on one matrix: (id of automaton, x, y) ->
+(automaton, results of applying the automaton at (x, y)). A memo table is shared
+by all kernels of one recognition or learning call (nested HOA kernels included),
+so an automaton is applied at a field only once. Automata are kept in the table,
+so their ids are not reused while the table lives. Results are shared and must
+not be modified. The table is cleared when the matrix is modified (the version
+of the grid changes), and invalidate drops results of an automaton that changed
+"""
+class AutomatonMemo:
+    def __init__(self, matrix):
+        self.grid = as_grid(matrix)
+        self.version = self.grid.version
+        self.results = dict()
+        self.hits = 0
+        self.misses = 0
+
+
+    def get(self, automaton, x, y):
+        if self.version != self.grid.version:
+            self.clear()
+
+        entry = self.results.get((id(automaton), x, y))
+        if entry is None:
+            self.misses += 1
+            return None
+        
+        self.hits += 1
+        return entry[1]
+
+
+    def put(self, automaton, x, y, results):
+        self.results[(id(automaton), x, y)] = (automaton, results)
+
+
+    def clear(self):
+        self.results.clear()
+        self.version = self.grid.version
+
+
+    # drop results of an automaton (of all automata if automaton is None)
+    def invalidate(self, automaton=None):
+        if automaton is None:
+            self.clear()
+        else:
+            aid = id(automaton)
+            self.results = {k : v for k, v in self.results.items() if k[0] != aid}
+
+
+    """
+    results of applying an automaton (automaton_type -- "FSM" or "HOA") at (x, y),
+    computed only if they are not in the table
+    """
+    def apply(self, automaton, automaton_type, x, y):
+        results = self.get(automaton, x, y)
+        if results is None:
+            if automaton_type == "FSM":
+                results = apply_fsm(automaton, self.grid, x, y)
+            else:
+                results = HOAPatRecKernel(automaton, self.grid, x, y, self).apply()
+            self.put(automaton, x, y, results)
+
+        return results
+
+
 """
 Pattern recognition based on HOA graphs
 """
 class HOAPatRecKernel:
-    def __init__(self, hoa, input_matrix, x, y):
+    # memo -- memo table of automaton results on the input matrix shared with
+    # other kernels (a new table is used by default)
+    def __init__(self, hoa, input_matrix, x, y, memo=None):
         self.hoa = hoa
-        self.input_matrix = input_matrix
+        self.input_matrix = as_grid(input_matrix)
+        if memo is None:
+            memo = AutomatonMemo(self.input_matrix)
+        elif memo.grid is not self.input_matrix:
+            raise Exception("[ERROR, HOAPatRecKernel] memo table of another matrix")
+        
+        self.memo = memo
         self.x = x
         self.y = y
-        self.dimx = len(input_matrix)
-        self.dimy = len(input_matrix[0])
+        self.dimx = self.input_matrix.dimx
+        self.dimy = self.input_matrix.dimy
         self.activation_time = [0] * hoa.num_nodes
         self.visited_fields = [None] * hoa.num_nodes
         self.all_visisted_fields = []
+        self.all_visited_set = FieldSet(self.dimx, self.dimy)
 
         # activation history
         self.activated_nodes = list()
@@ -521,16 +592,7 @@ class HOAPatRecKernel:
 
 
     def apply_automaton(self, hoa_node, x, y):
-        autom = hoa_node.get_automaton()
-        auto_type = hoa_node.get_automaton_type()
-        prk = None
-        if auto_type == "FSM":
-            prk = FSMPatRecKernel(autom, self.input_matrix, x, y)
-        else:
-            prk = HOAPatRecKernel(autom, self.input_matrix, x, y)   
-
-        rec, t, visited = prk.apply()
-        return rec, t, visited 
+        return self.memo.apply(hoa_node.get_automaton(), hoa_node.get_automaton_type(), x, y)
 
 
     def apply(self):
@@ -543,6 +605,7 @@ class HOAPatRecKernel:
             self.activation_time[0] = t
             self.visited_fields[0] = visited
             self.all_visisted_fields.extend(visited)
+            self.all_visited_set.update(visited)
             self.activated_nodes.append(start_node.get_id())
 
             # do bfs
@@ -571,7 +634,7 @@ class HOAPatRecKernel:
         for s in succs:
             s_id = s.get_id()
             move_type = graph.edges[start_node, s]["move_type"]
-            if move_type != "NONE":
+            if move_type != MOVE_NONE:
                 #print("BFS queue initialization -- ", s_id, move_type)
                 visited_nodes[s_id] = True
                 queue.append((s, 0, move_type))
@@ -613,6 +676,7 @@ class HOAPatRecKernel:
                     # mark the current node as visited
                     self.visited_fields[curr_id] = visited_fields
                     self.all_visisted_fields.extend(visited_fields)
+                    self.all_visited_set.update(visited_fields)
                     self.activation_time[curr_id] = t
 
                     # update activation history
@@ -626,7 +690,7 @@ class HOAPatRecKernel:
                         
                         #print("Processing successor ", s_id, "--->", move_type)
 
-                        if move_type != "NONE":
+                        if move_type != MOVE_NONE:
                             if not visited_nodes[s_id]:
                                 visited_nodes[s_id] = True
                                 queue.append((s, curr_id, move_type))
@@ -650,54 +714,41 @@ class HOAPatRecKernel:
 
 
     def determine_starting_position(self, prev_visited_fields, move_type, automaton_node):
-        if move_type == "START":
-            x, y = parse_field(prev_visited_fields[0])
-            return [[x, y]]
-        elif move_type.startswith("START_"):
-            mt = move_type[6:]
-            x, y = parse_field(prev_visited_fields[0])
-            ind = LT_ARRAY.index(mt)
-            x += dx[ind]
-            y += dy[ind]
-            return [[x, y]]
-        elif move_type in LT_ARRAY:
-            x, y = parse_field(prev_visited_fields[-1])
-            ind = LT_ARRAY.index(move_type)
-            x += dx[ind]
-            y += dy[ind]
+        d = move_type & MOVE_DIR_MASK
+        if move_type == MOVE_START:
+            x, y = cell_xy(prev_visited_fields[0])
             return [[x, y]]
+        elif move_kind(move_type) == MOVE_KIND_START:
+            x, y = cell_xy(prev_visited_fields[0])
+            return [[x + MOVE_DX[d], y + MOVE_DY[d]]]
+        elif move_type < MOVE_ID:
+            x, y = cell_xy(prev_visited_fields[-1])
+            return [[x + MOVE_DX[d], y + MOVE_DY[d]]]
         else:
-            # print("Move type = ", move_type)
+            # incidences (INC_x) and ID moves: starting positions 
+            # at/around middle fields visited by the previous automaton
+            # print("Move type = ", move_name(move_type))
             # print("Automaton", automaton_node.get_id(), " concept", automaton_node.get_concept())
             
             positions = []
+            for i in range(1, len(prev_visited_fields) - 1):
+                x, y = cell_xy(prev_visited_fields[i])
+                x += MOVE_DX[d]
+                y += MOVE_DY[d]
 
-            move = None
-            try:
-                ui = move_type.index("_")
-                move = move_type[(ui + 1):]
-            except ValueError:
-                pass
+                # fields out of the table are never visited
+                if not self.on_table(x, y):
+                    continue
 
-            # print("Move = ", move)
-            
-            for i in range(1, len(prev_visited_fields) - 1):
-                x, y = parse_field(prev_visited_fields[i])
-                if move != None:
-                    ind = LT_ARRAY.index(move)
-                    x += dx[ind]
-                    y += dy[ind]
-
-                field = str(x) + "-" + str(y)
-                if field in self.all_visisted_fields:
+                field = cell_id(x, y)
+                if field in self.all_visited_set:
                     # print("SKIP", field)
                     continue
 
                 # print("Trying automaton at", x, y)
-                if self.on_table(x, y):
-                    rec, _, _ = self.apply_automaton(automaton_node, x, y)
-                    if rec:
-                        positions.append([x, y])
+                rec, _, _ = self.apply_automaton(automaton_node, x, y)
+                if rec:
+                    positions.append([x, y])
 
             return positions
 
@@ -714,16 +765,15 @@ class HOAPatRecKernel:
         vf_i = self.visited_fields[auto_i]
         vf_j = self.visited_fields[auto_j]
         
-        if constraint == "END":
+        if constraint == MOVE_END:
             return vf_i[-1] == vf_j[-1]
-        elif constraint.startswith("INC_"):
-            end_type = constraint[constraint.index("_") + 1:]
-            # print(end_type)
+        elif move_kind(constraint) == MOVE_KIND_INC:
+            end_type = constraint & MOVE_DIR_MASK
             
             j_end = vf_j[-1]
             for k in range(1, len(vf_i) - 1):
                 f_i = vf_i[k]
-                nei, move = neigh(j_end, f_i)
+                nei, move = neigh_move(j_end, f_i)
                 if nei and move == end_type:
                     return True
             
@@ -4,11 +4,12 @@
 #
 # Authors: {svc, lucy}@dmi.uns.ac.rs
 
-from Matrix import load_matrix, print_matrix, determine_first_nonempty_pixel
-from Matrix import num_pixels, parse_field, coverage
+from Matrix import print_matrix, determine_first_nonempty_pixel
+from Matrix import num_pixels, cell_ids_xy, coverage
 from SceneAnalyzer import IdentifyObjects
-from HOAutomaton import HOAPatRecKernel
-from Automaton import FSMPatRecKernel, PatternGraph 
+from SceneStorage import open_scene
+from HOAutomaton import HOAPatRecKernel, AutomatonMemo
+from Automaton import get_pattern_graph
 
 
 def similarity_analysis(ac_scores):
@@ -27,18 +28,29 @@ def similarity_analysis(ac_scores):
     return sim_scores[0]
 
 
-def hoa_inference(mat, automata_memory, show_activation_history):
+"""
+num_pixs and first_pixel (the number of pixels and the first non-empty pixel 
+of mat) are computed if they are not given (e.g. by object descriptors)
+"""
+def hoa_inference(mat, automata_memory, show_activation_history, num_pixs=None, first_pixel=None):
     recognized_concepts = []
     ac_scores = []
     
-    num_pixs = num_pixels(mat)
+    if num_pixs is None:
+        num_pixs = num_pixels(mat)
+
+    pos = first_pixel
+    if pos is None:
+        pos = determine_first_nonempty_pixel(mat)
+
+    # sub-automata results are shared by kernels of all HOAs
+    memo = AutomatonMemo(mat)
 
     for hoa_concept in automata_memory.get_hoa_concepts():
         hoas = automata_memory.get_automata(hoa_concept)
         for hoa in hoas:
-            pos = determine_first_nonempty_pixel(mat)
             #print("Trying", hoa_concept, "at", pos)
-            prk = HOAPatRecKernel(hoa, mat, pos[0], pos[1])
+            prk = HOAPatRecKernel(hoa, memo.grid, pos[0], pos[1], memo)
             rec, _, visited_fields = prk.apply()
             cov_factor = len(set(visited_fields)) / num_pixs
             ac_score = prk.activation_score()
@@ -46,7 +58,7 @@ def hoa_inference(mat, automata_memory, show_activation_history):
             if show_activation_history:
                 prk.print_activation_history()
 
-            recognized = rec and coverage(visited_fields, mat)       
+            recognized = rec and coverage(prk.all_visited_set, mat)
             if recognized:
                 recognized_concepts.append(hoa_concept)
             
@@ -70,7 +82,7 @@ def hoa_inference(mat, automata_memory, show_activation_history):
 
 
 def fsm_inference(mat, automata_memory):
-    pg = PatternGraph(mat)
+    pg = get_pattern_graph(mat)
     starts = pg.start_nodes
 
     if len(starts) == 0:
@@ -78,16 +90,15 @@ def fsm_inference(mat, automata_memory):
 
     msgs = []
 
-    for start in starts:
-        x, y = parse_field(start)
+    xs, ys = cell_ids_xy(starts)
+    results = automata_memory.apply_base_automata(mat, xs, ys, with_visited=False)
+
+    for i in range(len(starts)):
+        x, y = int(xs[i]), int(ys[i])
         for concept in automata_memory.get_base_concepts():
-            fsms = automata_memory.get_automata(concept)
-            noauto = len(fsms)
-            for k in range(noauto):
-                fsm = fsms[k]
-                pkr = FSMPatRecKernel(fsm, mat, x, y)
-                rec, _, _ = pkr.apply()
-                if rec:
+            for k in range(len(automata_memory.get_automata(concept))):
+                res = results.get((concept, k, i))
+                if res is not None and res[0]:
                     msgs.append(concept + " recognized at (" + str(x) + ", " + str(y) + ")")
     
     if len(msgs) == 0:
@@ -98,17 +109,22 @@ def fsm_inference(mat, automata_memory):
             print(m)
 
 
+"""
+only non-empty fields of the scene and object matrices are loaded into memory
+"""
 def inference(scene_file, automata_memory, show_activation_history=False):
-    scene_desc, scene_matrix = load_matrix(scene_file)
+    scene_desc, scene = open_scene(scene_file, sparse=True)
     print(scene_desc, "loaded")
 
-    idobj = IdentifyObjects(scene_matrix)
+    idobj = IdentifyObjects(scene)
     num_objects = idobj.num_objects()
     for i in range(num_objects):
-        mat = idobj.get_object_matrix(i)
+        desc = idobj.get_object_descriptor(i)
+        mat = idobj.get_object_matrix(i, view=True)
         print("\nStarting pattern recognition for: ")
         print_matrix(mat)
-        hoa_inference(mat, automata_memory, show_activation_history=show_activation_history)
+        hoa_inference(mat, automata_memory, show_activation_history, desc.num_pixels, desc.local_first_pixel())
         fsm_inference(mat, automata_memory)
 
+
         
\ No newline at end of file
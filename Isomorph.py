@@ -55,12 +55,12 @@ class FSMIsomorphChecker:
             if b_tran == EMPTY_FSM_SYMBOL and a_tran != EMPTY_FSM_SYMBOL:
                 return False
             
-            a_tran_s, b_tran_s = str(a_tran), str(b_tran)
-            if a_tran_s in self.tran_map:
-                if b_tran_s != self.tran_map[a_tran_s]:
+            # FSM symbols are interned, so they are mapped by identity
+            if a_tran in self.tran_map:
+                if b_tran is not self.tran_map[a_tran]:
                     return False
             else:
-                self.tran_map[a_tran_s] = b_tran_s 
+                self.tran_map[a_tran] = b_tran 
 
         return True
     
@@ -7,6 +7,7 @@
 
 from UnsupervisedLearning import UnsupervisedLearner
 from SupervisedLearning import SupervisedLearner
+from Automaton import learn_simple_concepts
 
 class LearningEngine:
     def __init__(self, automata_memory, verbose=False):
@@ -33,6 +34,23 @@ class LearningEngine:
         ul.identify_and_learn_unknown_concepts()
 
 
+    """
+    supervised learning from many pattern files: FSMs of the patterns are learned
+    in a pool of processes (None -- one process per CPU), then the patterns are
+    learned in their order as by slearn (a recognized pattern is not learned again,
+    complex concepts are tried first) with the FSMs taken from the pool. 
+    The function returns the list of concepts added to the automata memory
+    """
+    def learn_base_concepts(self, pattern_files, processes=None):
+        pattern_files = list(pattern_files)
+        known = set(self.automata_memory.automata)
+        for f, (ok, _, _, _, fsms) in zip(pattern_files, learn_simple_concepts(pattern_files, processes)):
+            sl = SupervisedLearner(f, self.automata_memory, verbose=self.verbose)
+            sl.learn_concept((ok, fsms))
+
+        return [c for c in self.automata_memory.automata if c not in known]
+
+
 """
 if __name__ == "__main__":
     from AutomataMemory import AutomataMemory
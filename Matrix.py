@@ -7,25 +7,307 @@
 import random
 import re
 
+import numpy as np
+
 # Moore neighborhood: offsets
 dx = [-1, -1, -1, 0, 0, 1, 1, 1]
 dy = [-1, 0, 1, -1, 1, -1, 0, 1]
         
 
-# Moore neighborhood: link types in pattern graphs 
+# Moore neighborhood: link types in pattern graphs
 link_type = ["UL", "U", "UR", "L", "R", "DL", "D", "DR"]
 
+# link types leading to fields preceding in row-major order
+BACKWARD_LINKS = [0, 1, 2, 3]
+
+# opposite link types (link type k leads back by link type 7 - k)
+OPPOSITE_LINK = [7 - k for k in range(8)]
+
+# Neighbour masks: bit k of the mask of a field is set 
+# if the neighbour in direction k (dx[k], dy[k]) is non-empty.
+# Degree of a field is the number of set bits (MASK_DEGREE[mask])
+FULL_MASK = 0xFF
+MASK_DEGREE = np.array([bin(m).count("1") for m in range(256)], dtype=np.uint8)
+
+
+# Move codes used by FSMs and HOAs. The low 4 bits hold the direction
+# (index in link_type, MOVE_ID for identical fields, MOVE_NODIR if the
+# move has no direction), the remaining bits hold the kind of the move.
+# String forms ("UL", "EMPTY", "START_U", "INC_DR", "NONE", "END") are
+# used only for printing and persistence
+MOVE_ID = 8
+MOVE_NODIR = 15
+MOVE_DIR_MASK = 0xF
+
+MOVE_KIND_START = 0x10
+MOVE_KIND_INC = 0x20
+MOVE_KIND_EMPTY = 0x40
+MOVE_KIND_NONE = 0x80
+MOVE_KIND_END = 0x100
+
+MOVE_EMPTY = MOVE_KIND_EMPTY | MOVE_NODIR
+MOVE_START = MOVE_KIND_START | MOVE_NODIR
+MOVE_NONE = MOVE_KIND_NONE | MOVE_NODIR
+MOVE_END = MOVE_KIND_END | MOVE_NODIR
+
+# offsets indexed by direction
+MOVE_DX = dx + [0] * 8
+MOVE_DY = dy + [0] * 8
+
+_dir_names = link_type + ["ID"]
+
+_move_names = {MOVE_EMPTY: "EMPTY", MOVE_START: "START", MOVE_NONE: "NONE", MOVE_END: "END"}
+for _d in range(len(_dir_names)):
+    _move_names[_d] = _dir_names[_d]
+    _move_names[MOVE_KIND_START | _d] = "START_" + _dir_names[_d]
+    _move_names[MOVE_KIND_INC | _d] = "INC_" + _dir_names[_d]
+
+_move_codes = {name: code for code, name in _move_names.items()}
+
+
+def move_code(name):
+    code = _move_codes.get(name)
+    if code is None:
+        raise Exception("[ERROR, move_code] Unknown move type " + str(name))
+
+    return code
+
+
+def move_name(code):
+    return _move_names[code]
+
+
+def move_names(codes):
+    return [_move_names[c] for c in codes]
+
+
+def move_dir(code):
+    return code & MOVE_DIR_MASK
+
+
+def move_kind(code):
+    return code & ~MOVE_DIR_MASK
+
+
+# straight moves (U, L, R, D) have no diagonal component
+def is_straight_move(code):
+    d = code & MOVE_DIR_MASK
+    return d < MOVE_ID and (MOVE_DX[d] == 0 or MOVE_DY[d] == 0)
+
+
+# empty fields of a matrix
+EMPTY_SYMBOL = ' '
+EMPTY_CODE = ord(EMPTY_SYMBOL)
+
+
+"""
+Symbol-code table: the code of a symbol is its Unicode code point,
+so codes are shared by all grids and automata. Grids whose symbols
+all have codes below 256 are stored with one byte per field
+"""
+def symbol_code(symbol):
+    return ord(symbol)
+
+
+def code_symbol(code):
+    return chr(code)
+
+
+def code_dtype(max_code):
+    return np.uint8 if max_code <= 0xFF else np.uint32
+
+
+"""
+Grid: 2D matrix of symbols backed by a contiguous array of symbol codes.
+mat[i][j] reads and writes keep working through row views (GridRow), 
+while the analysis routines operate directly on grid.data
+"""
+class Grid:
+    def __init__(self, data):
+        self.data = data
+        self.dimx, self.dimy = data.shape
+        
+        # incremented on every modification, used to invalidate derived data
+        # (direct writes to data have to be followed by modified())
+        self.version = 0
+        self._neighbour_mask = None
+        self._neighbour_mask_version = -1
+
+
+    def __len__(self):
+        return self.dimx
+    
+
+    def __getitem__(self, i):
+        if isinstance(i, tuple):
+            return chr(self.data[i])
+        
+        if i < -self.dimx or i >= self.dimx:
+            raise IndexError("[Grid] row index out of range")
+        
+        return GridRow(self, i)
+    
+
+    def __iter__(self):
+        for i in range(self.dimx):
+            yield GridRow(self, i)
+
+
+    def __setitem__(self, i, symbol):
+        if not isinstance(i, tuple):
+            raise TypeError("[Grid] rows can not be assigned, use mat[i][j] = symbol")
+        
+        self.set_symbol(i[0], i[1], symbol)
+
+
+    def symbol(self, i, j):
+        return chr(self.data[i, j])
+    
+
+    def set_symbol(self, i, j, symbol):
+        code = symbol_code(symbol)
+        self.reserve_code(code)
+        self.data[i, j] = code
+        self.modified()
+
+
+    def set_symbols(self, xs, ys, symbol):
+        code = symbol_code(symbol)
+        self.reserve_code(code)
+        self.data[xs, ys] = code
+        self.modified()
+
+
+    # widens the code array if code does not fit into it
+    def reserve_code(self, code):
+        if code > np.iinfo(self.data.dtype).max:
+            self.data = self.data.astype(np.uint32)
+
+
+    def modified(self):
+        self.version += 1
+
+
+    def foreground(self):
+        return self.data != EMPTY_CODE
+
+
+    # neighbour-mask plane, computed once per version of the grid
+    def neighbour_mask(self):
+        if self._neighbour_mask_version != self.version:
+            self._neighbour_mask = neighbour_mask_plane(self.foreground())
+            self._neighbour_mask_version = self.version
+
+        return self._neighbour_mask
+    
+
+    def row_str(self, i):
+        row = self.data[i]
+        if row.dtype == np.uint8:
+            return row.tobytes().decode("latin-1")
+        
+        return row.astype("<u4").tobytes().decode("utf-32-le")
+    
+
+    def symbol_table(self):
+        codes = np.unique(self.data)
+        return [chr(c) for c in codes if c != EMPTY_CODE]
+    
+
+    def copy(self):
+        return Grid(self.data.copy())
+    
+
+    def nbytes(self):
+        return self.data.nbytes
+
+
+"""
+row of a grid providing list-like access to symbols
+"""
+class GridRow:
+    def __init__(self, grid, i):
+        self.grid = grid
+        self.i = i
+
+
+    def __len__(self):
+        return self.grid.dimy
+    
+
+    def __getitem__(self, j):
+        return chr(self.grid.data[self.i, j])
+    
+
+    def __setitem__(self, j, symbol):
+        self.grid.set_symbol(self.i, j, symbol)
+
+
+    def __iter__(self):
+        return iter(self.grid.row_str(self.i))
+    
+
+    def __str__(self):
+        return self.grid.row_str(self.i)
+
+
+"""
+neighbour masks of all fields given the plane of non-empty fields, 
+computed by comparisons with shifted planes
+"""
+def neighbour_mask_plane(fg):
+    dimx, dimy = fg.shape
+    padded = np.zeros((dimx + 2, dimy + 2), dtype=np.uint8)
+    padded[1:-1, 1:-1] = fg
+
+    mask = np.zeros((dimx, dimy), dtype=np.uint8)
+    for k in range(len(dx)):
+        mask |= padded[1 + dx[k]:1 + dx[k] + dimx, 1 + dy[k]:1 + dy[k] + dimy] << k
+
+    return mask
+
+
+"""
+function creates a grid from a list of strings (rows),
+shorter rows are padded by empty fields
+"""
+def grid_from_lines(lines):
+    dimx = len(lines)
+    dimy = max([len(l) for l in lines], default=0)
+    max_code = max([max(map(ord, l), default=0) for l in lines], default=0)
+    
+    if code_dtype(max_code) == np.uint8:
+        data = np.full((dimx, dimy), EMPTY_CODE, dtype=np.uint8)
+        for i in range(dimx):
+            l = lines[i]
+            data[i, :len(l)] = np.frombuffer(l.encode("latin-1"), dtype=np.uint8)
+    else:
+        data = np.full((dimx, dimy), EMPTY_CODE, dtype=np.uint32)
+        for i in range(dimx):
+            l = lines[i]
+            data[i, :len(l)] = np.frombuffer(l.encode("utf-32-le"), dtype="<u4")
+
+    return Grid(data)
+
+
+"""
+function converts a matrix (list of lists of symbols or Grid) to Grid
+"""
+def as_grid(mat):
+    if isinstance(mat, Grid):
+        return mat
+    
+    if isinstance(mat, SparseScene):
+        return mat.to_grid()
+    
+    return grid_from_lines(["".join(row) for row in mat])
+
 
 """
 Function creates an empty matrix of dimensions <dimx, dimy>
 """
 def create_empty_matrix(dimx, dimy):
-    mat = []
-    for _ in range(dimx):
-        row = [' '] * dimy
-        mat.append(row)
-
-    return mat
+    return Grid(np.full((dimx, dimy), EMPTY_CODE, dtype=np.uint8))
 
 
 """
@@ -34,12 +316,9 @@ populated with symbol with probability p
 """
 def create_random_matrix(dimx, dimy, p, symbol):
     mat = create_empty_matrix(dimx, dimy)
-    for i in range(dimx):
-        for j in range(dimy):
-            r = random.random()
-            if r <= p:
-                mat[i][j] = symbol
-
+    r = np.array([random.random() for _ in range(dimx * dimy)]).reshape((dimx, dimy))
+    xs, ys = np.nonzero(r <= p)
+    mat.set_symbols(xs, ys, symbol)
     return mat
 
 
@@ -49,26 +328,15 @@ it returns the name of the concept or the scene (first line in the file)
 and the matrix of symbols loaded from file (all other lines)
 """
 def load_matrix(file):
+    if file.endswith(".mcmg"):
+        from SceneStorage import load_grid
+        return load_grid(file)
+
     with open(file) as f:
         lines = [line.rstrip() for line in f]
 
     conceptName = lines[0]
-    dimx = len(lines) - 1
-    dimy = 0
-    for i in range(1, len(lines)):
-        l = len(lines[i])
-        if l > dimy:
-            dimy = l
-
-    mat = create_empty_matrix(dimx, dimy)
-    
-    for i in range(1, len(lines)):
-        l = lines[i]
-        for j in range(len(l)):
-            c = l[j]
-            if c != ' ':
-                mat[i - 1][j] = c
-
+    mat = grid_from_lines(lines[1:])
     return conceptName, mat
 
 
@@ -76,47 +344,306 @@ def load_matrix(file):
 simple function to print matrix
 """
 def print_matrix(mat):
+    if isinstance(mat, SparseScene):
+        mat = mat.to_grid()
+
+    if isinstance(mat, Grid):
+        for i in range(mat.dimx):
+            print(mat.row_str(i))
+        return
+    
     for i in range(len(mat)):
         print("".join(mat[i]))
 
 
+"""
+Cell ids: a field (x, y) is identified by the integer (x << CELL_BITS) | y.
+Cell ids do not depend on matrix dimensions, string representations
+("x-y") are used only for printing and persistence
+"""
+CELL_BITS = 32
+CELL_MASK = (1 << CELL_BITS) - 1
+
+def cell_id(x, y):
+    return (x << CELL_BITS) | y
+
+
+def cell_xy(c):
+    return c >> CELL_BITS, c & CELL_MASK
+
+
+def cell_str(c):
+    return str(c >> CELL_BITS) + "-" + str(c & CELL_MASK)
+
+
+def cells_str(cells):
+    return [cell_str(c) for c in cells]
+
+
+"""
+cell ids for coordinate arrays
+"""
+def cell_ids(xs, ys):
+    return (np.asarray(xs, dtype=np.int64) << CELL_BITS) | np.asarray(ys, dtype=np.int64)
+
+
+def cell_ids_xy(cells):
+    cells = np.asarray(cells, dtype=np.int64)
+    return cells >> CELL_BITS, cells & CELL_MASK
+
+
+"""
+Bitmap set of fields (cell ids) of a matrix with dimensions <dimx, dimy>,
+fields outside the matrix are ignored when added and they are never in the set
+"""
+class FieldSet:
+    def __init__(self, dimx, dimy, cells=None):
+        self.dimx = dimx
+        self.dimy = dimy
+        self.plane = np.zeros((dimx, dimy), dtype=bool)
+        if cells is not None:
+            self.update(cells)
+
+
+    def on_plane(self, x, y):
+        return x >= 0 and x < self.dimx and y >= 0 and y < self.dimy
+
+
+    # coordinates of cells (cell ids) in the plane and the mask of such cells
+    def plane_xy(self, cells):
+        xs, ys = cell_ids_xy(cells)
+        inside = (xs >= 0) & (xs < self.dimx) & (ys < self.dimy)
+        return xs[inside], ys[inside], inside
+
+
+    def __contains__(self, c):
+        x, y = c >> CELL_BITS, c & CELL_MASK
+        return self.on_plane(x, y) and bool(self.plane[x, y])
+    
+
+    def add(self, c):
+        x, y = c >> CELL_BITS, c & CELL_MASK
+        if self.on_plane(x, y):
+            self.plane[x, y] = True
+
+
+    def update(self, cells):
+        if isinstance(cells, FieldSet):
+            self.plane |= cells.plane
+        elif len(cells) > 0:
+            xs, ys, _ = self.plane_xy(cells)
+            self.plane[xs, ys] = True
+
+
+    def union(self, other):
+        fs = FieldSet(self.dimx, self.dimy)
+        fs.plane = self.plane | other.plane
+        return fs
+    
+
+    def __or__(self, other):
+        return self.union(other)
+    
+
+    def popcount(self):
+        return int(np.count_nonzero(self.plane))
+    
+
+    def __len__(self):
+        return self.popcount()
+    
+
+    def __iter__(self):
+        xs, ys = np.nonzero(self.plane)
+        return iter(cell_ids(xs, ys).tolist())
+
+
+    # checks whether all non-empty fields of mat are in the set
+    def covers(self, mat):
+        if isinstance(mat, SparseScene):
+            return bool(np.all(self.plane[mat.xs, mat.ys]))
+        
+        return not np.any(as_grid(mat).foreground() & ~self.plane)
+    
+
+    # checks whether any of cells (list of cell ids or FieldSet) is in the set
+    def overlaps(self, cells):
+        if isinstance(cells, FieldSet):
+            return bool(np.any(self.plane & cells.plane))
+        
+        if len(cells) == 0:
+            return False
+        
+        xs, ys, _ = self.plane_xy(cells)
+        return bool(np.any(self.plane[xs, ys]))
+    
+
+    # checks whether cells contain a field (other than skip) that is not in the set
+    # (fields outside the plane are not in the set)
+    def has_new(self, cells, skip=None):
+        if len(cells) == 0:
+            return False
+        
+        ids = np.asarray(cells, dtype=np.int64)
+        xs, ys, inside = self.plane_xy(ids)
+        missing = ~inside
+        missing[inside] = ~self.plane[xs, ys]
+        if skip is not None:
+            missing &= ids != skip
+
+        return bool(np.any(missing))
+
+
+
+"""
+Sparse scene: coordinates and symbol codes of non-empty fields sorted
+in row-major order (i.e. by cell ids). Analysis routines accepting sparse 
+scenes work in time proportional to the number of non-empty fields 
+instead of the area of the scene, which suits low-density scenes 
+(line drawings)
+"""
+class SparseScene:
+    def __init__(self, dimx, dimy, xs, ys, codes):
+        self.dimx = dimx
+        self.dimy = dimy
+
+        ids = cell_ids(xs, ys)
+        order = np.argsort(ids, kind="stable")
+        self.ids = ids[order]
+        self.xs = np.asarray(xs, dtype=np.int64)[order]
+        self.ys = np.asarray(ys, dtype=np.int64)[order]
+        self.codes = np.asarray(codes)[order]
+        self._neighbour_masks = None
+
+
+    def num_pixels(self):
+        return len(self.ids)
+
+
+    # indices of non-empty fields (xs, ys), -1 for empty fields and fields out of the scene
+    def lookup(self, xs, ys):
+        xs = np.asarray(xs, dtype=np.int64)
+        ys = np.asarray(ys, dtype=np.int64)
+        if len(self.ids) == 0:
+            return np.full(xs.shape, -1, dtype=np.int64)
+        
+        inside = (xs >= 0) & (xs < self.dimx) & (ys >= 0) & (ys < self.dimy)
+        ids = cell_ids(np.where(inside, xs, 0), np.where(inside, ys, 0))
+        pos = np.minimum(np.searchsorted(self.ids, ids), len(self.ids) - 1)
+        return np.where(inside & (self.ids[pos] == ids), pos, -1)
+
+
+    """
+    links between adjacent non-empty fields (Moore neighborhood): indices of 
+    source and destination fields and link types (indices in dx and dy),
+    links are ordered by source fields and then by link types.
+    directions -- link types to consider (e.g. BACKWARD_LINKS), all by default
+    """
+    def links(self, directions=None):
+        if directions is None:
+            directions = range(len(dx))
+
+        srcs, dsts, types = [], [], []
+        for k in directions:
+            nei = self.lookup(self.xs + dx[k], self.ys + dy[k])
+            src = np.flatnonzero(nei >= 0)
+            srcs.append(src)
+            dsts.append(nei[src])
+            types.append(np.full(len(src), k, dtype=np.int64))
+
+        src, dst, k = np.concatenate(srcs), np.concatenate(dsts), np.concatenate(types)
+        order = np.lexsort((k, src))
+        return src[order], dst[order], k[order]
+
+
+    # neighbour masks of non-empty fields (in the order of ids)
+    def neighbour_masks(self):
+        if self._neighbour_masks is None:
+            masks = np.zeros(len(self.ids), dtype=np.uint8)
+            for k in range(len(dx)):
+                found = self.lookup(self.xs + dx[k], self.ys + dy[k]) >= 0
+                masks |= found.astype(np.uint8) << k
+            self._neighbour_masks = masks
+
+        return self._neighbour_masks
+
+
+    def symbol(self, i, j):
+        ind = int(self.lookup([i], [j])[0])
+        return EMPTY_SYMBOL if ind == -1 else code_symbol(int(self.codes[ind]))
+
+
+    # symbol codes of fields [x0, x0 + h) x [y0, y0 + w) of the scene
+    def window(self, x0, y0, h, w):
+        lo = np.searchsorted(self.ids, cell_id(int(x0), 0))
+        hi = np.searchsorted(self.ids, cell_id(int(x0 + h), 0))
+        xs, ys, codes = self.xs[lo:hi], self.ys[lo:hi], self.codes[lo:hi]
+        sel = (ys >= y0) & (ys < y0 + w)
+
+        max_code = int(codes.max()) if len(codes) > 0 else 0
+        data = np.full((h, w), EMPTY_CODE, dtype=code_dtype(max_code))
+        data[xs[sel] - x0, ys[sel] - y0] = codes[sel]
+        return data
+
+
+    def to_grid(self):
+        return Grid(self.window(0, 0, self.dimx, self.dimy))
+
+
+"""
+function converts a matrix (list of lists of symbols or Grid) to SparseScene
+"""
+def as_sparse(mat):
+    if isinstance(mat, SparseScene):
+        return mat
+    
+    grid = as_grid(mat)
+    xs, ys = np.nonzero(grid.foreground())
+    return SparseScene(grid.dimx, grid.dimy, xs, ys, grid.data[xs, ys])
+
 """
 function that parses string representation of field coordinates
+(cell ids are accepted as well)
 """
 def parse_field(f):
-    l = re.split("-", f)
-    return int(l[0]), int(l[1])
+    if isinstance(f, str):
+        l = re.split("-", f)
+        return int(l[0]), int(l[1])
+    
+    return cell_xy(f)
 
 
 """
-function that checks whether two fields are neighbours
+function that checks whether two fields (cell ids) are neighbours
 """
 
 def neigh(f1, f2):
-    f1_x, f1_y = parse_field(f1)
-    f2_x, f2_y = parse_field(f2)
-    return _neigh(f1_x, f1_y, f2_x, f2_y)
+    return _neigh(f1 >> CELL_BITS, f1 & CELL_MASK, f2 >> CELL_BITS, f2 & CELL_MASK)
 
 
-def _neigh(f1_x, f1_y, f2_x, f2_y):
-    if f1_x == f2_x and f1_y == f2_y:
-        return True, "ID"
+# link types indexed by (dx + 1) * 3 + (dy + 1)
+_offset_link_type = ["UL", "U", "UR", "L", "ID", "R", "DL", "D", "DR"]
+_offset_move = [move_code(t) for t in _offset_link_type]
 
+def _neigh(f1_x, f1_y, f2_x, f2_y):
     _dx = f1_x - f2_x
     _dy = f1_y - f2_y
 
-    if abs(_dx) <= 1 and abs(_dy) <= 1:
-        lt = ""
-        for i in range(len(link_type)):
-            if _dx == dx[i] and _dy == dy[i]:
-                lt = link_type[i]
-                break
+    if -1 <= _dx <= 1 and -1 <= _dy <= 1:
+        return True, _offset_link_type[(_dx + 1) * 3 + _dy + 1]
+    else:
+        return False, None
+
 
-        if lt == "":
-            print("[Warning, Matrix.py] Strange neighbours: ", _dx, _dy)
-            return False, None
-    
-        return True, lt
+"""
+the same as neigh, but the link type is returned as a move code
+"""
+def neigh_move(f1, f2):
+    _dx = (f1 >> CELL_BITS) - (f2 >> CELL_BITS)
+    _dy = (f1 & CELL_MASK) - (f2 & CELL_MASK)
+
+    if -1 <= _dx <= 1 and -1 <= _dy <= 1:
+        return True, _offset_move[(_dx + 1) * 3 + _dy + 1]
     else:
         return False, None
     
@@ -125,56 +652,58 @@ def _neigh(f1_x, f1_y, f2_x, f2_y):
 function to determine the first nonempty field in a matrix
 """
 def determine_first_nonempty_pixel(mat):
-    dimx, dimy = len(mat), len(mat[0])
-    for i in range(dimx):
-        for j in range(dimy):
-            if mat[i][j] != ' ':
-                return i, j
-            
-    return None
+    fg = as_grid(mat).foreground()
+    if fg.size == 0:
+        return None
+    
+    k = int(np.argmax(fg))
+    if not fg.flat[k]:
+        return None
+    
+    return divmod(k, fg.shape[1])
     
 
+"""
+returns coordinates of non-empty fields (in row-major order)
+"""
+def nonempty_fields(mat):
+    if isinstance(mat, SparseScene):
+        return mat.xs.tolist(), mat.ys.tolist()
+    
+    xs, ys = np.nonzero(as_grid(mat).foreground())
+    return xs.tolist(), ys.tolist()
+
 
 """
-check whether fields set covers matrix mat 
+check whether fields set (FieldSet or collection of cell ids) covers matrix mat 
 """
 def coverage(fields, mat):
-    dimx, dimy = len(mat), len(mat[0])
-    for i in range(dimx):
-        for j in range(dimy): 
-            f = mat[i][j]
-            f_str = str(i) + "-" + str(j)
-            if f != ' ' and f_str not in fields:
-                return False
-                
-    return True
+    if isinstance(mat, SparseScene):
+        if isinstance(fields, FieldSet):
+            return fields.covers(mat)
+        
+        return bool(np.all(np.isin(mat.ids, np.asarray(list(fields), dtype=np.int64))))
+    
+    grid = as_grid(mat)
+    if not isinstance(fields, FieldSet):
+        fields = FieldSet(grid.dimx, grid.dimy, list(fields))
+
+    return fields.covers(grid)
 
 
 """
 returns the number of non-empty pixels
 """
 def num_pixels(mat):
-    dimx, dimy = len(mat), len(mat[0])
-    total = 0
-    for i in range(dimx):
-        for j in range(dimy): 
-            f = mat[i][j]
-            if f != ' ':
-                total += 1
-                
-    return total
+    if isinstance(mat, SparseScene):
+        return mat.num_pixels()
+    
+    return int(np.count_nonzero(as_grid(mat).foreground()))
 
 
 """
 converts matrix to string
 """
 def mat_to_str(mat):
-    dimx, dimy = len(mat), len(mat[0])
-    s = ""
-    for i in range(dimx):
-        for j in range(dimy): 
-            f = mat[i][j]
-            s += f
-        s += "\n"
-                
-    return s
\ No newline at end of file
+    grid = as_grid(mat)
+    return "".join([grid.row_str(i) + "\n" for i in range(grid.dimx)])
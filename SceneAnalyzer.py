@@ -6,9 +6,15 @@ SceneAnalyzer: Identification of objects in a given scene
 Authors: Dusica Knezevic (lucy@dmi.uns.ac.rs), Milos Savic (svc@dmi.uns.ac.rs)
 '''
 
+import os
 import networkx as nx
 
-from Matrix import dx, dy, link_type, parse_field, create_empty_matrix
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+from Matrix import dx, dy, link_type, BACKWARD_LINKS, create_empty_matrix, as_grid, as_sparse, SparseScene, Grid
+from Matrix import cell_id, cells_str, symbol_code, code_symbol, EMPTY_CODE, CELL_BITS, CELL_MASK, FULL_MASK
+from SceneStorage import MappedScene
 
 # Moore neighborhood: offsets
 # dx = [-1, -1, -1, 0, 0, 1, 1, 1]
@@ -17,56 +23,233 @@ from Matrix import dx, dy, link_type, parse_field, create_empty_matrix
 # Moore neighborhood: link types in pattern graphs 
 # link_type = ["UL", "U", "UR", "L", "R", "DL", "D", "DR"]
 
+"""
+Descriptor of an object computed during labeling: bounding box 
+(min_x, min_y, max_x, max_y), number of pixels, the first non-empty 
+pixel (row-major order) and the number of pixels per symbol
+"""
+class ObjectDescriptor:
+    def __init__(self, index, bbox, num_pixels, first_pixel, symbol_histogram):
+        self.index = index
+        self.bbox = bbox
+        self.num_pixels = num_pixels
+        self.first_pixel = first_pixel
+        self.symbol_histogram = symbol_histogram
+        
+        # whether the bounding box contains only pixels of the object 
+        # (determined when the object matrix is requested)
+        self.exclusive = None
+
+
+    def dims(self):
+        return self.bbox[2] - self.bbox[0] + 1, self.bbox[3] - self.bbox[1] + 1
+
+
+    # the first pixel in the object matrix (relative to the bounding box)
+    def local_first_pixel(self):
+        return self.first_pixel[0] - self.bbox[0], self.first_pixel[1] - self.bbox[1]
+
+
+    def print(self):
+        print("Object", self.index, "bbox", self.bbox, "#pixels", self.num_pixels, 
+            "first pixel", self.first_pixel, "symbols", self.symbol_histogram)
+
+
+"""
+Objects are identified in the sparse form of a scene (Matrix.SparseScene),
+so the identification time depends on the number of non-empty pixels
+rather than on the area of the scene. Grids are converted to sparse scenes, 
+mapped scenes (SceneStorage.MappedScene) are scanned row by row, 
+so only non-empty pixels have to fit into memory.
+
+Pixels are labeled by a two-pass algorithm: links to already scanned 
+neighbours (UL, U, UR, L) are unified by union-find and the labels 
+are resolved in the second pass. The result are object labels of pixels, 
+pixel lists and bounding boxes of objects, graphs of objects (networkx) 
+are built only when get_objects is called.
+
+If tile_size (int or pair of ints) is given, the scene is split into tiles 
+which are labeled (in a pool of processes if processes > 1, None -- one 
+process per CPU) and components are merged across tile borders.
+
+Object matrices are copies of scene windows. If a view is requested, object
+matrices of grid scenes are read-only views of the scene grid (without copying)
+when bounding boxes of objects do not contain other pixels, such matrices keep
+the scene alive and must not be stored (e.g. as patterns of learned concepts)
+"""
 class IdentifyObjects:
-    def __init__(self, matrix, remove_internal_pix=False):
-        self.matrix = matrix
-        self.dimx = len(matrix)
-        self.dimy = len(matrix[0])
+    def __init__(self, matrix, remove_internal_pix=False, tile_size=None, processes=1):
+        self.grid = None
+        if isinstance(matrix, MappedScene):
+            self.scene = matrix.to_sparse()
+        elif isinstance(matrix, SparseScene):
+            self.scene = matrix
+        else:
+            self.grid = as_grid(matrix)
+            self.scene = as_sparse(self.grid)
+
+        self.dimx = self.scene.dimx
+        self.dimy = self.scene.dimy
         self.remove_internal_pix = remove_internal_pix
-        self.objects = self.__identify_objects()
-
-
-    # identifies all objects on a scene represented by matrix
-    def __identify_objects(self):
-        objects = [] # result; list of all detected components
-        self.graph = nx.DiGraph()
-
-        for i in range(0, self.dimx):
-            for j in range(0, self.dimy):
-                if self.matrix[i][j] != ' ':
-                    node_id = str(i) + "-" + str(j)
-                    self.graph.add_node(node_id)
-
-        for i in range(0, self.dimx):
-            for j in range(0, self.dimy):
-                if self.matrix[i][j] != ' ':
-                    current_id = str(i) + "-" + str(j)
-                    for k in range(len(dx)):
-                        nei_x = i + dx[k]
-                        nei_y = j + dy[k]
-                        in_range = nei_x >= 0 and nei_x < self.dimx and nei_y >= 0 and nei_y < self.dimy
-                        if in_range and self.matrix[nei_x][nei_y] != ' ':
-                            nei_id = str(nei_x) + "-" + str(nei_y)
-                            self.graph.add_edge(current_id, nei_id, link_type=link_type[k])
+        self.tile_size = tile_size
+        self.processes = processes
+        self.objects = None
+        
+        if tile_size is None:
+            roots, kept = self.__label_pixels()
+        else:
+            roots, kept = self.__label_pixels_tiled()
+
+        self.__resolve_labels(roots, kept)
+
+
+    # first pass: provisional labels (roots of components) of all pixels
+    def __label_pixels(self):
+        n = self.scene.num_pixels()
+        src, dst, _ = self.scene.links(BACKWARD_LINKS)
         
+        kept = np.ones(n, dtype=bool)
         if self.remove_internal_pix:
-            to_remove = []
-            for node in self.graph.nodes:
-                if self.graph.in_degree(node) == 8:
-                    to_remove.append(node)
+            # internal pixels have all 8 neighbours non-empty
+            kept = self.__neighbour_masks() != FULL_MASK
+            link_kept = kept[src] & kept[dst]
+            src, dst = src[link_kept], dst[link_kept]
 
-            self.graph.remove_nodes_from(to_remove)
+        return _union_find(n, src, dst), kept
 
-        components = nx.weakly_connected_components(self.graph)
-        for comp in components:
-            obj = nx.DiGraph()
-            obj.add_nodes_from(comp)
-            obj.add_edges_from((n, nbr, d)
-            for n, nbrs in self.graph.adj.items() if n in comp
-            for nbr, d in nbrs.items() if nbr in comp)
-            objects.append(obj)
 
-        return objects
+    # neighbour masks of non-empty pixels (taken from the grid if available)
+    def __neighbour_masks(self):
+        if self.grid is not None:
+            return self.grid.neighbour_mask()[self.scene.xs, self.scene.ys]
+        
+        return self.scene.neighbour_masks()
+
+
+    # provisional labels obtained labeling tiles of the scene in parallel
+    def __label_pixels_tiled(self):
+        if isinstance(self.tile_size, int):
+            tile_dimx, tile_dimy = self.tile_size, self.tile_size
+        else:
+            tile_dimx, tile_dimy = self.tile_size
+
+        processes = self.processes
+        if processes is None:
+            processes = os.cpu_count() or 1
+
+        tasks = list(self.__tile_tasks(tile_dimx, tile_dimy))
+        if processes <= 1 or len(tasks) <= 1:
+            results = [_label_tile(t) for t in tasks]
+        else:
+            with ProcessPoolExecutor(max_workers=min(processes, len(tasks))) as pool:
+                results = list(pool.map(_label_tile, tasks))
+
+        return self.__merge_tiles(results)
+
+
+    # tiles with a one-pixel halo (non-empty pixels of the tile and its halo)
+    def __tile_tasks(self, tile_dimx, tile_dimy):
+        scene = self.scene
+        for x0 in range(0, self.dimx, tile_dimx):
+            h = min(tile_dimx, self.dimx - x0)
+            lo = np.searchsorted(scene.ids, cell_id(x0 - 1, 0))
+            hi = np.searchsorted(scene.ids, cell_id(x0 + h + 1, 0))
+            band_xs, band_ys = scene.xs[lo:hi], scene.ys[lo:hi]
+            
+            for y0 in range(0, self.dimy, tile_dimy):
+                w = min(tile_dimy, self.dimy - y0)
+                sel = (band_ys >= y0 - 1) & (band_ys < y0 + w + 1)
+                xs, ys = band_xs[sel], band_ys[sel]
+
+                core = (xs >= x0) & (xs < x0 + h) & (ys >= y0) & (ys < y0 + w)
+                if np.any(core):
+                    yield x0, y0, h, w, self.dimx, self.dimy, xs, ys, self.remove_internal_pix
+
+
+    # merges tile components linked across tile borders
+    def __merge_tiles(self, results):
+        ids = self.scene.ids
+        if len(results) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=bool)
+        
+        tile_ids, removed, roots, src, dst = [np.concatenate([r[k] for r in results]) for k in range(5)]
+        order = np.argsort(tile_ids)
+        removed, roots = removed[order], roots[order]
+
+        # roots are the first pixels of tile components, 
+        # so every pixel is preceded by its root
+        parent = np.searchsorted(ids, roots)
+        src, dst = np.searchsorted(ids, src), np.searchsorted(ids, dst)
+        link_kept = ~removed[src] & ~removed[dst]
+        return _union_find(len(ids), src[link_kept], dst[link_kept], parent), ~removed
+
+
+    # second pass: objects are numbered by their first pixels (row-major order)
+    def __resolve_labels(self, roots, kept):
+        scene = self.scene
+        self.labels = np.full(len(roots), -1, dtype=np.int64)
+        _, self.labels[kept] = np.unique(roots[kept], return_inverse=True)
+
+        pix = np.flatnonzero(kept)
+        self.object_pix = pix[np.argsort(self.labels[pix], kind="stable")]
+        counts = np.bincount(self.labels[pix], minlength=0)
+        self.object_starts = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+
+        xs, ys = scene.xs[self.object_pix], scene.ys[self.object_pix]
+        starts = self.object_starts[:-1]
+        if len(starts) > 0:
+            self.bounding_boxes = np.stack([np.minimum.reduceat(xs, starts), np.minimum.reduceat(ys, starts),
+                np.maximum.reduceat(xs, starts), np.maximum.reduceat(ys, starts)], axis=1)
+        else:
+            self.bounding_boxes = np.zeros((0, 4), dtype=np.int64)
+
+        self.descriptors = self.__describe_objects(counts)
+
+
+    def __describe_objects(self, counts):
+        scene = self.scene
+        num_objects = len(counts)
+
+        # symbol histograms: (object, symbol code) pairs counted at once
+        keys = (self.labels[self.object_pix] << CELL_BITS) | scene.codes[self.object_pix].astype(np.int64)
+        keys, key_counts = np.unique(keys, return_counts=True)
+        histograms = [dict() for _ in range(num_objects)]
+        for k, c in zip(keys.tolist(), key_counts.tolist()):
+            histograms[k >> CELL_BITS][code_symbol(k & CELL_MASK)] = c
+
+        bboxes = self.bounding_boxes.tolist()
+        first = self.object_pix[self.object_starts[:-1]]
+        first_xs, first_ys = scene.xs[first].tolist(), scene.ys[first].tolist()
+        counts = counts.tolist()
+
+        return [ObjectDescriptor(o, tuple(bboxes[o]), counts[o], (first_xs[o], first_ys[o]), histograms[o]) 
+            for o in range(num_objects)]
+
+
+    def get_object_descriptor(self, index):
+        return self.descriptors[index]
+
+
+    def get_object_descriptors(self):
+        return self.descriptors
+
+
+    # pixels of the object (arrays of coordinates in row-major order)
+    def object_pixels(self, index):
+        pix = self.object_pix[self.object_starts[index]:self.object_starts[index + 1]]
+        return self.scene.xs[pix], self.scene.ys[pix]
+
+
+    # bounding box of the object: min_x, min_y, max_x, max_y
+    def bounding_box(self, index):
+        return tuple(self.bounding_boxes[index].tolist())
+
+
+    # labels of all fields of the scene (object index, -1 for empty fields)
+    def label_plane(self):
+        plane = np.full((self.dimx, self.dimy), -1, dtype=np.int32)
+        plane[self.scene.xs, self.scene.ys] = self.labels
+        return plane
 
 
     """
@@ -81,42 +264,322 @@ class IdentifyObjects:
         return None
     """
 
+    # graphs of objects are built on the first call
     def get_objects(self):
+        if self.objects is None:
+            self.objects = self.__build_objects()
+
         return self.objects
     
 
+    def __build_objects(self):
+        labels = self.labels
+        src, dst, types = self.scene.links()
+        link_kept = (labels[src] != -1) & (labels[dst] != -1)
+        src, dst, types = src[link_kept], dst[link_kept], types[link_kept]
+        
+        # links grouped by objects, the order of links of a pixel is kept
+        order = np.argsort(labels[src], kind="stable")
+        src, dst, types = src[order], dst[order], types[order]
+        link_starts = np.searchsorted(labels[src], np.arange(self.num_objects() + 1))
+
+        ids = self.scene.ids.tolist()
+        object_pix = self.object_pix.tolist()
+        src, dst, types = src.tolist(), dst.tolist(), types.tolist()
+
+        objects = []
+        for o in range(self.num_objects()):
+            obj = nx.DiGraph()
+            obj.add_nodes_from([ids[p] for p in object_pix[self.object_starts[o]:self.object_starts[o + 1]]])
+            obj.add_edges_from((ids[src[l]], ids[dst[l]], {"link_type": link_type[types[l]]})
+                for l in range(link_starts[o], link_starts[o + 1]))
+            objects.append(obj)
+
+        return objects
+
+
     def num_objects(self):
-        return len(self.objects)
+        return len(self.object_starts) - 1
     
 
-    def get_object_matrix(self, index):
+    # view -- a read-only view of the scene grid is returned if possible
+    def get_object_matrix(self, index, view=False):
         if index >= self.num_objects():
             raise Exception("[ERROR, get_object_matrix] invalid index")
         
-        obj = self.objects[index].nodes
-        no_pixels = len(obj)
-        x_arr, y_arr = [], []
-        for pixel in obj:
-            x, y = parse_field(pixel)
-            x_arr.append(x)
-            y_arr.append(y)
-
-        min_x, min_y = min(x_arr), min(y_arr)
+        desc = self.descriptors[index]
+        min_x, min_y, max_x, max_y = desc.bbox
+        dim_x, dim_y = desc.dims()
+        
+        if self.grid is not None:
+            window = self.grid.data[min_x:max_x + 1, min_y:max_y + 1]
+            if desc.exclusive is None:
+                desc.exclusive = np.count_nonzero(window != EMPTY_CODE) == desc.num_pixels
+            
+            if desc.exclusive:
+                if not view:
+                    return Grid(window.copy())
 
-        for i in range(no_pixels):
-            x_arr[i] -= min_x
-            y_arr[i] -= min_y
+                window = window.view()
+                window.flags.writeable = False
+                return Grid(window)
+        else:
+            window = self.scene.window(min_x, min_y, dim_x, dim_y)
 
-        dim_x, dim_y = max(x_arr) + 1, max(y_arr) + 1
+        x_arr, y_arr = self.object_pixels(index)
         mat = create_empty_matrix(dim_x, dim_y)
-        for i in range(no_pixels):
-            x, y = x_arr[i], y_arr[i]
-            org_x, org_y = x + min_x, y + min_y
-            val = self.matrix[org_x][org_y]
-            mat[x][y] = val
+        mat.reserve_code(int(window.max()))
+        mat.data[x_arr - min_x, y_arr - min_y] = window[x_arr - min_x, y_arr - min_y]
+        
+        return mat
+
+
+"""
+Incremental segmenter for scenes changing by small deltas. The initial 
+labeling is obtained by IdentifyObjects, then pixel additions and removals
+update objects locally: objects touched by added pixels are merged, 
+objects which lost pixels are re-flooded (and possibly split). 
+Objects are identified by keys which remain stable between updates, 
+update returns keys of changed (new or modified) and deleted objects
+"""
+class IncrementalSegmenter:
+    def __init__(self, matrix, remove_internal_pix=False):
+        idobj = IdentifyObjects(matrix, remove_internal_pix)
+        scene = idobj.scene
+        self.dimx = scene.dimx
+        self.dimy = scene.dimy
+        self.remove_internal_pix = remove_internal_pix
+
+        ids = scene.ids.tolist()
+        self.pixels = dict(zip(ids, scene.codes.tolist()))
+        
+        # object key of every pixel included in objects and pixels of objects
+        self.object_of = dict()
+        self.objects = dict()
+        for o in range(idobj.num_objects()):
+            cells = [ids[p] for p in idobj.object_pix[idobj.object_starts[o]:idobj.object_starts[o + 1]].tolist()]
+            self.objects[o] = set(cells)
+            for c in cells:
+                self.object_of[c] = o
+
+        self.next_key = idobj.num_objects()
+
+
+    """
+    applies a delta: added -- list of (x, y, symbol), removed -- list of (x, y),
+    it returns the sets of keys of changed and deleted objects
+    """
+    def update(self, added=None, removed=None):
+        changed, deleted = set(), set()
+        touched = []
+
+        # codes of removed pixels (a pixel removed and added again is modified)
+        removed_codes = dict()
+        for x, y in removed or []:
+            c = cell_id(x, y)
+            if c in self.pixels:
+                removed_codes.setdefault(c, self.pixels.pop(c))
+                touched.append(c)
+
+        for x, y, symbol in added or []:
+            if x < 0 or x >= self.dimx or y < 0 or y >= self.dimy:
+                raise Exception("[ERROR, IncrementalSegmenter] pixel out of the scene: " + str((x, y)))
+            
+            c = cell_id(x, y)
+            code = symbol_code(symbol)
+            if c in self.pixels:
+                if self.pixels[c] != code and c in self.object_of:
+                    changed.add(self.object_of[c])
+            else:
+                if removed_codes.get(c, code) != code and c in self.object_of:
+                    changed.add(self.object_of[c])
+                touched.append(c)
+            self.pixels[c] = code
+
+        # pixels whose inclusion in objects may change
+        candidates = set(touched)
+        if self.remove_internal_pix:
+            for c in touched:
+                candidates.update(self.__neighbours(c))
+
+        leaving = [c for c in candidates if c in self.object_of and not self.__kept(c)]
+        entering = [c for c in candidates if c not in self.object_of and self.__kept(c)]
+
+        # removals: objects losing pixels are re-flooded
+        dirty = set()
+        for c in leaving:
+            key = self.object_of.pop(c)
+            self.objects[key].discard(c)
+            dirty.add(key)
+
+        for key in dirty:
+            self.__reflood(key, changed, deleted)
+
+        # additions: objects of neighbouring pixels are merged
+        for c in sorted(entering):
+            keys = set([self.object_of[n] for n in self.__neighbours(c) if n in self.object_of])
+            if len(keys) == 0:
+                key = self.__new_object()
+            else:
+                key = max(keys, key=lambda k: len(self.objects[k]))
+                for k in keys:
+                    if k != key:
+                        self.__merge(key, k)
+                        deleted.add(k)
+
+            self.objects[key].add(c)
+            self.object_of[c] = key
+            changed.add(key)
+
+        changed -= deleted
+        deleted -= set(self.objects.keys())
+        return changed, deleted
+
+
+    def __neighbours(self, c):
+        x, y = c >> CELL_BITS, c & CELL_MASK
+        return [cell_id(x + dx[k], y + dy[k]) for k in range(len(dx)) 
+            if x + dx[k] >= 0 and x + dx[k] < self.dimx and y + dy[k] >= 0 and y + dy[k] < self.dimy]
+
+
+    # non-empty pixel is included in objects unless it is an internal pixel to be removed
+    def __kept(self, c):
+        if c not in self.pixels:
+            return False
+        
+        if not self.remove_internal_pix:
+            return True
         
+        return sum([1 for n in self.__neighbours(c) if n in self.pixels]) != 8
+
+
+    def __new_object(self):
+        key = self.next_key
+        self.next_key += 1
+        self.objects[key] = set()
+        return key
+
+
+    def __merge(self, key, other):
+        for c in self.objects[other]:
+            self.object_of[c] = key
+        self.objects[key] |= self.objects.pop(other)
+
+
+    # splits the object into connected components, the largest component keeps the key
+    def __reflood(self, key, changed, deleted):
+        remaining = self.objects.pop(key)
+        components = []
+        while len(remaining) > 0:
+            start = remaining.pop()
+            comp = set([start])
+            stack = [start]
+            while len(stack) > 0:
+                c = stack.pop()
+                for n in self.__neighbours(c):
+                    if n in remaining:
+                        remaining.discard(n)
+                        comp.add(n)
+                        stack.append(n)
+            components.append(comp)
+
+        if len(components) == 0:
+            deleted.add(key)
+            return
+
+        components.sort(key=len, reverse=True)
+        self.objects[key] = components[0]
+        changed.add(key)
+        for comp in components[1:]:
+            new_key = self.__new_object()
+            self.objects[new_key] = comp
+            for c in comp:
+                self.object_of[c] = new_key
+            changed.add(new_key)
+
+
+    def num_objects(self):
+        return len(self.objects)
+    
+
+    def object_keys(self):
+        return list(self.objects.keys())
+
+
+    # cells of the object in row-major order
+    def get_object_cells(self, key):
+        return sorted(self.objects[key])
+
+
+    def get_object_matrix(self, key):
+        cells = self.get_object_cells(key)
+        xs = [c >> CELL_BITS for c in cells]
+        ys = [c & CELL_MASK for c in cells]
+        min_x, min_y = min(xs), min(ys)
+
+        mat = create_empty_matrix(max(xs) - min_x + 1, max(ys) - min_y + 1)
+        for c, x, y in zip(cells, xs, ys):
+            mat.set_symbol(x - min_x, y - min_y, code_symbol(self.pixels[c]))
+
         return mat
+
+
+    # objects as lists of cells ordered by their first pixels (as in IdentifyObjects)
+    def get_objects_cells(self):
+        return sorted([self.get_object_cells(k) for k in self.objects])
+
+
+"""
+union-find over n elements linked by (src[k], dst[k]) links,
+every element ends up pointing to the first element (the root) of its component. 
+parent -- initial forest (every element preceded by its parent)
+"""
+def _union_find(n, src, dst, parent=None):
+    parent = np.arange(n) if parent is None else parent.copy()
+    while True:
+        # pointer jumping: every element points to its root
+        while True:
+            grand = parent[parent]
+            if np.array_equal(grand, parent):
+                break
+            parent = grand
+
+        ps, pd = parent[src], parent[dst]
+        diff = ps != pd
+        if not np.any(diff):
+            return parent
+
+        # hook larger roots to smaller ones
+        np.minimum.at(parent, np.maximum(ps[diff], pd[diff]), np.minimum(ps[diff], pd[diff]))
+
+
+"""
+labels non-empty pixels of a tile [x0, x0 + h) x [y0, y0 + w) given
+pixels of the tile and its halo (xs, ys). Links of tile pixels leading
+to already scanned halo pixels are later used to merge components of tiles
+"""
+def _label_tile(task):
+    x0, y0, h, w, dimx, dimy, xs, ys, remove_internal_pix = task
+    region = SparseScene(dimx, dimy, xs, ys, np.zeros(len(xs), dtype=np.uint8))
+    n = region.num_pixels()
+    core = (region.xs >= x0) & (region.xs < x0 + h) & (region.ys >= y0) & (region.ys < y0 + w)
     
+    src, dst, _ = region.links(BACKWARD_LINKS)
+    removed = np.zeros(n, dtype=bool)
+    if remove_internal_pix:
+        # all neighbours of tile pixels are in the region
+        removed = region.neighbour_masks() == FULL_MASK
+
+    # every link is reported by the tile of its source pixel
+    from_core = core[src]
+    src, dst = src[from_core], dst[from_core]
+    
+    inner = core[dst] & ~removed[src] & ~removed[dst]
+    labels = _union_find(n, src[inner], dst[inner])
+
+    ids = region.ids
+    return ids[core], removed[core], ids[labels[core]], ids[src], ids[dst]
+
 
 if __name__ == "__main__":
     from Matrix import load_matrix, print_matrix
@@ -128,7 +591,7 @@ if __name__ == "__main__":
     
     for i in range(no):
         obj = objs[i]
-        print(obj.nodes)
+        print(cells_str(obj.nodes))
 
         mat = idobj.get_object_matrix(i)
         print_matrix(mat)
@@ -0,0 +1,117 @@
+# Meta-cognitive machines
+#
+# Scene batch module: segmentation of many scene files
+# (a directory or a glob pattern) in a pool of processes
+#
+# Authors: {svc, lucy}@dmi.uns.ac.rs
+
+import glob
+import os
+import sys
+
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from SceneStorage import load_sparse, MCMG_EXTENSION
+from SceneAnalyzer import IdentifyObjects
+
+# extensions of scene files taken from directories
+SCENE_EXTENSIONS = [".txt", MCMG_EXTENSION]
+
+
+"""
+function returns scene files given by a directory
+(all scene files in the directory) or a glob pattern, sorted by name
+"""
+def scene_files(path):
+    if os.path.isdir(path):
+        files = [os.path.join(path, f) for f in os.listdir(path)]
+        return sorted([f for f in files if os.path.isfile(f) and os.path.splitext(f)[1] in SCENE_EXTENSIONS])
+
+    return sorted(glob.glob(path))
+
+
+"""
+segmentation of one scene file (executed by workers),
+it returns the scene name and the list of (object descriptor, object matrix) pairs
+"""
+def analyze_scene(scene_file, remove_internal_pix=False, with_matrices=False):
+    scene_name, scene = load_sparse(scene_file)
+    idobj = IdentifyObjects(scene, remove_internal_pix)
+
+    objects = []
+    for i in range(idobj.num_objects()):
+        mat = idobj.get_object_matrix(i) if with_matrices else None
+        objects.append((idobj.get_object_descriptor(i), mat))
+
+    return scene_name, objects
+
+
+"""
+Generator segmenting scene files (list of files, a directory or a glob pattern)
+in a pool of processes (None -- one process per CPU). It yields tuples
+(scene file, scene name, object descriptor, object matrix) in the order in which
+the scenes are completed, object matrices are included if with_matrices is True.
+At most max_pending scenes (2 per process by default) are submitted to the pool
+at a time, so memory does not depend on the number of scene files
+"""
+def analyze_scenes(scenes, processes=None, remove_internal_pix=False, with_matrices=False, max_pending=None):
+    if isinstance(scenes, str):
+        scenes = scene_files(scenes)
+
+    if processes is None:
+        processes = os.cpu_count() or 1
+
+    if max_pending is None:
+        max_pending = 2 * processes
+
+    files = iter(scenes)
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        pending = dict()
+        while True:
+            while len(pending) < max_pending:
+                f = next(files, None)
+                if f is None:
+                    break
+                pending[pool.submit(analyze_scene, f, remove_internal_pix, with_matrices)] = f
+
+            if len(pending) == 0:
+                return
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                f = pending.pop(future)
+                try:
+                    scene_name, objects = future.result()
+                except Exception as e:
+                    print("[Warning, analyze_scenes] scene", f, "skipped:", e)
+                    continue
+
+                for desc, mat in objects:
+                    yield f, scene_name, desc, mat
+
+
+#
+# python3 SceneBatch.py test_files [-p 4] [-rip]
+# python3 SceneBatch.py "test_files/scene*.txt"
+#
+if __name__ == "__main__":
+    args = sys.argv[1:]
+
+    if len(args) == 0 or "-h" in args:
+        print("Help:")
+        print("First argument: directory or glob pattern of scene files (quote glob patterns)")
+        print("-p N: number of worker processes (default: number of CPUs)")
+        print("-rip: remove internal pixels of objects")
+    else:
+        processes = None
+        if "-p" in args:
+            processes = int(args[args.index("-p") + 1])
+
+        remove_internal_pix = "-rip" in args
+
+        num_objects = dict()
+        for f, scene_name, desc, _ in analyze_scenes(args[0], processes, remove_internal_pix):
+            num_objects[f] = num_objects.get(f, 0) + 1
+            print(f, scene_name, "object", desc.index, "bbox", desc.bbox, "#pixels", desc.num_pixels, "symbols", desc.symbol_histogram)
+
+        print("#scenes with objects", len(num_objects), "#objects", sum(num_objects.values()))
@@ -5,7 +5,10 @@
 # 
 # Authors: {svc, lucy}@dmi.uns.ac.rs
 
+import numpy as np
+
 from Matrix import create_empty_matrix, print_matrix, mat_to_str
+from SceneStorage import save_grid, MCMG_EXTENSION
 
 import pybresenham as geom
 
@@ -28,10 +31,13 @@ class SceneGenerator:
 
 
     def populate_matrix(self, points):
-        for p in points:
-            x, y = p[0], p[1]
-            if x >= 0 and x <= self.dimx and y >= 0 and y <= self.dimy:
-                self.M[x][y] = self.symbol
+        if len(points) == 0:
+            return
+        
+        pts = np.array(points, dtype=np.int64).reshape((-1, 2))
+        x, y = pts[:, 0], pts[:, 1]
+        inside = (x >= 0) & (x <= self.dimx) & (y >= 0) & (y <= self.dimy)
+        self.M.set_symbols(x[inside], y[inside], self.symbol)
 
 
     def draw_circle(self, centerx, centery, radius):
@@ -54,7 +60,11 @@ class SceneGenerator:
         self.populate_matrix(points)
 
 
-    def save(self, file_name, pattern=""):
+    def save(self, file_name, pattern="", binary=False):
+        if binary:
+            save_grid(file_name + MCMG_EXTENSION, self.M, name=pattern)
+            return
+
         s = mat_to_str(self.M)
         if pattern == "":
             fn = file_name + ".txt"
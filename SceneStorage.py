@@ -0,0 +1,456 @@
+# Meta-cognitive machines
+#
+# Scene storage module: loading of very large scenes
+# (memory-mapped text scenes exposing rows and tiles lazily)
+# and the compact binary grid format (.mcmg)
+#
+# Authors: {svc, lucy}@dmi.uns.ac.rs
+
+import base64
+import mmap
+import struct
+import zlib
+
+import numpy as np
+
+from Matrix import Grid, SparseScene, EMPTY_CODE, code_dtype, as_grid
+
+# size of chunks used when scanning mapped files
+SCAN_CHUNK = 1 << 24
+
+# bytes removed from line ends (the same as str.rstrip for ASCII)
+_WHITESPACE = np.zeros(256, dtype=bool)
+_WHITESPACE[[9, 10, 11, 12, 13, 28, 29, 30, 31, 32]] = True
+
+
+"""
+Memory-mapped text scene (the format used by load_matrix: the first line
+is the name of the scene, other lines are rows of the matrix). Only the line
+index is kept in memory, rows and tiles are decoded on request, so scenes
+larger than RAM can be analyzed row by row or tile by tile
+"""
+class MappedScene:
+    def __init__(self, file):
+        self.file = file
+        self.f = open(file, "rb")
+        size = self.f.seek(0, 2)
+        self.mm = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ) if size > 0 else None
+        self.buf = np.frombuffer(self.mm, dtype=np.uint8) if size > 0 else np.zeros(0, dtype=np.uint8)
+
+        starts, stops = self.index_lines()
+        if len(starts) == 0:
+            raise Exception("[ERROR, MappedScene] empty scene file " + file)
+
+        self.name = bytes(self.buf[starts[0]:stops[0]]).decode("utf-8").rstrip()
+
+        # rows of the matrix: [start, stop) byte ranges without trailing whitespace
+        self.starts = starts[1:]
+        self.stops = stops[1:].copy()
+        self.lengths = np.zeros(len(self.starts), dtype=np.int64)
+        self.ascii = True
+        for i in range(len(self.starts)):
+            seg = self.buf[self.starts[i]:self.stops[i]]
+            keep = np.flatnonzero(~_WHITESPACE[seg])
+            end = int(keep[-1]) + 1 if len(keep) > 0 else 0
+            self.stops[i] = self.starts[i] + end
+            seg = seg[:end]
+            if end > 0 and seg.max() >= 0x80:
+                # UTF-8 encoded row, count characters instead of bytes
+                self.ascii = False
+                self.lengths[i] = int(np.count_nonzero((seg & 0xC0) != 0x80))
+            else:
+                self.lengths[i] = end
+
+        self.dimx = len(self.starts)
+        self.dimy = int(self.lengths.max()) if self.dimx > 0 else 0
+
+
+    def index_lines(self):
+        size = len(self.buf)
+        newlines = []
+        for off in range(0, size, SCAN_CHUNK):
+            chunk = self.buf[off:off + SCAN_CHUNK]
+            newlines.append(np.flatnonzero(chunk == 10) + off)
+
+        nl = np.concatenate(newlines) if len(newlines) > 0 else np.zeros(0, dtype=np.int64)
+        starts = np.concatenate(([0], nl + 1)).astype(np.int64)
+        stops = np.concatenate((nl, [size])).astype(np.int64)
+
+        # no line after the last line break
+        if starts[-1] == size:
+            starts, stops = starts[:-1], stops[:-1]
+
+        return starts, stops
+
+
+    def __len__(self):
+        return self.dimx
+
+
+    """
+    symbol codes of the row i padded to the scene width (a fresh array)
+    """
+    def row_codes(self, i, y0=0, width=None):
+        if width is None:
+            width = self.dimy - y0
+
+        seg = self.buf[self.starts[i]:self.stops[i]]
+        if len(seg) > 0 and seg.max() >= 0x80:
+            s = bytes(seg).decode("utf-8")
+            seg = np.frombuffer(s.encode("utf-32-le"), dtype="<u4")
+            seg = seg.astype(code_dtype(int(seg.max())))
+
+        out = np.full(width, EMPTY_CODE, dtype=seg.dtype)
+        lo = max(y0, 0)
+        part = seg[lo:max(y0 + width, lo)]
+        out[lo - y0:lo - y0 + len(part)] = part
+        return out
+
+
+    def rows(self, start=0, stop=None):
+        if stop is None:
+            stop = self.dimx
+
+        for i in range(start, stop):
+            yield i, self.row_codes(i)
+
+
+    """
+    grid with fields [x0, x0 + h) x [y0, y0 + w) of the scene,
+    fields out of the scene are empty
+    """
+    def tile(self, x0, y0, h, w):
+        rows = []
+        for i in range(x0, x0 + h):
+            if i >= 0 and i < self.dimx:
+                rows.append(self.row_codes(i, y0, w))
+            else:
+                rows.append(np.full(w, EMPTY_CODE, dtype=np.uint8))
+
+        dtype = np.uint32 if any([r.dtype == np.uint32 for r in rows]) else np.uint8
+        data = np.full((h, w), EMPTY_CODE, dtype=dtype)
+        for k in range(h):
+            data[k] = rows[k]
+
+        return Grid(data)
+
+
+    def tiles(self, tile_dimx, tile_dimy):
+        for x0 in range(0, self.dimx, tile_dimx):
+            for y0 in range(0, self.dimy, tile_dimy):
+                h, w = min(tile_dimx, self.dimx - x0), min(tile_dimy, self.dimy - y0)
+                yield x0, y0, self.tile(x0, y0, h, w)
+
+
+    def to_grid(self):
+        return self.tile(0, 0, self.dimx, self.dimy)
+
+
+    # non-empty fields of the scene, only one row is decoded at a time
+    def to_sparse(self):
+        xs, ys, codes = [], [], []
+        for i in range(self.dimx):
+            row = self.row_codes(i, 0, int(self.lengths[i]))
+            nz = np.flatnonzero(row != EMPTY_CODE)
+            if len(nz) > 0:
+                xs.append(np.full(len(nz), i, dtype=np.int64))
+                ys.append(nz)
+                codes.append(row[nz])
+
+        if len(xs) == 0:
+            return SparseScene(self.dimx, self.dimy, [], [], np.zeros(0, dtype=np.uint8))
+        
+        dtype = np.uint32 if any([c.dtype == np.uint32 for c in codes]) else np.uint8
+        codes = np.concatenate([c.astype(dtype) for c in codes])
+        return SparseScene(self.dimx, self.dimy, np.concatenate(xs), np.concatenate(ys), codes)
+
+
+    def close(self):
+        # numpy views have to be released before the map is closed
+        self.buf = None
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
+        self.f.close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+"""
+function opens a scene file without loading it into memory,
+it returns the name of the scene and the mapped scene
+(the same contract as load_matrix), binary scenes are loaded.
+If sparse is True, the scene is returned as a sparse scene (Matrix.SparseScene)
+"""
+def open_scene(file, sparse=False):
+    if sparse:
+        return load_sparse(file)
+    
+    if is_mcmg_file(file):
+        return load_grid(file)
+
+    scene = MappedScene(file)
+    return scene.name, scene
+
+
+"""
+function loads non-empty fields of a scene (text or binary file),
+it returns the name of the scene and the sparse scene
+"""
+def load_sparse(file):
+    if is_mcmg_file(file):
+        name, dimx, dimy, xs, ys, lengths, codes = read_runs(file)
+        px, py, pc = runs_to_pixels(xs, ys, lengths, codes)
+        pc = pc.astype(code_dtype(int(pc.max()) if len(pc) > 0 else 0))
+        return name, SparseScene(dimx, dimy, px, py, pc)
+    
+    with MappedScene(file) as scene:
+        return scene.name, scene.to_sparse()
+
+
+
+"""
+Binary grid format (.mcmg). All numbers are little-endian:
+
+  header:  b"MCMG", version (u8), flags (u8, bit 0: zlib compressed body),
+           dimx (u32), dimy (u32), number of runs (u64),
+           concept name (u16 length + UTF-8 bytes),
+           symbol table (u16 size + u32 symbol codes), body length (u64)
+  body:    runs of non-empty symbols stored column-wise:
+           runs per row (u32 x dimx), gap from the end of the previous
+           run in the row (u32 x runs), run length (u32 x runs) and
+           symbol table index (u8 or u16 x runs)
+
+Empty fields are not stored, so the size of a file and the time needed
+to read it depend on the number of pixels rather than on the scene area
+"""
+MCMG_EXTENSION = ".mcmg"
+MCMG_MAGIC = b"MCMG"
+MCMG_VERSION = 1
+MCMG_ZLIB = 1
+
+# prefix of grids encoded as strings (for Neo4j node properties)
+MCMG_STR_PREFIX = "mcmg:"
+
+_MCMG_HEADER = struct.Struct("<4sBBIIQ")
+
+
+def is_mcmg_file(file):
+    return file.endswith(MCMG_EXTENSION)
+
+
+"""
+runs of non-empty symbols in rows (given as a 2D array of symbol codes),
+rows are numbered from x0
+"""
+def grid_runs(data, x0=0):
+    dimx, dimy = data.shape
+    if dimx == 0 or dimy == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=data.dtype)
+
+    change = np.ones((dimx, dimy), dtype=bool)
+    change[:, 1:] = data[:, 1:] != data[:, :-1]
+    pos = np.flatnonzero(change)
+    lengths = np.diff(np.append(pos, dimx * dimy))
+    codes = data.ravel()[pos]
+
+    nonempty = codes != EMPTY_CODE
+    pos, lengths, codes = pos[nonempty], lengths[nonempty], codes[nonempty]
+    return pos // dimy + x0, pos % dimy, lengths, codes
+
+
+def _runs_body(dimx, xs, ys, lengths, codes):
+    table = np.unique(codes)
+    symbols = np.searchsorted(table, codes)
+    symbols = symbols.astype(np.uint8 if len(table) <= 0x100 else np.uint16)
+
+    row_counts = np.bincount(xs, minlength=dimx).astype("<u4")
+
+    # gaps between runs in a row
+    ends = ys + lengths
+    prev_end = np.zeros(len(ys), dtype=np.int64)
+    same_row = np.zeros(len(ys), dtype=bool)
+    same_row[1:] = xs[1:] == xs[:-1]
+    prev_end[1:] = ends[:-1]
+    gaps = np.where(same_row, ys - prev_end, ys)
+
+    body = row_counts.tobytes() + gaps.astype("<u4").tobytes() + lengths.astype("<u4").tobytes() + symbols.tobytes()
+    return table, body
+
+
+def _mcmg_bytes(name, dimx, dimy, xs, ys, lengths, codes, compress):
+    table, body = _runs_body(dimx, xs, ys, lengths, codes)
+    flags = 0
+    if compress:
+        body = zlib.compress(body)
+        flags |= MCMG_ZLIB
+
+    name_bytes = name.encode("utf-8")
+    return b"".join([
+        _MCMG_HEADER.pack(MCMG_MAGIC, MCMG_VERSION, flags, dimx, dimy, len(xs)),
+        struct.pack("<H", len(name_bytes)), name_bytes,
+        struct.pack("<H", len(table)), table.astype("<u4").tobytes(),
+        struct.pack("<Q", len(body)), body])
+
+
+def _write_mcmg(file, name, dimx, dimy, xs, ys, lengths, codes, compress):
+    with open(file, "wb") as f:
+        f.write(_mcmg_bytes(name, dimx, dimy, xs, ys, lengths, codes, compress))
+
+
+"""
+function saves grid (or list of lists) mat to binary file
+"""
+def save_grid(file, mat, name="", compress=True):
+    grid = as_grid(mat)
+    xs, ys, lengths, codes = grid_runs(grid.data)
+    _write_mcmg(file, name, grid.dimx, grid.dimy, xs, ys, lengths, codes, compress)
+
+
+"""
+function reads runs from binary file, it returns the concept name, 
+dimensions and runs (row, column, length and symbol code of each run)
+"""
+def read_runs(file):
+    with open(file, "rb") as f:
+        return parse_runs(f.read(), file)
+
+
+def parse_runs(buf, source="<bytes>"):
+    magic, version, flags, dimx, dimy, nruns = _MCMG_HEADER.unpack_from(buf, 0)
+    if magic != MCMG_MAGIC or version != MCMG_VERSION:
+        raise Exception("[ERROR, parse_runs] not a MCMG (version " + str(MCMG_VERSION) + ") grid: " + source)
+
+    off = _MCMG_HEADER.size
+    name_len, = struct.unpack_from("<H", buf, off)
+    off += 2
+    name = buf[off:off + name_len].decode("utf-8")
+    off += name_len
+
+    table_len, = struct.unpack_from("<H", buf, off)
+    off += 2
+    table = np.frombuffer(buf, dtype="<u4", count=table_len, offset=off).astype(np.int64)
+    off += 4 * table_len
+
+    body_len, = struct.unpack_from("<Q", buf, off)
+    off += 8
+    body = buf[off:off + body_len]
+    if flags & MCMG_ZLIB:
+        body = zlib.decompress(body)
+
+    sym_dtype = np.uint8 if table_len <= 0x100 else np.dtype("<u2")
+    row_counts = np.frombuffer(body, dtype="<u4", count=dimx, offset=0).astype(np.int64)
+    off = 4 * dimx
+    gaps = np.frombuffer(body, dtype="<u4", count=nruns, offset=off).astype(np.int64)
+    off += 4 * nruns
+    lengths = np.frombuffer(body, dtype="<u4", count=nruns, offset=off).astype(np.int64)
+    off += 4 * nruns
+    symbols = np.frombuffer(body, dtype=sym_dtype, count=nruns, offset=off)
+
+    xs = np.repeat(np.arange(dimx, dtype=np.int64), row_counts)
+
+    # columns: gaps and lengths of previous runs accumulated within rows
+    steps = gaps.copy()
+    same_row = np.zeros(nruns, dtype=bool)
+    same_row[1:] = xs[1:] == xs[:-1]
+    steps[1:] += np.where(same_row[1:], lengths[:-1], 0)
+    csum = np.cumsum(steps)
+    row_first = (np.cumsum(row_counts) - row_counts)[xs]
+    ys = csum - csum[row_first] + steps[row_first]
+
+    return name, dimx, dimy, xs, ys, lengths, table[symbols]
+
+
+"""
+fields covered by runs: coordinates and symbol codes of all pixels
+"""
+def runs_to_pixels(xs, ys, lengths, codes):
+    px = np.repeat(xs, lengths)
+    run_start = np.repeat(np.cumsum(lengths) - lengths, lengths)
+    py = np.repeat(ys, lengths) + np.arange(len(px)) - run_start
+    return px, py, np.repeat(codes, lengths)
+
+
+"""
+function loads a grid from binary file, 
+it returns the concept name and the grid (the same contract as load_matrix)
+"""
+def load_grid(file):
+    return _runs_to_grid(read_runs(file))
+
+
+def _runs_to_grid(runs):
+    name, dimx, dimy, xs, ys, lengths, codes = runs
+    max_code = int(codes.max()) if len(codes) > 0 else 0
+    data = np.full((dimx, dimy), EMPTY_CODE, dtype=code_dtype(max_code))
+    px, py, pc = runs_to_pixels(xs, ys, lengths, codes)
+    data[px, py] = pc
+    return name, Grid(data)
+
+
+"""
+conversion of text scenes and patterns (.txt, .pat) to binary files, 
+the text file is scanned row by row
+"""
+def convert_text_to_mcmg(text_file, mcmg_file=None, compress=True):
+    if mcmg_file is None:
+        mcmg_file = text_file.rsplit(".", 1)[0] + MCMG_EXTENSION
+
+    with MappedScene(text_file) as scene:
+        runs = []
+        for i, codes in scene.rows():
+            r = grid_runs(codes.reshape((1, -1)), x0=i)
+            if len(r[0]) > 0:
+                runs.append(r)
+
+        if len(runs) > 0:
+            xs, ys, lengths, codes = [np.concatenate([r[k] for r in runs]) for k in range(4)]
+        else:
+            xs, ys, lengths, codes = grid_runs(np.zeros((0, 0), dtype=np.uint8))
+
+        _write_mcmg(mcmg_file, scene.name, scene.dimx, scene.dimy, xs, ys, lengths, codes, compress)
+
+    return mcmg_file
+
+
+def convert_mcmg_to_text(mcmg_file, text_file):
+    name, grid = load_grid(mcmg_file)
+    with open(text_file, "w") as f:
+        f.write(name + "\n")
+        for i in range(grid.dimx):
+            f.write(grid.row_str(i).rstrip() + "\n")
+
+
+"""
+grids encoded as strings (base64 of the binary format),
+used to store patterns as node properties 
+"""
+def grid_to_str(mat, name=""):
+    grid = as_grid(mat)
+    xs, ys, lengths, codes = grid_runs(grid.data)
+    buf = _mcmg_bytes(name, grid.dimx, grid.dimy, xs, ys, lengths, codes, True)
+    return MCMG_STR_PREFIX + base64.b64encode(buf).decode("ascii")
+
+
+def str_to_grid(s):
+    buf = base64.b64decode(s[len(MCMG_STR_PREFIX):])
+    return _runs_to_grid(parse_runs(buf))[1]
+
+
+def is_grid_str(s):
+    return s.startswith(MCMG_STR_PREFIX)
+
+if __name__ == "__main__":
+    from Matrix import load_matrix, mat_to_str
+
+    for f in ["test_files/scene1.txt", "test_files/square.pat"]:
+        name, scene = open_scene(f)
+        lname, lmat = load_matrix(f)
+        print(name, scene.dimx, scene.dimy, name == lname and mat_to_str(scene.to_grid()) == mat_to_str(lmat))
+        scene.close()
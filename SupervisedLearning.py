@@ -16,7 +16,8 @@ class SupervisedLearner:
         self.concept, self.pattern_matrix = load_matrix(pattern_file) 
         
 
-    def learn_concept(self):
+    # simple_concept -- (passed, fsms) learned from the pattern if already computed
+    def learn_concept(self, simple_concept=None):
         if self.concept in self.automata_memory.get_hoa_concepts():
             print("[Warning]", self.concept, "already exists in the automata memory, abort")
             return
@@ -25,7 +26,7 @@ class SupervisedLearner:
         learner.check_concept()
 
         if not learner.concept_recognized:
-            learner.learn_concept(self.concept, False)
+            learner.learn_concept(self.concept, False, simple_concept)
             return 
         
         if learner.complex_concept_recognized:
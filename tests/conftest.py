@@ -0,0 +1,11 @@
+# Meta-cognitive machines
+#
+# Regression tests: fast paths are checked against reference paths
+#
+# Authors: {svc, lucy}@dmi.uns.ac.rs
+
+import os
+import sys
+
+# modules of the package are flat modules in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
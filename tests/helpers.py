@@ -0,0 +1,196 @@
+# Meta-cognitive machines
+#
+# Helpers shared by regression tests: test files, random grids
+# and reference (brute-force) implementations
+#
+# Authors: {svc, lucy}@dmi.uns.ac.rs
+
+import contextlib
+import glob
+import io
+import os
+
+import networkx as nx
+import numpy as np
+
+from Matrix import Grid, dx, dy, link_type, cell_id, EMPTY_CODE
+from AutomataMemory import AutomataMemory
+from LearningEngine import LearningEngine
+
+TEST_FILES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "test_files")
+
+
+def data_file(name):
+    return os.path.join(TEST_FILES, name)
+
+
+def pattern_files():
+    return sorted(glob.glob(os.path.join(TEST_FILES, "*.pat")))
+
+
+def scene_files():
+    return sorted(glob.glob(os.path.join(TEST_FILES, "*.txt")))
+
+
+"""
+random grid of dimensions <dimx, dimy>, fields are non-empty
+with probability p and hold symbols chosen from symbols
+"""
+def random_grid(rng, dimx, dimy, p, symbols="x"):
+    codes = np.array([ord(s) for s in symbols], dtype=np.uint8)
+    data = np.where(rng.random((dimx, dimy)) < p, codes[rng.integers(0, len(codes), (dimx, dimy))], EMPTY_CODE)
+    return Grid(data.astype(np.uint8))
+
+
+"""
+random connected pattern: a random walk of the given number of steps
+"""
+def random_walk_grid(rng, dimx, dimy, steps, symbols="x"):
+    data = np.full((dimx, dimy), EMPTY_CODE, dtype=np.uint8)
+    x, y = int(rng.integers(dimx)), int(rng.integers(dimy))
+    for _ in range(steps):
+        data[x, y] = ord(symbols[int(rng.integers(len(symbols)))])
+        k = int(rng.integers(len(dx)))
+        x, y = min(max(x + dx[k], 0), dimx - 1), min(max(y + dy[k], 0), dimy - 1)
+
+    return Grid(data)
+
+
+# reference neighbour mask: bit k is set if the k-th Moore neighbour is non-empty
+def brute_neighbour_mask(data, x, y):
+    dimx, dimy = data.shape
+    mask = 0
+    for k in range(len(dx)):
+        nx, ny = x + dx[k], y + dy[k]
+        if 0 <= nx < dimx and 0 <= ny < dimy and data[nx, ny] != EMPTY_CODE:
+            mask |= 1 << k
+
+    return mask
+
+
+"""
+reference segmentation: connected components of non-empty fields
+(Moore neighbourhood) found by flood fill, as sorted lists of (x, y),
+components are ordered by their first fields. Internal fields (all 8
+neighbours non-empty) are excluded if remove_internal_pix is True
+"""
+def flood_fill_objects(data, remove_internal_pix=False):
+    dimx, dimy = data.shape
+    fg = data != EMPTY_CODE
+    kept = fg.copy()
+    if remove_internal_pix:
+        for x in range(dimx):
+            for y in range(dimy):
+                if fg[x, y] and brute_neighbour_mask(data, x, y) == 0xFF:
+                    kept[x, y] = False
+
+    seen = np.zeros((dimx, dimy), dtype=bool)
+    objects = []
+    for x in range(dimx):
+        for y in range(dimy):
+            if not kept[x, y] or seen[x, y]:
+                continue
+
+            seen[x, y] = True
+            comp, stack = [], [(x, y)]
+            while len(stack) > 0:
+                cx, cy = stack.pop()
+                comp.append((cx, cy))
+                for k in range(len(dx)):
+                    nx, ny = cx + dx[k], cy + dy[k]
+                    if 0 <= nx < dimx and 0 <= ny < dimy and kept[nx, ny] and not seen[nx, ny]:
+                        seen[nx, ny] = True
+                        stack.append((nx, ny))
+
+            objects.append(sorted(comp))
+
+    return objects
+
+
+"""
+reference pattern graph (networkx, as pattern graphs were built before
+they were kept in arrays): nodes are cell ids of non-empty fields in row-major
+order, links of a node are added in the order of link types
+"""
+def reference_pattern_graph(data):
+    dimx, dimy = data.shape
+    G = nx.DiGraph()
+    for x in range(dimx):
+        for y in range(dimy):
+            if data[x, y] != EMPTY_CODE:
+                G.add_node(cell_id(x, y), symbol=chr(data[x, y]))
+
+    for x in range(dimx):
+        for y in range(dimy):
+            if data[x, y] != EMPTY_CODE:
+                for k in range(len(dx)):
+                    nx_, ny_ = x + dx[k], y + dy[k]
+                    if 0 <= nx_ < dimx and 0 <= ny_ < dimy and data[nx_, ny_] != EMPTY_CODE:
+                        G.add_edge(cell_id(x, y), cell_id(nx_, ny_), link_type=link_type[k])
+
+    return G
+
+
+
+"""
+reference DFS of a pattern graph (the recursive decomposition into sequences),
+it returns sequences, DFS parents and return-back sequence indices
+"""
+def reference_dfs(G, node):
+    visited = set([node])
+    sequences, return_back = [], [None]
+    dfs_parent = {node: None}
+    state = {"sequence": []}
+
+    def rec(curr):
+        state["sequence"].append(curr)
+        sequence_index = len(sequences)
+        prev = dfs_parent[curr]
+        transition_move = None if prev is None else G.edges[prev, curr]["link_type"]
+
+        last_append = None
+        move_forward = []
+        for n in G.neighbors(curr):
+            if n not in visited:
+                if transition_move is not None and G.edges[curr, n]["link_type"] == transition_move:
+                    last_append = n
+                else:
+                    move_forward.append(n)
+
+        if last_append is not None:
+            move_forward.append(last_append)
+
+        if len(move_forward) == 1:
+            visited.add(move_forward[0])
+            dfs_parent[move_forward[0]] = curr
+            rec(move_forward[0])
+            return
+
+        sequences.append(state["sequence"])
+        state["sequence"] = []
+        for n in move_forward:
+            if n not in visited:
+                return_back.append(sequence_index)
+                visited.add(n)
+                dfs_parent[n] = curr
+                rec(n)
+
+    rec(node)
+    return sequences, dfs_parent, return_back
+
+
+# FSMs as lists of (state name, [(symbol, next state name)])
+def fsm_structure(fsm):
+    return fsm.activating_symbol, [(s.name, [(sym, ns.name) for sym, ns in s.transitions]) for s in fsm.states]
+
+
+# automata memory with base and complex concepts learned from test files by the learning engine
+def learned_memory():
+    memory = AutomataMemory()
+    le = LearningEngine(memory)
+    with contextlib.redirect_stdout(io.StringIO()):
+        for f in ["vertical_line.pat", "horizontal_line.pat", "scene-rect.txt", "t.pat", "left_angle.pat", 
+            "right_angle.pat", "rect.pat", "square.pat", "square_cross.pat", "square_line.pat", "triangle.pat"]:
+            le.learn(data_file(f))
+
+    return memory
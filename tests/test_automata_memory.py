@@ -0,0 +1,141 @@
+# Meta-cognitive machines
+#
+# Tests of the automata memory: FSMs of base concepts applied through
+# the FSM bank compared with applying every FSM by FSMPatRecKernel,
+# candidate automata of the activation index compared with brute-force checks
+#
+# Authors: {svc, lucy}@dmi.uns.ac.rs
+
+import numpy as np
+
+from Matrix import load_matrix, coverage, cell_ids_xy, MOVE_DX, MOVE_DY
+from Automaton import FSM, FSMPatRecKernel, fsm_prefix, learn_simple_concept, learn_simple_concept_from_matrix, get_pattern_graph
+from AutomataMemory import AutomataMemory
+from HOAutomaton import AutomatonMemo
+from SceneAnalyzer import IdentifyObjects
+
+from helpers import pattern_files, scene_files, random_grid, random_walk_grid, learned_memory
+
+
+# memory with base concepts of test patterns and random patterns
+def base_memory(rng):
+    memory = AutomataMemory()
+    for f in pattern_files():
+        ok, concept, mat, _, fsms = learn_simple_concept(f)
+        if ok and concept not in memory.automata:
+            memory.add_automata_to_memory(concept, True, fsms, mat)
+
+    for i in range(15):
+        mat = random_walk_grid(rng, 6, 6, int(rng.integers(2, 10)), "xy")
+        ok, _, fsms = learn_simple_concept_from_matrix(mat)
+        if ok:
+            memory.add_automata_to_memory("random" + str(i), True, fsms, mat)
+
+    return memory
+
+
+# object matrices of test scenes, test patterns and random patterns
+def object_matrices(rng):
+    mats = [load_matrix(f)[1] for f in pattern_files()]
+    for f in scene_files():
+        io = IdentifyObjects(load_matrix(f)[1])
+        mats += [io.get_object_matrix(o) for o in range(io.num_objects())]
+
+    mats += [random_walk_grid(rng, 6, 6, int(rng.integers(2, 10)), "xy") for _ in range(20)]
+    return mats
+
+
+# reference retrieval: every FSM of every base concept applied by a kernel at every start node
+def reference_satisfiable_basic_concepts(memory, mat):
+    sat = []
+    for start in get_pattern_graph(mat).start_nodes:
+        x, y = cell_ids_xy([start])
+        for concept in memory.base_concepts:
+            for fsm in memory.automata[concept]:
+                rec, _, visited = FSMPatRecKernel(fsm, mat, int(x[0]), int(y[0])).apply()
+                if rec and coverage(visited, mat):
+                    sat.append((concept, fsm))
+
+    return sat
+
+
+def test_apply_base_automata_matches_kernels():
+    rng = np.random.default_rng(23)
+    memory = base_memory(rng)
+    mats = object_matrices(rng) + [random_grid(rng, 10, 10, p, "xy") for p in [0.3, 0.7]]
+
+    for mat in mats:
+        xs, ys = np.nonzero(mat.data != 32)
+        for with_visited in [False, True]:
+            results = memory.apply_base_automata(mat, xs, ys, with_visited)
+            for concept in memory.base_concepts:
+                for k, fsm in enumerate(memory.automata[concept]):
+                    for i in range(len(xs)):
+                        rec, _, visited = FSMPatRecKernel(fsm, mat, int(xs[i]), int(ys[i])).apply()
+                        res = results.get((concept, k, i))
+                        if rec:
+                            assert res == (True, visited if with_visited else None)
+                        elif res is not None:
+                            assert res == (False, visited if with_visited else None)
+
+        # base concepts are retrieved for connected patterns
+        if get_pattern_graph(mat).connected:
+            assert memory.retrieve_satisfiable_basic_concepts(mat) == reference_satisfiable_basic_concepts(memory, mat)
+
+
+# brute-force activation check: the activating symbol of the (start) FSM is at (x, y)
+# and the first transition of its prefix is feasible
+def may_activate(automaton, mat, x, y):
+    while not isinstance(automaton, FSM):
+        if len(automaton.nodes) == 0:
+            return True
+        automaton = automaton.nodes[0].get_automaton()
+
+    prefix = fsm_prefix(automaton)
+    if mat.symbol(x, y) != automaton.activating_symbol:
+        return False
+    if len(prefix) == 0:
+        return True
+
+    nx_, ny_ = x + MOVE_DX[prefix[0].move], y + MOVE_DY[prefix[0].move]
+    return 0 <= nx_ < mat.dimx and 0 <= ny_ < mat.dimy and mat.data[nx_, ny_] == prefix[0].code
+
+
+def assert_index_matches_memory(memory, mats):
+    for mat in mats:
+        for x in range(mat.dimx):
+            for y in range(mat.dimy):
+                expected = dict()
+                for concept, automata in memory.automata.items():
+                    found = [(k, a) for k, a in enumerate(automata) if may_activate(a, mat, x, y)]
+                    if len(found) > 0:
+                        expected[concept] = found
+                assert memory.candidate_automata(mat, x, y) == expected
+
+        assert memory.candidate_automata(mat, -1, 0) == {} and memory.candidate_automata(mat, 0, mat.dimy) == {}
+
+
+# candidate automata of a field are the automata that can be activated there,
+# so no automaton recognizing a pattern at the field is missed
+def test_activation_index_candidates_are_complete():
+    memory = learned_memory()
+    mats = [load_matrix(f)[1] for f in scene_files()]
+    assert_index_matches_memory(memory, mats)
+
+    for mat in mats[:2]:
+        memo = AutomatonMemo(mat)
+        for x in range(mat.dimx):
+            for y in range(mat.dimy):
+                candidates = memory.candidate_automata(mat, x, y)
+                for concept, automata in memory.automata.items():
+                    automaton_type = "FSM" if concept in memory.base_concepts else "HOA"
+                    for k, a in enumerate(automata):
+                        if memo.apply(a, automaton_type, x, y)[0]:
+                            assert (k, a) in candidates[concept]
+
+    # the index follows renamed and removed concepts
+    unknown = sorted([c for c in memory.hoa_concepts if memory.is_unsupervised_concept(c)])[0]
+    memory.reconfigure_unsupervised_concept(unknown, False, "named", memory.patterns[unknown][0])
+    memory.remove_concept_from_memory("square")
+    assert "square" not in memory.automata and "named" in memory.automata
+    assert_index_matches_memory(memory, mats)
@@ -0,0 +1,420 @@
+# Meta-cognitive machines
+#
+# Tests of pattern graphs and FSMs (Automaton module): array-based pattern
+# graphs compared with networkx pattern graphs, iterative DFS compared with
+# the recursive DFS, cached pattern graphs, repetition periods compared with
+# the naive search, interned FSM symbols, reduction of FSMs of a concept,
+# compiled FSMs compared with FSMPatRecKernel, vectorized runs compared with
+# runs from single starts, FSM bank candidates compared with prefix walks
+#
+# Authors: {svc, lucy}@dmi.uns.ac.rs
+
+import pickle
+import sys
+
+import networkx as nx
+import numpy as np
+import pytest
+from concurrent.futures import ProcessPoolExecutor
+
+from Matrix import load_matrix, grid_from_lines, as_sparse, move_code, cell_id, cell_ids_xy, MOVE_DX, MOVE_DY
+from Automaton import PatternGraph, PatternGraphDFS, PatternGraphCache, get_pattern_graph, FSMLearner, apply_fsm
+from Automaton import FSM, FSMSymbol, EMPTY_FSM_SYMBOL, fsm_symbol_table, repetition_period
+from Automaton import deduplicate_fsms, fsm_coverage, learn_simple_concept, learn_simple_concept_from_matrix
+from Automaton import FSMPatRecKernel, apply_fsm_multi, fsm_prefix, FSMBank
+from AutomataMemory import AutomataMemory
+
+from helpers import pattern_files, scene_files, random_grid, random_walk_grid, reference_pattern_graph, reference_dfs, fsm_structure
+
+
+def test_pattern_graph_matches_networkx():
+    rng = np.random.default_rng(14)
+    patterns = [load_matrix(f)[1] for f in pattern_files()]
+    patterns += [random_walk_grid(rng, 8, 10, 25, "xy") for _ in range(20)]
+    patterns += [random_grid(rng, 6, 7, 0.4, "xy") for _ in range(10)]
+
+    for mat in patterns:
+        G = reference_pattern_graph(mat.data)
+        pg = PatternGraph(mat)
+
+        assert list(pg.node_ids) == list(G.nodes)
+        assert pg.num_nodes() == G.number_of_nodes()
+        assert pg.first_node == list(G.nodes)[0]
+        for n in G.nodes:
+            assert pg.symbol(n) == G.nodes[n]["symbol"]
+            assert pg.neighbors(n) == list(G.neighbors(n))
+            for m in G.neighbors(n):
+                assert pg.move(n, m) == move_code(G.edges[n, m]["link_type"])
+
+        H = pg.to_networkx()
+        assert list(H.nodes) == list(G.nodes)
+        assert list(H.edges(data="link_type")) == list(G.edges(data="link_type"))
+        assert list(pg.bfs_edges(pg.first_node)) == list(nx.bfs_edges(G, pg.first_node))
+        # nodes reached by BFS links (none if the first node is isolated)
+        bfs_order = list(nx.bfs_tree(G, pg.first_node).nodes)
+        bfs_order = bfs_order if len(bfs_order) > 1 else []
+        assert list(pg.bfs_order()) == bfs_order
+
+        connected = nx.is_connected(G.to_undirected())
+        assert pg.connected == connected
+        if connected:
+            start_nodes = [n for n in G.nodes if G.in_degree(n) == 1]
+            assert list(pg.start_nodes) == start_nodes
+            assert pg.is_concept_simple() == (len(start_nodes) > 0)
+        else:
+            assert not pg.is_concept_simple()
+
+
+# iterative DFS compared with the recursive DFS from every start node
+def test_dfs_matches_recursive_dfs():
+    rng = np.random.default_rng(15)
+    patterns = [load_matrix(f)[1] for f in pattern_files()]
+    patterns += [random_walk_grid(rng, 9, 9, 40, "xy") for _ in range(30)]
+
+    for mat in patterns:
+        G = reference_pattern_graph(mat.data)
+        pg = PatternGraph(mat)
+        for node in list(G.nodes)[:10]:
+            sequences, dfs_parent, return_back = PatternGraphDFS(pg).dfs(node)
+            ref_sequences, ref_parent, ref_return_back = reference_dfs(G, node)
+            assert sequences == ref_sequences
+            assert dfs_parent == ref_parent
+            assert return_back == ref_return_back
+
+
+# long lines are traversed without recursion
+def test_dfs_long_line():
+    n = 3 * sys.getrecursionlimit()
+    pg = PatternGraph(grid_from_lines(["x" * n]))
+    assert list(pg.start_nodes) == [cell_id(0, 0), cell_id(0, n - 1)]
+
+    sequences, dfs_parent, return_back = PatternGraphDFS(pg).dfs(cell_id(0, n - 1))
+    assert sequences == [[cell_id(0, y) for y in range(n - 1, -1, -1)]]
+    assert dfs_parent[cell_id(0, 0)] == cell_id(0, 1) and return_back == [None]
+
+    fsm = FSMLearner(pg, cell_id(0, 0)).learn()
+    assert apply_fsm(fsm, grid_from_lines(["x" * n]), 0, 0)[0]
+
+
+# patterns with equal content share one pattern graph, the least recently used graphs are evicted
+def test_pattern_graph_cache():
+    rng = np.random.default_rng(16)
+    cache = PatternGraphCache(max_size=3)
+    mats = [random_walk_grid(rng, 7, 7, 20, "xy") for _ in range(4)]
+
+    pg = cache.get(mats[0])
+    assert cache.get(mats[0].copy()) is pg
+    assert cache.get(as_sparse(mats[0])) is pg
+    assert cache.get([list(str(r)) for r in mats[0]]) is pg
+    assert cache.stats() == {"size": 1, "max_size": 3, "hits": 3, "misses": 1}
+
+    # a different symbol or position gives a different graph
+    changed = mats[0].copy()
+    x, y = as_sparse(changed).xs[0], as_sparse(changed).ys[0]
+    changed.set_symbol(x, y, "z" if changed.symbol(x, y) != "z" else "x")
+    assert cache.get(changed) is not pg
+    assert cache.get(grid_from_lines([" " + str(r) for r in mats[0]])) is not pg
+
+    # mats[0] is the least recently used graph
+    cache.get(changed)
+    pgs = [cache.get(m) for m in mats[1:]]
+    assert cache.stats()["size"] == 3
+    assert cache.get(mats[0]) is not pg
+    assert cache.get(mats[3]) is pgs[2]
+
+    # DFS does not modify shared graphs
+    pg = get_pattern_graph(mats[1])
+    state = (pg.node_ids, pg.adj_start, pg.adj_dst, pg.adj_move, pg.start_nodes, pg.bfs_order())
+    results = [PatternGraphDFS(pg).dfs(n) for n in pg.start_nodes]
+    assert (pg.node_ids, pg.adj_start, pg.adj_dst, pg.adj_move, pg.start_nodes, pg.bfs_order()) == state
+    assert [PatternGraphDFS(get_pattern_graph(mats[1].copy())).dfs(n) for n in pg.start_nodes] == results
+    assert not pg.node_masks.flags.writeable
+
+    cache.clear()
+    assert cache.stats() == {"size": 0, "max_size": 3, "hits": 0, "misses": 0}
+
+
+# naive repetition period: the smallest period p <= n / 2 dividing n such that
+# the sequence is a repetition of its first p elements
+def naive_repetition_period(s):
+    for p in range(1, len(s) // 2 + 1):
+        if len(s) % p == 0 and s == s[:p] * (len(s) // p):
+            return p
+
+    return 0
+
+
+def test_repetition_period_matches_naive():
+    for n in range(0, 11):
+        for k in range(2 ** n):
+            ids = [(k >> i) & 1 for i in range(n)]
+            assert repetition_period(ids) == naive_repetition_period(ids)
+
+    rng = np.random.default_rng(17)
+    for _ in range(300):
+        p = int(rng.integers(1, 6))
+        ids = rng.integers(0, 3, p).tolist() * int(rng.integers(1, 6))
+        if rng.random() < 0.3:
+            ids[int(rng.integers(len(ids)))] = 3
+        assert repetition_period(ids) == naive_repetition_period(ids)
+
+    # FSM symbols are compared by their ids
+    syms = [FSMSymbol(move_code(m), s) for m in ["U", "R"] for s in "xy"]
+    learner = FSMLearner(PatternGraph(grid_from_lines(["xx"])), cell_id(0, 0))
+    for _ in range(200):
+        s = [syms[i] for i in rng.integers(0, len(syms), int(rng.integers(1, 9)))]
+        if rng.random() < 0.5:
+            s = s * int(rng.integers(2, 4))
+        assert learner.is_repetition_sequence(s) == naive_repetition_period([str(x) for x in s])
+
+        red_seq, rep = learner.reduce_fsmsymbol_sequence(s)
+        i = 0
+        for sym, r in zip(red_seq, rep):
+            run = 1
+            while i + run < len(s) and s[i + run] is sym:
+                run += 1
+            assert s[i] is sym and r == (run > 1)
+            i += run
+        assert i == len(s)
+
+
+def _symbol_in_worker(sym):
+    return sym, FSMSymbol(sym.move, sym.next_symbol) is sym
+
+
+def test_fsm_symbols_are_interned():
+    sym = FSMSymbol("UR", "x")
+    assert FSMSymbol(move_code("UR"), "x") is sym
+    assert FSMSymbol("UR", "y") is not sym and FSMSymbol("U", "x") is not sym
+    assert fsm_symbol_table[sym.id] is sym
+    assert (sym.move, sym.next_symbol, sym.code, str(sym)) == (move_code("UR"), "x", ord("x"), "<UR,x>")
+    assert EMPTY_FSM_SYMBOL.code == -1 and FSMSymbol("EMPTY", "") is EMPTY_FSM_SYMBOL
+    with pytest.raises(Exception):
+        sym.move = move_code("U")
+
+    assert pickle.loads(pickle.dumps(sym)) is sym
+    with ProcessPoolExecutor(max_workers=1) as pool:
+        received, interned = pool.submit(_symbol_in_worker, sym).result()
+    assert received is sym and interned
+
+    # pickled FSMs keep their structure and share interned symbols
+    for f in pattern_files():
+        pg = PatternGraph(load_matrix(f)[1])
+        if not pg.is_concept_simple():
+            continue
+
+        for node in pg.start_nodes:
+            fsm = FSMLearner(pg, node).learn()
+            copy = pickle.loads(pickle.dumps(fsm))
+            assert fsm_structure(copy) == fsm_structure(fsm)
+            assert all([s.fsm is copy for s in copy.states])
+            assert copy.canonical_form() == fsm.canonical_form()
+
+
+def test_canonical_forms_merge_bisimilar_states():
+    sym_d, sym_r = FSMSymbol("D", "x"), FSMSymbol("R", "x")
+    fsm = FSM("x")
+    a, b = fsm.create_state(), fsm.create_state()
+    a.add_transition(sym_d, b)
+    a.add_transition(sym_r, b)
+    b.add_transition(EMPTY_FSM_SYMBOL, a)
+
+    # the same FSM with a duplicated branch state
+    dup = FSM("x")
+    a, b, c = dup.create_state(), dup.create_state(), dup.create_state()
+    a.add_transition(sym_d, b)
+    a.add_transition(sym_r, c)
+    b.add_transition(EMPTY_FSM_SYMBOL, a)
+    c.add_transition(EMPTY_FSM_SYMBOL, a)
+    assert dup.canonical_form() == fsm.canonical_form()
+
+    # a self-loop is not equivalent to a transition to another state
+    loop = FSM("x")
+    a, b, c = loop.create_state(), loop.create_state(), loop.create_state()
+    a.add_transition(sym_d, b)
+    b.add_transition(sym_d, b)
+    b.add_transition(sym_r, c)
+    chain = FSM("x")
+    a, b, c, d = chain.create_state(), chain.create_state(), chain.create_state(), chain.create_state()
+    a.add_transition(sym_d, b)
+    b.add_transition(sym_d, c)
+    c.add_transition(sym_r, d)
+    assert loop.canonical_form() != chain.canonical_form()
+    assert FSM("y").canonical_form() != FSM("x").canonical_form()
+
+
+# reduced FSMs cover every field covered by an eliminated FSM, so patterns are still recognized
+def test_deduplicated_fsms_recognize_patterns():
+    rng = np.random.default_rng(19)
+    patterns = [load_matrix(f)[1] for f in pattern_files()]
+    patterns += [random_walk_grid(rng, 7, 7, int(rng.integers(2, 14)), "ab") for _ in range(60)]
+
+    for mat in patterns:
+        ok, pg, fsms = learn_simple_concept_from_matrix(mat)
+        if not ok:
+            continue
+
+        kept, eliminated = deduplicate_fsms(fsms, None, mat)
+        assert eliminated == len(fsms) - len(kept) and len(kept) > 0
+        assert all([any([f is k for f in fsms]) for k in kept])
+
+        xs, ys = cell_ids_xy(pg.start_nodes)
+        covered = [fsm_coverage(k, mat, xs, ys) for k in kept]
+        for fsm in fsms:
+            c = fsm_coverage(fsm, mat, xs, ys)
+            assert any([c <= k for k in covered])
+
+        recognized = lambda automata: any([apply_fsm(f, mat, x, y)[0] for f in automata for x, y in zip(xs, ys)])
+        assert recognized(kept) == recognized(fsms)
+
+        # copies of kept FSMs are eliminated, kept FSMs are not reduced again
+        assert deduplicate_fsms([pickle.loads(pickle.dumps(k)) for k in kept], kept) == ([], len(kept))
+        assert len(deduplicate_fsms(kept, None, mat)[0]) == len(kept)
+
+    # the memory keeps the reduced FSMs of base concepts and counts eliminated FSMs
+    memory = AutomataMemory(deduplicate_fsms=True)
+    total = 0
+    for f in pattern_files():
+        ok, concept, mat, _, fsms = learn_simple_concept(f)
+        if ok:
+            memory.add_automata_to_memory(concept, True, fsms, mat)
+            memory.add_automata_to_memory(concept, True, list(fsms), mat)
+            total += len(fsms)
+            assert concept in [c[0] for c in memory.retrieve_satisfiable_basic_concepts(mat)]
+
+    kept = sum([len(memory.automata[c]) for c in memory.automata])
+    assert kept < total and memory.eliminated_fsms == 2 * total - kept
+
+
+# FSMs learned from test patterns and random patterns (symbols x and y)
+def learned_fsms(rng, num_random):
+    fsms = []
+    patterns = [load_matrix(f)[1] for f in pattern_files()]
+    patterns += [random_walk_grid(rng, 6, 6, int(rng.integers(2, 12)), "xy") for _ in range(num_random)]
+    for mat in patterns:
+        fsms.extend(learn_simple_concept_from_matrix(mat)[2])
+
+    return fsms
+
+
+# matrices the FSMs are applied to: test scenes and random grids
+def input_matrices(rng):
+    mats = [load_matrix(f)[1] for f in scene_files()]
+    mats += [random_grid(rng, 12, 12, p, "xy") for p in [0.3, 0.6, 0.9]]
+    return mats
+
+
+# compiled FSMs give the results of FSMPatRecKernel
+def test_compiled_fsm_matches_kernel():
+    rng = np.random.default_rng(21)
+    fsms = learned_fsms(rng, 25)
+    mats = input_matrices(rng)
+
+    for fsm in fsms:
+        for mat in mats:
+            for x in range(mat.dimx):
+                for y in range(mat.dimy):
+                    assert apply_fsm(fsm, mat, x, y) == FSMPatRecKernel(fsm, mat, x, y).apply()
+
+    # fields out of the matrix do not activate FSMs
+    assert apply_fsm(fsms[0], mats[0], -1, 0) == (False, 0, None)
+    assert apply_fsm(fsms[0], mats[0], 0, mats[0].dimy) == (False, 0, None)
+
+    # the compiled form follows changes of the FSM
+    fsm = FSM("x")
+    a, b = fsm.create_state(), fsm.create_state()
+    a.add_transition(FSMSymbol("R", "x"), b)
+    cfsm = fsm.compile()
+    assert fsm.compile() is cfsm
+    mat = grid_from_lines(["xx", "x "])
+    assert apply_fsm(fsm, mat, 0, 0) == FSMPatRecKernel(fsm, mat, 0, 0).apply() == (True, 2, [cell_id(0, 0), cell_id(0, 1)])
+
+    b.add_transition(FSMSymbol("DL", "x"), fsm.create_state())
+    assert fsm.compile() is not cfsm
+    assert apply_fsm(fsm, mat, 0, 0) == FSMPatRecKernel(fsm, mat, 0, 0).apply()
+    assert apply_fsm(fsm, mat, 0, 0)[0]
+
+
+# vectorized runs from many starts give the results of runs from each start
+def test_apply_fsm_multi_matches_apply_fsm():
+    rng = np.random.default_rng(22)
+    fsms = learned_fsms(rng, 25)
+    mats = input_matrices(rng)
+
+    for fsm in fsms:
+        for mat in mats:
+            xs, ys, recognized, active_time, visited = apply_fsm_multi(fsm, mat, with_visited=True)
+            assert list(zip(xs.tolist(), ys.tolist())) == [(x, y) for x in range(mat.dimx) for y in range(mat.dimy) 
+                if mat.symbol(x, y) == fsm.activating_symbol]
+            assert len(visited) == len(xs)
+            for r in range(len(xs)):
+                assert (recognized[r], active_time[r], visited[r]) == apply_fsm(fsm, mat, int(xs[r]), int(ys[r]))
+            assert list(visited) == [visited[r] for r in range(len(xs))]
+
+            # any start fields, also fields not activating the FSM and fields out of the matrix
+            sx = rng.integers(-1, mat.dimx + 1, 40)
+            sy = rng.integers(-1, mat.dimy + 1, 40)
+            _, _, recognized, active_time, visited = apply_fsm_multi(fsm, mat, sx, sy, with_visited=True)
+            _, _, recognized2, active_time2, no_visited = apply_fsm_multi(fsm, mat, sx, sy)
+            assert no_visited is None
+            assert np.array_equal(recognized, recognized2) and np.array_equal(active_time, active_time2)
+            for r in range(len(sx)):
+                assert (recognized[r], active_time[r], visited[r]) == apply_fsm(fsm, mat, int(sx[r]), int(sy[r]))
+
+
+# the prefix of an FSM can be followed from the field (x, y)
+def prefix_feasible(fsm, mat, x, y):
+    if mat.symbol(x, y) != fsm.activating_symbol:
+        return False
+
+    for sym in fsm_prefix(fsm):
+        x, y = x + MOVE_DX[sym.move], y + MOVE_DY[sym.move]
+        if x < 0 or x >= mat.dimx or y < 0 or y >= mat.dimy or mat.data[x, y] != sym.code:
+            return False
+
+    return True
+
+
+# FSM bank candidates are the FSMs with feasible prefixes, so no recognizing FSM is missed
+def test_fsm_bank_candidates_are_complete():
+    rng = np.random.default_rng(23)
+    fsms = learned_fsms(rng, 25)
+    concepts = dict()
+    for i, fsm in enumerate(fsms):
+        concepts.setdefault("c" + str(i % 7), []).append(fsm)
+
+    bank = FSMBank()
+    for concept, cfsms in concepts.items():
+        bank.add(concept, cfsms)
+    assert bank.num_fsms() == len(fsms)
+
+    for mat in input_matrices(rng):
+        for x in range(mat.dimx):
+            for y in range(mat.dimy):
+                found = bank.candidates(mat, x, y)
+                expected = dict()
+                for concept, cfsms in concepts.items():
+                    feasible = [(k, f) for k, f in enumerate(cfsms) if prefix_feasible(f, mat, x, y)]
+                    if len(feasible) > 0:
+                        expected[concept] = feasible
+                assert found == expected
+
+                for concept, cfsms in concepts.items():
+                    for k, f in enumerate(cfsms):
+                        if apply_fsm(f, mat, x, y)[0]:
+                            assert (k, f) in found[concept]
+
+    # removed and renamed concepts
+    mat = input_matrices(rng)[0]
+    cells = [(x, y) for x in range(mat.dimx) for y in range(mat.dimy)]
+    before = [bank.candidates(mat, x, y) for x, y in cells]
+    bank.remove("c0")
+    bank.rename("c1", "d1")
+    assert bank.num_fsms() == len(fsms) - len(concepts["c0"])
+    for (x, y), b in zip(cells, before):
+        b.pop("c0", None)
+        if "c1" in b:
+            b["d1"] = b.pop("c1")
+        assert bank.candidates(mat, x, y) == b
+
+    assert bank.candidates(mat, -1, 0) == {} and bank.candidates(mat, mat.dimx, 0) == {}
@@ -0,0 +1,67 @@
+# Meta-cognitive machines
+#
+# Tests of HOA recognition: kernels sharing a memo table of automaton
+# results compared with kernels applying every automaton again
+#
+# Authors: {svc, lucy}@dmi.uns.ac.rs
+
+from Matrix import load_matrix
+from HOAutomaton import HOAPatRecKernel, AutomatonMemo
+
+from helpers import data_file, scene_files, learned_memory
+
+
+# memo table that keeps nothing: every automaton is applied again
+class NoMemo(AutomatonMemo):
+    def put(self, automaton, x, y, results):
+        pass
+
+
+def kernel_results(hoa, mat, x, y, memo):
+    kernel = HOAPatRecKernel(hoa, mat, x, y, memo)
+    rec, t, visited = kernel.apply()
+    return rec, t, list(visited) if visited is not None else None, kernel.activation_score()
+
+
+def test_memoized_hoa_recognition_matches_fresh_kernels():
+    memory = learned_memory()
+    hoas = [a for c in sorted(memory.hoa_concepts) for a in memory.automata[c]]
+
+    recognized = 0
+    for f in scene_files():
+        mat = load_matrix(f)[1]
+        memo = AutomatonMemo(mat)
+        fields = [(x, y) for x in range(mat.dimx) for y in range(mat.dimy) if mat.symbol(x, y) != " "]
+
+        expected = [kernel_results(hoa, mat, x, y, NoMemo(mat)) for hoa in hoas for x, y in fields]
+        recognized += sum([r[0] for r in expected])
+
+        # results are equal when taken from the table (twice) and with a table per kernel
+        for _ in range(2):
+            assert [kernel_results(hoa, mat, x, y, memo) for hoa in hoas for x, y in fields] == expected
+        assert [kernel_results(hoa, mat, x, y, None) for hoa in hoas for x, y in fields] == expected
+        assert memo.hits > 0
+
+    assert recognized > 0
+
+
+def test_memo_table_is_invalidated():
+    memory = learned_memory()
+    hoa = memory.automata["square"][0]
+    mat = load_matrix(data_file("scene-rect.txt"))[1]
+    fields = [(x, y) for x in range(mat.dimx) for y in range(mat.dimy) if mat.symbol(x, y) != " "]
+    memo = AutomatonMemo(mat)
+    for x, y in fields:
+        memo.apply(hoa, "HOA", x, y)
+
+    assert all([memo.get(hoa, x, y) is not None for x, y in fields])
+    memo.invalidate(hoa)
+    assert all([memo.get(hoa, x, y) is None for x, y in fields])
+    assert len(memo.results) > 0
+
+    # a modified grid drops all results
+    x, y = fields[0]
+    mat.set_symbol(x, y, " ")
+    assert memo.get(hoa.nodes[0].get_automaton(), x, y) is None and len(memo.results) == 0
+    for x, y in fields[1:]:
+        assert memo.apply(hoa, "HOA", x, y) == HOAPatRecKernel(hoa, mat, x, y, NoMemo(mat)).apply()
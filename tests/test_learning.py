@@ -0,0 +1,69 @@
+# Meta-cognitive machines
+#
+# Tests of learning in process pools compared with serial learning
+#
+# Authors: {svc, lucy}@dmi.uns.ac.rs
+
+import contextlib
+import io
+import sys
+
+import numpy as np
+
+from Matrix import grid_from_lines
+from Automaton import learn_simple_concept, learn_simple_concept_from_matrix, learn_simple_concepts
+from AutomataMemory import AutomataMemory
+from LearningEngine import LearningEngine
+
+from helpers import data_file, pattern_files, random_walk_grid, fsm_structure
+
+
+def memory_info(memory):
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        memory.info()
+
+    return out.getvalue()
+
+
+def test_parallel_fsm_learning_matches_serial():
+    rng = np.random.default_rng(20)
+    patterns = [random_walk_grid(rng, 8, 8, 30, "xy") for _ in range(10)]
+
+    # long chains of states are pickled by worker processes
+    n = 3 * sys.getrecursionlimit()
+    patterns.append(grid_from_lines(["".join(rng.choice(list("xyz"), n))]))
+
+    for mat in patterns:
+        ok, pg, fsms = learn_simple_concept_from_matrix(mat)
+        pok, ppg, pfsms = learn_simple_concept_from_matrix(mat, processes=2)
+        assert (pok, ppg) == (ok, pg)
+        assert [fsm_structure(f) for f in pfsms] == [fsm_structure(f) for f in fsms]
+
+    files = pattern_files()
+    serial = [learn_simple_concept(f) for f in files]
+    for processes in [1, 2, None]:
+        pooled = learn_simple_concepts(iter(files), processes)
+        assert len(pooled) == len(serial)
+        for (ok, concept, _, _, fsms), (pok, pconcept, _, _, pfsms) in zip(serial, pooled):
+            assert (pok, pconcept) == (ok, concept)
+            assert [fsm_structure(f) for f in pfsms] == [fsm_structure(f) for f in fsms]
+
+
+# base concepts learned from FSMs of a pool give the same memory as supervised learning file by file
+def test_learn_base_concepts_matches_learn():
+    names = ["vertical_line.pat", "horizontal_line.pat", "t.pat", "left_angle.pat", "right_angle.pat", 
+        "rect.pat", "square.pat", "square_cross.pat", "square_line.pat", "vertical_line.pat"]
+    files = [data_file(f) for f in names]
+
+    memory = AutomataMemory()
+    le = LearningEngine(memory)
+    for f in files:
+        le.learn(f)
+
+    for processes in [1, 2]:
+        pmemory = AutomataMemory()
+        added = LearningEngine(pmemory).learn_base_concepts(iter(files), processes)
+        assert added == list(memory.automata)
+        assert (pmemory.base_concepts, pmemory.hoa_concepts) == (memory.base_concepts, memory.hoa_concepts)
+        assert memory_info(pmemory) == memory_info(memory)
@@ -0,0 +1,250 @@
+# Meta-cognitive machines
+#
+# Tests of grids, field sets, sparse scenes and move codes (Matrix module)
+#
+# Authors: {svc, lucy}@dmi.uns.ac.rs
+
+import random
+
+import numpy as np
+import pytest
+
+from Matrix import as_grid, grid_from_lines, load_matrix, mat_to_str, dx, dy, link_type, move_code
+from Matrix import move_name, move_names, move_dir, move_kind, is_straight_move, MOVE_DX, MOVE_DY
+from Matrix import cell_id, cell_xy, cell_str, cell_ids, cell_ids_xy, parse_field, neigh, neigh_move
+from Matrix import FieldSet, coverage, as_sparse, num_pixels, nonempty_fields, BACKWARD_LINKS, EMPTY_CODE, MASK_DEGREE
+
+from helpers import pattern_files, scene_files, random_grid, brute_neighbour_mask
+
+
+# rows of grids loaded from files are the lines of the files (padded by empty fields)
+def test_grid_rows_match_file_lines():
+    for f in pattern_files() + scene_files():
+        with open(f) as fd:
+            lines = [line.rstrip() for line in fd][1:]
+
+        _, mat = load_matrix(f)
+        assert mat.dimx == len(lines)
+        for i in range(mat.dimx):
+            assert "".join(mat[i]) == lines[i].ljust(mat.dimy)
+            for j in range(mat.dimy):
+                assert mat[i][j] == mat.symbol(i, j) == lines[i].ljust(mat.dimy)[j]
+
+
+def test_grid_from_lists_of_symbols():
+    rows = [list("ab "), list(" c"), list("")]
+    mat = as_grid(rows)
+    assert (mat.dimx, mat.dimy) == (3, 3)
+    assert [str(r) for r in mat] == ["ab ", " c ", "   "]
+    assert as_grid(mat) is mat
+
+
+def test_grid_writes_modify_version_and_widen_codes():
+    mat = grid_from_lines(["x ", " x"])
+    assert mat.data.dtype == np.uint8
+    
+    version = mat.version
+    mat[0][1] = "y"
+    assert mat.symbol(0, 1) == "y" and mat.version > version
+
+    # symbols with codes above 255 widen the code array
+    mat[1][0] = "Ж"
+    assert mat.data.dtype == np.uint32
+    assert mat[1][0] == "Ж" and mat[0][1] == "y"
+    assert str(mat[1]) == "Жx"
+
+
+def test_mat_to_str_round_trip():
+    for f in pattern_files():
+        _, mat = load_matrix(f)
+        copy = grid_from_lines(mat_to_str(mat).splitlines())
+        assert np.array_equal(copy.data, mat.data)
+
+
+# cell ids are ordered as fields in row-major order, scalar and array forms agree
+def test_cell_ids():
+    fields = [(x, y) for x in range(4) for y in range(5)] + [(70000, 3), (2, 1 << 31)]
+    ids = [cell_id(x, y) for x, y in fields]
+    assert [cell_xy(c) for c in ids] == fields
+    assert [parse_field(cell_str(c)) for c in ids] == fields
+    assert ids[:20] == sorted(ids[:20])
+
+    xs, ys = zip(*fields)
+    assert cell_ids(xs, ys).tolist() == ids
+    back_xs, back_ys = cell_ids_xy(ids)
+    assert back_xs.tolist() == list(xs) and back_ys.tolist() == list(ys)
+
+
+# neighbour tests on cell ids agree with the Moore neighbourhood offsets
+def test_neigh_on_cell_ids():
+    c = cell_id(5, 5)
+    for k in range(len(dx)):
+        n = cell_id(5 + dx[k], 5 + dy[k])
+        assert neigh(n, c) == (True, link_type[k])
+        assert neigh_move(n, c) == (True, move_code(link_type[k]))
+
+    assert neigh(c, c) == (True, "ID")
+    assert neigh(cell_id(7, 5), c) == (False, None)
+    assert neigh_move(cell_id(5, 3), c) == (False, None)
+
+
+# FieldSet behaves as a set of the cell ids of fields in the plane
+def test_field_set_matches_set():
+    rng = random.Random(5)
+    for _ in range(500):
+        dimx, dimy = rng.randint(1, 6), rng.randint(1, 6)
+        fs, ref = FieldSet(dimx, dimy), set()
+
+        def random_cell():
+            return cell_id(rng.randint(-2, dimx + 1), rng.randint(-2, dimy + 1))
+
+        def on_plane(c):
+            x, y = cell_xy(c)
+            return 0 <= x < dimx and 0 <= y < dimy
+
+        for _ in range(5):
+            cells = [random_cell() for _ in range(rng.randint(0, 6))]
+            if rng.random() < 0.5:
+                fs.update(cells)
+            else:
+                for c in cells:
+                    fs.add(c)
+            ref.update([c for c in cells if on_plane(c)])
+
+            query = [random_cell() for _ in range(rng.randint(0, 6))]
+            skip = rng.choice(query) if len(query) > 0 else None
+            assert fs.has_new(query, skip) == any([c not in ref and c != skip for c in query])
+            assert fs.overlaps(query) == any([c in ref for c in query])
+            assert all([(c in fs) == (c in ref) for c in query])
+            assert sorted(fs) == sorted(ref) and len(fs) == len(ref)
+
+        other = FieldSet(dimx, dimy, [c for c in ref if rng.random() < 0.5])
+        assert sorted(fs | other) == sorted(ref)
+
+
+# coverage by field sets agrees with coverage by sets of cell ids
+def test_coverage_matches_set():
+    rng = np.random.default_rng(3)
+    for _ in range(100):
+        grid = random_grid(rng, 5, 6, 0.4)
+        ids = [cell_id(x, y) for x, y in zip(*np.nonzero(grid.foreground()))]
+        fields = [c for c in ids if rng.random() < 0.8]
+        expected = set(ids) <= set(fields)
+        assert coverage(fields, grid) == expected
+        assert coverage(FieldSet(grid.dimx, grid.dimy, fields), grid) == expected
+        assert coverage(fields, as_sparse(grid)) == expected
+
+
+# move codes round trip through their string forms (used for printing and persistence)
+def test_move_codes_round_trip():
+    names = link_type + ["ID"]
+    names = names + ["START_" + n for n in names] + ["INC_" + n for n in names] + ["EMPTY", "START", "NONE", "END"]
+    codes = [move_code(n) for n in names]
+    assert len(set(codes)) == len(names)
+    assert move_names(codes) == names
+    for n, c in zip(names, codes):
+        assert move_name(c) == n
+
+    for k in range(len(link_type)):
+        for c in [move_code(link_type[k]), move_code("START_" + link_type[k]), move_code("INC_" + link_type[k])]:
+            assert move_dir(c) == k
+            assert (MOVE_DX[move_dir(c)], MOVE_DY[move_dir(c)]) == (dx[k], dy[k])
+            assert is_straight_move(c) == (link_type[k] in ["U", "L", "R", "D"])
+
+    for n in ["ID", "START_ID", "INC_ID", "EMPTY", "START", "NONE", "END"]:
+        assert not is_straight_move(move_code(n))
+
+    assert move_kind(move_code("INC_DR")) == move_kind(move_code("INC_U")) != move_kind(move_code("START_U"))
+    with pytest.raises(Exception):
+        move_code("INC_")
+
+
+# sparse scenes compared with the dense grids they are built from
+def test_sparse_scene_matches_grid():
+    rng = np.random.default_rng(7)
+    grids = [load_matrix(f)[1] for f in pattern_files() + scene_files()]
+    grids += [random_grid(rng, 17, 23, p, "xy") for p in [0.0, 0.05, 0.4, 1.0]]
+
+    for mat in grids:
+        sp = as_sparse(mat)
+        assert as_sparse(sp) is sp
+        assert mat_to_str(sp.to_grid()) == mat_to_str(mat)
+        assert num_pixels(sp) == num_pixels(mat) == len(sp.ids)
+        assert nonempty_fields(sp) == nonempty_fields(mat)
+        assert list(sp.ids) == sorted(sp.ids) == list(cell_ids(sp.xs, sp.ys))
+
+        fields = set(zip(sp.xs.tolist(), sp.ys.tolist()))
+        index = {f: i for i, f in enumerate(zip(sp.xs.tolist(), sp.ys.tolist()))}
+
+        # links against brute-force neighbour search
+        expected = []
+        for i, (x, y) in enumerate(zip(sp.xs.tolist(), sp.ys.tolist())):
+            for k in range(len(dx)):
+                if (x + dx[k], y + dy[k]) in fields:
+                    expected.append((i, index[(x + dx[k], y + dy[k])], k))
+        src, dst, k = sp.links()
+        assert list(zip(src.tolist(), dst.tolist(), k.tolist())) == expected
+
+        src, dst, k = sp.links(BACKWARD_LINKS)
+        assert list(zip(src.tolist(), dst.tolist(), k.tolist())) == [e for e in expected if e[2] in BACKWARD_LINKS]
+
+        masks = [brute_neighbour_mask(mat.data, x, y) for x, y in zip(sp.xs.tolist(), sp.ys.tolist())]
+        assert sp.neighbour_masks().tolist() == masks
+
+        # lookup, symbols and windows (also partly out of the scene)
+        for _ in range(50):
+            x, y = int(rng.integers(-2, mat.dimx + 2)), int(rng.integers(-2, mat.dimy + 2))
+            inside = 0 <= x < mat.dimx and 0 <= y < mat.dimy
+            assert int(sp.lookup([x], [y])[0]) == index.get((x, y), -1)
+            if inside:
+                assert sp.symbol(x, y) == mat.symbol(x, y)
+
+        for _ in range(10):
+            x0, y0 = int(rng.integers(0, mat.dimx)), int(rng.integers(-2, mat.dimy))
+            h, w = int(rng.integers(1, mat.dimx - x0 + 1)), int(rng.integers(1, 8))
+            expected = np.full((h, w), EMPTY_CODE, dtype=np.int64)
+            for i in range(h):
+                for j in range(w):
+                    if 0 <= y0 + j < mat.dimy:
+                        expected[i, j] = mat.data[x0 + i, y0 + j]
+            assert np.array_equal(sp.window(x0, y0, h, w).astype(np.int64), expected)
+
+        assert coverage(FieldSet(mat.dimx, mat.dimy, sp.ids), sp)
+        assert coverage(set(sp.ids.tolist()), sp)
+        if len(sp.ids) > 0:
+            assert not coverage(set(sp.ids[1:].tolist()), sp)
+
+
+# neighbour-mask planes compared with brute-force masks, also after modifications of grids
+def test_neighbour_mask_plane():
+    rng = np.random.default_rng(13)
+    grids = [load_matrix(f)[1] for f in pattern_files() + scene_files()]
+    grids += [random_grid(rng, 9, 14, p) for p in [0.0, 0.5, 1.0]]
+
+    def check(mat):
+        plane = mat.neighbour_mask()
+        for x in range(mat.dimx):
+            for y in range(mat.dimy):
+                mask = brute_neighbour_mask(mat.data, x, y)
+                assert plane[x, y] == mask
+                assert MASK_DEGREE[mask] == bin(mask).count("1")
+
+    for mat in grids:
+        check(mat)
+        assert mat.neighbour_mask() is mat.neighbour_mask()
+
+    mat = random_grid(rng, 9, 14, 0.5)
+    check(mat)
+    for _ in range(20):
+        x, y = int(rng.integers(9)), int(rng.integers(14))
+        k = int(rng.integers(4))
+        if k == 0:
+            mat.set_symbol(x, y, " " if mat.symbol(x, y) != " " else "y")
+        elif k == 1:
+            mat[x][y] = "z"
+        elif k == 2:
+            mat.set_symbols([x, 0], [y, 0], " ")
+        else:
+            mat.data[x, y] = EMPTY_CODE
+            mat.modified()
+        check(mat)
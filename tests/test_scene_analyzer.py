@@ -0,0 +1,196 @@
+# Meta-cognitive machines
+#
+# Tests of object identification: union-find labeling compared with flood fill,
+# tiled labeling compared with labeling of the whole scene, object descriptors
+# and object matrices compared with values recomputed from object pixels,
+# incremental segmentation compared with segmentation of the whole scene
+#
+# Authors: {svc, lucy}@dmi.uns.ac.rs
+
+import numpy as np
+import pytest
+
+from Matrix import load_matrix, grid_from_lines, mat_to_str, as_sparse, EMPTY_SYMBOL, create_empty_matrix, cell_id, dx, dy, link_type
+from SceneAnalyzer import IdentifyObjects, IncrementalSegmenter
+from SceneStorage import MappedScene
+
+from helpers import scene_files, random_grid, flood_fill_objects
+
+
+# pixels of objects as sorted lists of (x, y) in the order of objects
+def object_cells(io):
+    cells = []
+    for o in range(io.num_objects()):
+        xs, ys = io.object_pixels(o)
+        cells.append(sorted(zip(xs.tolist(), ys.tolist())))
+
+    return cells
+
+
+# cells and symbols of an object
+def object_state(seg, key):
+    return [(c, seg.pixels[c]) for c in seg.get_object_cells(key)]
+
+
+def assert_same_objects(a, b):
+    assert object_cells(a) == object_cells(b)
+    assert np.array_equal(a.label_plane(), b.label_plane())
+    for da, db in zip(a.get_object_descriptors(), b.get_object_descriptors()):
+        assert (da.bbox, da.num_pixels, da.first_pixel, da.symbol_histogram) == \
+            (db.bbox, db.num_pixels, db.first_pixel, db.symbol_histogram)
+
+
+def test_tiled_labeling_matches_whole_scene():
+    rng = np.random.default_rng(8)
+    scenes = [load_matrix(f)[1] for f in scene_files()]
+    scenes += [random_grid(rng, 31, 47, p, "xy") for p in [0.0, 0.3, 0.6, 0.9]]
+
+    for mat in scenes:
+        for remove_internal_pix in [False, True]:
+            ref = IdentifyObjects(mat, remove_internal_pix)
+            for tile_size in [2, (4, 9), 64]:
+                assert_same_objects(IdentifyObjects(mat, remove_internal_pix, tile_size=tile_size), ref)
+                assert_same_objects(IdentifyObjects(as_sparse(mat), remove_internal_pix, tile_size=tile_size), ref)
+
+
+def test_tiled_labeling_in_processes():
+    rng = np.random.default_rng(80)
+    mat = random_grid(rng, 60, 60, 0.55, "xy")
+    for remove_internal_pix in [False, True]:
+        ref = IdentifyObjects(mat, remove_internal_pix)
+        assert_same_objects(IdentifyObjects(mat, remove_internal_pix, tile_size=16, processes=2), ref)
+        assert_same_objects(IdentifyObjects(mat, remove_internal_pix, tile_size=(7, 25), processes=None), ref)
+
+    for f in scene_files():
+        with MappedScene(f) as scene:
+            ref = IdentifyObjects(load_matrix(f)[1])
+            assert_same_objects(IdentifyObjects(scene, tile_size=5, processes=2), ref)
+
+
+# union-find labeling compared with flood fill, object graphs with brute-force links
+def test_labeling_matches_flood_fill():
+    rng = np.random.default_rng(9)
+    scenes = [load_matrix(f)[1] for f in scene_files()]
+    scenes += [random_grid(rng, 19, 27, p, "xyz") for p in [0.0, 0.2, 0.5, 0.8, 1.0]]
+
+    for mat in scenes:
+        for remove_internal_pix in [False, True]:
+            expected = flood_fill_objects(mat.data, remove_internal_pix)
+            for io in [IdentifyObjects(mat, remove_internal_pix), IdentifyObjects(as_sparse(mat), remove_internal_pix)]:
+                assert io.num_objects() == len(expected)
+                assert object_cells(io) == expected
+
+                plane = io.label_plane()
+                for o, cells in enumerate(expected):
+                    assert all([plane[x, y] == o for x, y in cells])
+                assert np.count_nonzero(plane >= 0) == sum([len(c) for c in expected])
+
+                objects = io.get_objects()
+                for o, cells in enumerate(expected):
+                    fields = set(cells)
+                    links = set()
+                    for x, y in cells:
+                        for k in range(len(dx)):
+                            if (x + dx[k], y + dy[k]) in fields:
+                                links.add((cell_id(x, y), cell_id(x + dx[k], y + dy[k]), link_type[k]))
+
+                    assert set(objects[o].nodes) == set([cell_id(x, y) for x, y in cells])
+                    assert set([(u, v, d["link_type"]) for u, v, d in objects[o].edges(data=True)]) == links
+
+
+# descriptors and object matrices compared with values recomputed from object pixels
+def test_descriptors_and_object_matrices():
+    rng = np.random.default_rng(10)
+    scenes = [load_matrix(f)[1] for f in scene_files()]
+    scenes += [random_grid(rng, 19, 27, p, "xyz") for p in [0.1, 0.5]]
+
+    for mat in scenes:
+        for remove_internal_pix in [False, True]:
+            io = IdentifyObjects(mat, remove_internal_pix)
+            sio = IdentifyObjects(as_sparse(mat), remove_internal_pix)
+            for o, cells in enumerate(object_cells(io)):
+                xs, ys = [c[0] for c in cells], [c[1] for c in cells]
+                bbox = (min(xs), min(ys), max(xs), max(ys))
+                histogram = {}
+                for x, y in cells:
+                    histogram[mat.symbol(x, y)] = histogram.get(mat.symbol(x, y), 0) + 1
+
+                desc = io.get_object_descriptor(o)
+                assert (desc.index, desc.bbox, desc.num_pixels, desc.first_pixel) == (o, bbox, len(cells), cells[0])
+                assert desc.symbol_histogram == histogram
+                assert io.bounding_box(o) == bbox
+                assert desc.local_first_pixel() == (cells[0][0] - bbox[0], cells[0][1] - bbox[1])
+
+                expected = create_empty_matrix(bbox[2] - bbox[0] + 1, bbox[3] - bbox[1] + 1)
+                for x, y in cells:
+                    expected.set_symbol(x - bbox[0], y - bbox[1], mat.symbol(x, y))
+
+                copy = io.get_object_matrix(o)
+                view = io.get_object_matrix(o, view=True)
+                for m in [copy, view, sio.get_object_matrix(o), sio.get_object_matrix(o, view=True)]:
+                    assert mat_to_str(m) == mat_to_str(expected)
+
+                # copies are writable and independent of the scene
+                assert copy.data.flags.writeable
+                assert not np.shares_memory(copy.data, mat.data)
+                if desc.exclusive:
+                    assert np.shares_memory(view.data, mat.data) and not view.data.flags.writeable
+                else:
+                    assert not np.shares_memory(view.data, mat.data)
+
+    with pytest.raises(Exception):
+        io.get_object_matrix(io.num_objects())
+
+
+# objects of an incremental segmenter after random deltas compared with a fresh segmentation
+def test_incremental_segmenter_matches_identify_objects():
+    rng = np.random.default_rng(12)
+    for remove_internal_pix in [False, True]:
+        mat = random_grid(rng, 15, 21, 0.45, "xy")
+        seg = IncrementalSegmenter(mat, remove_internal_pix)
+
+        for step in range(60):
+            before = dict([(k, object_state(seg, k)) for k in seg.object_keys()])
+
+            removed = [(int(rng.integers(15)), int(rng.integers(21))) for _ in range(int(rng.integers(0, 6)))]
+            added = [(int(rng.integers(15)), int(rng.integers(21)), "xyz"[int(rng.integers(3))]) 
+                for _ in range(int(rng.integers(0, 6)))]
+            for x, y in removed:
+                mat.set_symbol(x, y, EMPTY_SYMBOL)
+            for x, y, s in added:
+                mat.set_symbol(x, y, s)
+
+            changed, deleted = seg.update(added, removed)
+
+            io = IdentifyObjects(mat, remove_internal_pix)
+            expected = [[cell_id(x, y) for x, y in cells] for cells in object_cells(io)]
+            assert seg.get_objects_cells() == expected
+            assert seg.num_objects() == io.num_objects()
+            for key in seg.object_keys():
+                o = expected.index(seg.get_object_cells(key))
+                assert mat_to_str(seg.get_object_matrix(key)) == mat_to_str(io.get_object_matrix(o))
+
+            # every modified object is reported, keys of vanished objects are deleted
+            keys = set(seg.object_keys())
+            assert changed <= keys and len(deleted & keys) == 0
+            assert set(before) - keys <= deleted
+            for key in keys:
+                if before.get(key) != object_state(seg, key):
+                    assert key in changed
+
+
+# a pixel removed and added again with another symbol modifies its object
+def test_incremental_segmenter_readded_pixel():
+    mat = grid_from_lines(["xxx", "   ", "  x"])
+    seg = IncrementalSegmenter(mat)
+    key = [k for k in seg.object_keys() if cell_id(0, 1) in seg.get_object_cells(k)][0]
+
+    changed, deleted = seg.update(added=[(0, 1, "y")], removed=[(0, 1)])
+    assert key in changed and len(deleted) == 0
+    assert mat_to_str(seg.get_object_matrix(key)) == "xyx\n"
+
+    changed, deleted = seg.update(added=[(0, 1, "y")], removed=[(0, 1)])
+    assert len(changed) == 0 and len(deleted) == 0
+
+    with pytest.raises(Exception):
+        seg.update(added=[(3, 0, "x")])
@@ -0,0 +1,53 @@
+# Meta-cognitive machines
+#
+# Tests of batch segmentation: objects found in a pool of processes
+# compared with IdentifyObjects applied to scenes one by one
+#
+# Authors: {svc, lucy}@dmi.uns.ac.rs
+
+import os
+import shutil
+
+from Matrix import load_matrix, mat_to_str
+from SceneAnalyzer import IdentifyObjects
+from SceneBatch import analyze_scenes, scene_files as batch_scene_files
+from SceneStorage import convert_text_to_mcmg
+
+from helpers import scene_files, pattern_files
+
+
+def test_batch_matches_identify_objects(tmp_path):
+    files = []
+    for f in scene_files():
+        files.append(shutil.copy(f, str(tmp_path)))
+        files.append(convert_text_to_mcmg(f, str(tmp_path / (os.path.basename(f)[:-4] + "_bin.mcmg"))))
+
+    # patterns and broken scenes are not taken from directories / are skipped
+    shutil.copy(pattern_files()[0], str(tmp_path))
+    with open(str(tmp_path / "broken.mcmg"), "wb") as f:
+        f.write(b"not a grid")
+
+    assert batch_scene_files(str(tmp_path)) == sorted(files + [str(tmp_path / "broken.mcmg")])
+    assert batch_scene_files(str(tmp_path / "*_bin.mcmg")) == sorted([f for f in files if f.endswith("_bin.mcmg")])
+
+    for remove_internal_pix in [False, True]:
+        found = dict()
+        for f, scene_name, desc, mat in analyze_scenes(str(tmp_path), 2, remove_internal_pix, True, max_pending=3):
+            found.setdefault(f, []).append((scene_name, desc, mat))
+
+        assert sorted(found) == sorted(files)
+        for f in files:
+            name, scene = load_matrix(f)
+            io = IdentifyObjects(scene, remove_internal_pix)
+            assert len(found[f]) == io.num_objects()
+            for o, (scene_name, desc, mat) in enumerate(found[f]):
+                ref = io.get_object_descriptor(o)
+                assert scene_name == name and desc.index == o
+                assert (desc.bbox, desc.num_pixels, desc.first_pixel, desc.symbol_histogram) == \
+                    (ref.bbox, ref.num_pixels, ref.first_pixel, ref.symbol_histogram)
+                assert mat_to_str(mat) == mat_to_str(io.get_object_matrix(o))
+
+    # without matrices, in a single process
+    found = list(analyze_scenes(files[:2], processes=1))
+    assert all([mat is None for _, _, _, mat in found])
+    assert len(found) == sum([IdentifyObjects(load_matrix(f)[1]).num_objects() for f in files[:2]])
@@ -0,0 +1,129 @@
+# Meta-cognitive machines
+#
+# Tests of scene storage: memory-mapped text scenes and binary grids (.mcmg)
+# compared with load_matrix (the reference loader)
+#
+# Authors: {svc, lucy}@dmi.uns.ac.rs
+
+import numpy as np
+
+from Matrix import Grid, grid_from_lines, load_matrix, mat_to_str, as_sparse, EMPTY_CODE
+from SceneStorage import MappedScene, open_scene, load_sparse
+from SceneStorage import MCMG_EXTENSION, save_grid, load_grid, convert_text_to_mcmg, convert_mcmg_to_text
+from SceneStorage import grid_to_str, str_to_grid
+
+from helpers import pattern_files, scene_files, random_grid
+
+
+def write_scene(path, name, lines):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(name + "\n")
+        for line in lines:
+            f.write(line + "\n")
+
+    return str(path)
+
+
+def assert_same_sparse(a, b):
+    assert (a.dimx, a.dimy) == (b.dimx, b.dimy)
+    assert np.array_equal(a.ids, b.ids)
+    assert np.array_equal(a.xs, b.xs) and np.array_equal(a.ys, b.ys)
+    assert np.array_equal(a.codes.astype(np.int64), b.codes.astype(np.int64))
+
+
+def assert_mapped_matches_load_matrix(f):
+    lname, lmat = load_matrix(f)
+
+    name, scene = open_scene(f)
+    with scene:
+        assert name == lname == scene.name
+        assert (scene.dimx, scene.dimy) == (lmat.dimx, lmat.dimy)
+        assert mat_to_str(scene.to_grid()) == mat_to_str(lmat)
+        for i, codes in scene.rows():
+            assert np.array_equal(codes.astype(np.int64), lmat.data[i].astype(np.int64))
+
+    sname, sparse = load_sparse(f)
+    assert sname == lname
+    assert_same_sparse(sparse, as_sparse(lmat))
+
+
+def test_mapped_scenes_match_load_matrix():
+    for f in pattern_files() + scene_files():
+        assert_mapped_matches_load_matrix(f)
+
+
+# trailing whitespace, empty rows, unicode symbols and a missing final line break
+def test_mapped_scene_irregular_rows(tmp_path):
+    f = write_scene(tmp_path / "a.txt", "irregular", ["xx  ", "", "  šx\t", "x █ x"])
+    assert_mapped_matches_load_matrix(f)
+
+    f = str(tmp_path / "b.txt")
+    with open(f, "w") as fd:
+        fd.write("no_break\nx x\n xx")
+    assert_mapped_matches_load_matrix(f)
+
+
+def test_tiles_cover_the_scene():
+    for f in scene_files():
+        _, lmat = load_matrix(f)
+        with MappedScene(f) as scene:
+            data = np.full((scene.dimx, scene.dimy), EMPTY_CODE, dtype=np.int64)
+            for x0, y0, tile in scene.tiles(7, 5):
+                assert tile.dimx <= 7 and tile.dimy <= 5
+                data[x0:x0 + tile.dimx, y0:y0 + tile.dimy] = tile.data
+            assert np.array_equal(data, lmat.data.astype(np.int64))
+
+            # fields out of the scene are empty
+            tile = scene.tile(-2, -3, scene.dimx + 4, scene.dimy + 6)
+            assert np.array_equal(tile.data[2:-2, 3:-3].astype(np.int64), lmat.data.astype(np.int64))
+            assert np.count_nonzero(tile.data != EMPTY_CODE) == np.count_nonzero(lmat.data != EMPTY_CODE)
+
+
+def assert_same_grid(a, b):
+    assert (a.dimx, a.dimy) == (b.dimx, b.dimy)
+    assert np.array_equal(a.data.astype(np.int64), b.data.astype(np.int64))
+
+
+def test_mcmg_round_trip(tmp_path):
+    rng = np.random.default_rng(5)
+    grids = [load_matrix(f)[1] for f in pattern_files() + scene_files()]
+    grids += [random_grid(rng, 13, 29, p, "xyz") for p in [0.0, 0.3, 1.0]]
+    grids.append(grid_from_lines(["", "", ""]))
+
+    # wide codes and a symbol table larger than 256 entries (u16 symbol indices)
+    wide = np.full((20, 40), EMPTY_CODE, dtype=np.uint32)
+    wide[rng.random((20, 40)) < 0.7] = 0x100
+    wide.ravel()[:600] = 0x1000 + np.arange(600)
+    grids.append(Grid(wide))
+
+    for k, mat in enumerate(grids):
+        for compress in [True, False]:
+            f = str(tmp_path / ("g" + str(k) + MCMG_EXTENSION))
+            save_grid(f, mat, name="concept " + str(k), compress=compress)
+
+            name, grid = load_grid(f)
+            assert name == "concept " + str(k)
+            assert_same_grid(grid, mat)
+            assert load_matrix(f)[0] == name
+
+            sname, sparse = load_sparse(f)
+            assert sname == name
+            assert_same_sparse(sparse, as_sparse(mat))
+
+        assert_same_grid(str_to_grid(grid_to_str(mat, "s")), mat)
+
+
+def test_mcmg_text_conversion(tmp_path):
+    files = pattern_files() + scene_files()
+    files.append(write_scene(tmp_path / "u.txt", "unicode", ["šš  x", "", " █x█ "]))
+    for k, f in enumerate(files):
+        lname, lmat = load_matrix(f)
+        mcmg = convert_text_to_mcmg(f, str(tmp_path / ("c" + str(k) + MCMG_EXTENSION)))
+        name, grid = load_grid(mcmg)
+        assert name == lname
+        assert_same_grid(grid, lmat)
+
+        text = str(tmp_path / ("c" + str(k) + ".txt"))
+        convert_mcmg_to_text(mcmg, text)
+        assert load_matrix(text)[0] == lname
+        assert mat_to_str(load_matrix(text)[1]) == mat_to_str(lmat)